@@ -0,0 +1,275 @@
+"""
+読み取り専用APIの非同期版（ASGI サーバーで動かす）
+
+問い合わせが多い読み取りエンドポイントを async ビュー + 非同期ORMで実装し、
+独立したクエリは asyncio.gather でまとめて待つ。
+レスポンスは同期版（api/views.py, prediction/views.py）と同じ形。
+"""
+
+import asyncio
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import JsonResponse
+from rest_framework.authtoken.models import Token
+
+from prediction.follow_cache import afollowing_ids
+from prediction.models import Horse, Prediction, Race, UserPoint, UserProfile
+from .serializers import TimelinePredictionSerializer
+
+DEFAULT_PROFILE_IMAGE = "profile_images/default-image.jpg"
+
+
+async def _aget_user(request):
+    """トークン認証 → セッション認証の順でユーザーを取得する"""
+    auth = request.headers.get("Authorization", "").split()
+    if len(auth) == 2 and auth[0].lower() == "token":
+        try:
+            token = await Token.objects.select_related("user").aget(key=auth[1])
+        except Token.DoesNotExist:
+            return None
+        return token.user if token.user.is_active else None
+
+    user = await request.auser()
+    return user if user.is_authenticated else None
+
+
+def async_token_required(view):
+    """DRF の IsAuthenticated 相当（非同期ビュー用）"""
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user = await _aget_user(request)
+        if user is None:
+            return JsonResponse(
+                {"detail": "認証情報が含まれていません。"},
+                status=401,
+            )
+        request.user = user
+        return await view(request, *args, **kwargs)
+
+    return wrapper
+
+
+def _profile_image_url(request, profile, default=True):
+    if profile is not None and profile.profile_image:
+        return request.build_absolute_uri(profile.profile_image.url)
+    if default:
+        return request.build_absolute_uri(f"{settings.MEDIA_URL}{DEFAULT_PROFILE_IMAGE}")
+    return None
+
+
+@async_token_required
+async def races(request):
+    """レース一覧。get_races_api と同じ形"""
+    race_list = [race async for race in Race.objects.values("id", "name").order_by("id")]
+    return JsonResponse(race_list, safe=False)
+
+
+async def horses_by_race(request):
+    """馬一覧（レースIDで絞り込み）。get_horses_by_race と同じ形"""
+    race_id = request.GET.get("race_id")
+    if not race_id:
+        return JsonResponse([], safe=False)
+    horses = [
+        horse
+        async for horse in Horse.objects.filter(race_id=race_id).values("id", "name")
+    ]
+    return JsonResponse(horses, safe=False)
+
+
+@async_token_required
+async def timeline(request):
+    """フォロー中＋自分の予想タイムライン。PredictionViewSet.timeline と同じ形"""
+    user = request.user
+    following_ids = list(await afollowing_ids(user.id))
+
+    queryset = (
+        Prediction.objects.filter(user__id__in=following_ids + [user.id])
+        .select_related(
+            "race",
+            "first_position",
+            "second_position",
+            "third_position",
+            "user",
+            "user__userprofile",
+        )
+        .order_by("-created_at")
+    )
+    race_id = request.GET.get("race_id")
+    if race_id:
+        queryset = queryset.filter(race_id=race_id)
+
+    predictions = [prediction async for prediction in queryset]
+    serializer = TimelinePredictionSerializer(
+        predictions, many=True, context={"request": request}
+    )
+    return JsonResponse(serializer.data, safe=False)
+
+
+@async_token_required
+async def points_ranking(request):
+    """ポイントランキング（TOP 20）。的中率は UserPoint、予想数はプロフィールに保存した値"""
+    top = [
+        user_point
+        async for user_point in UserPoint.objects.select_related(
+            "user", "user__userprofile"
+        ).order_by("-points")[:20]
+    ]
+
+    rankings = []
+    for rank, user_point in enumerate(top, start=1):
+        user = user_point.user
+        profile = getattr(user, "userprofile", None)
+        rankings.append({
+            "rank": rank,
+            "user_id": user.id,
+            "username": user.username,
+            "profile_image_url": _profile_image_url(request, profile, default=False),
+            "points": user_point.points,
+            "hit_rate": user_point.hit_rate,
+            "predictions_count": profile.predictions_count if profile else 0,
+        })
+    return JsonResponse(rankings, safe=False)
+
+
+async def _profile_payload(request, user):
+    """プロフィール詳細（/api/users/me/profile/ と同じ形）。独立した集計は並行して待つ"""
+
+    # 件数はプロフィールに持っている値（prediction/profile_counters.py）、
+    # 的中率は採点のたびに UserPoint に保存している値
+    user_point, profile = await asyncio.gather(
+        UserPoint.objects.filter(user=user).only("points", "hit_rate").afirst(),
+        UserProfile.objects.filter(user=user).afirst(),
+    )
+
+    return {
+        "id": user.id,
+        "username": user.username,
+        "email": user.email,
+        "profile": {
+            "profile_image_url": _profile_image_url(request, profile),
+            "updated_at": profile.updated_at if profile else None,
+        },
+        **{name: getattr(profile, name, 0) for name in UserProfile.COUNTER_FIELDS},
+        "hit_rate": user_point.hit_rate if user_point else 0,
+        "points": user_point.points if user_point else 0,
+    }
+
+
+@async_token_required
+async def user_profile(request):
+    """現在のユーザーのプロフィール詳細"""
+    return JsonResponse(await _profile_payload(request, request.user))
+
+
+HOME_CACHE_VERSION_KEY = "home:version"
+
+
+def _home_cache_key(user_id, version):
+    return f"home:{version}:{user_id}"
+
+
+def invalidate_home(user_id=None):
+    """ホーム画面のキャッシュを破棄する（user_id 省略時は全ユーザー分）"""
+    if user_id is None:
+        cache.set(HOME_CACHE_VERSION_KEY, uuid.uuid4().hex, None)
+    else:
+        cache.delete(_home_cache_key(user_id, cache.get(HOME_CACHE_VERSION_KEY, 0)))
+
+
+async def _open_races():
+    """結果がまだ出ていないレース"""
+    return [
+        race
+        async for race in Race.objects.filter(raceresult__isnull=True)
+        .values("id", "name", "date", "location")
+        .order_by("date", "id")
+    ]
+
+
+async def _latest_results(user, limit):
+    """結果が出た自分の予想（新しい順）。/api/results/ と同じ形"""
+    queryset = (
+        Prediction.objects.filter(user=user, race__raceresult__isnull=False)
+        .select_related(
+            "race",
+            "race__raceresult__first_place",
+            "race__raceresult__second_place",
+            "race__raceresult__third_place",
+            "first_position",
+            "second_position",
+            "third_position",
+        )
+        .order_by("-race__raceresult__updated_at", "-id")[:limit]
+    )
+    predictions = [prediction async for prediction in queryset]
+    results = []
+    for prediction in predictions:
+        race_result = prediction.race.raceresult
+        results.append({
+            "id": prediction.id,
+            "race_name": prediction.race.name,
+            "race_location": prediction.race.location,
+            "predicted_1": prediction.first_position.name,
+            "predicted_2": prediction.second_position.name,
+            "predicted_3": prediction.third_position.name,
+            "actual_1": race_result.first_place.name if race_result.first_place else None,
+            "actual_2": race_result.second_place.name if race_result.second_place else None,
+            "actual_3": race_result.third_place.name if race_result.third_place else None,
+            "score": prediction.score,
+        })
+    return results
+
+
+async def _timeline_page(request, user, limit):
+    """タイムラインの先頭ページ"""
+    following_ids = list(await afollowing_ids(user.id))
+    queryset = (
+        Prediction.objects.filter(user_id__in=following_ids + [user.id])
+        .select_related(
+            "race",
+            "first_position",
+            "second_position",
+            "third_position",
+            "user",
+            "user__userprofile",
+        )
+        .order_by("-created_at")[:limit]
+    )
+    predictions = [prediction async for prediction in queryset]
+    return TimelinePredictionSerializer(
+        predictions, many=True, context={"request": request}
+    ).data
+
+
+@async_token_required
+async def home(request):
+    """
+    アプリ起動時のホーム画面用API
+    GET /api/async/home/
+
+    プロフィール・ポイント・的中率・受付中のレース・最新の結果・
+    タイムライン先頭ページを1レスポンスで返す（ユーザーごとに短時間キャッシュ）
+    """
+    user = request.user
+    key = _home_cache_key(user.id, await cache.aget(HOME_CACHE_VERSION_KEY, 0))
+    data = await cache.aget(key)
+    if data is None:
+        profile, open_races, latest_results, timeline_page = await asyncio.gather(
+            _profile_payload(request, user),
+            _open_races(),
+            _latest_results(user, settings.HOME_RESULTS_LIMIT),
+            _timeline_page(request, user, settings.HOME_TIMELINE_LIMIT),
+        )
+        data = {
+            "profile": profile,
+            "points": {"points": profile["points"], "hit_rate": profile["hit_rate"]},
+            "open_races": open_races,
+            "latest_results": latest_results,
+            "timeline": timeline_page,
+        }
+        await cache.aset(key, data, settings.HOME_CACHE_SECONDS)
+    return JsonResponse(data)
@@ -0,0 +1,93 @@
+"""
+?fields= / ?expand= によるレスポンスの絞り込み
+
+    GET /api/predictions/?fields=id,race,first_position,second_position,third_position
+    GET /api/predictions/?expand=first_position_detail,user
+
+- パラメータなし: これまでどおり全フィールドを返す
+- ?fields=: 指定したフィールドだけを返す
+- ?expand=: ネストしたオブジェクト（Meta.expandable_fields）を追加で返す。
+  ?fields= がなければ「ネスト以外の全フィールド + 指定したもの」
+- 返さないフィールドのための JOIN / prefetch は行わない
+"""
+
+
+def _parse_list(value):
+    if value is None:
+        return None
+    return [name.strip() for name in value.split(",") if name.strip()]
+
+
+class DynamicFieldsMixin:
+    """
+    シリアライザー用。Meta に以下を定義する
+
+    expandable_fields: ?expand= で要求されたときだけ返すフィールド
+    select_related_fields: フィールド名 → 必要な select_related
+    prefetch_related_fields: フィールド名 → 必要な prefetch_related
+    """
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        selected = set(self.selected_fields(fields, expand))
+        for name in list(self.fields):
+            if name not in selected:
+                self.fields.pop(name)
+
+    @classmethod
+    def selected_fields(cls, fields=None, expand=None):
+        declared = list(cls.Meta.fields)
+        if fields is None and expand is None:
+            return declared
+
+        expandable = set(getattr(cls.Meta, "expandable_fields", ()))
+        if fields is None:
+            chosen = {name for name in declared if name not in expandable}
+        else:
+            chosen = set(fields)
+        chosen |= set(expand or ()) & expandable
+        return [name for name in declared if name in chosen]
+
+    @classmethod
+    def related_lookups(cls, fields=None, expand=None):
+        """選ばれたフィールドに必要な (select_related, prefetch_related)"""
+        selected = cls.selected_fields(fields, expand)
+        select_map = getattr(cls.Meta, "select_related_fields", {})
+        prefetch_map = getattr(cls.Meta, "prefetch_related_fields", {})
+        select_related = {lookup for name in selected for lookup in select_map.get(name, ())}
+        prefetch_related = {lookup for name in selected for lookup in prefetch_map.get(name, ())}
+        return sorted(select_related), sorted(prefetch_related)
+
+
+class SparseFieldsetMixin:
+    """
+    ViewSet 用。GET のときクエリパラメータをシリアライザーに渡し、
+    クエリセットの JOIN / prefetch を要求されたフィールドに合わせる
+    """
+
+    def _sparse_params(self):
+        if self.request is None or self.request.method != "GET":
+            return {}
+        return {
+            "fields": _parse_list(self.request.query_params.get("fields")),
+            "expand": _parse_list(self.request.query_params.get("expand")),
+        }
+
+    def get_serializer(self, *args, **kwargs):
+        if issubclass(self.get_serializer_class(), DynamicFieldsMixin):
+            for key, value in self._sparse_params().items():
+                kwargs.setdefault(key, value)
+        return super().get_serializer(*args, **kwargs)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        serializer_class = self.get_serializer_class()
+        if not issubclass(serializer_class, DynamicFieldsMixin):
+            return queryset
+
+        select_related, prefetch_related = serializer_class.related_lookups(**self._sparse_params())
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        return queryset
@@ -14,6 +14,7 @@ from prediction.models import (
     UserPoint,
     UserProfile,
 )
+from .mixins import DynamicFieldsMixin
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -46,15 +47,17 @@ class HorseSerializer(serializers.ModelSerializer):
         read_only_fields = ("id", "race")
 
 
-class RaceSerializer(serializers.ModelSerializer):
+class RaceSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     horses = HorseSerializer(many=True, read_only=True)
 
     class Meta:
         model = Race
         fields = ("id", "name", "horses")
+        expandable_fields = ("horses",)
+        prefetch_related_fields = {"horses": ("horses",)}
 
 
-class PredictionSerializer(serializers.ModelSerializer):
+class PredictionSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     race_name = serializers.CharField(source="race.name", read_only=True)
     first_position_detail = HorseSerializer(source="first_position", read_only=True)
@@ -77,9 +80,34 @@ class PredictionSerializer(serializers.ModelSerializer):
             "user",
         )
         read_only_fields = ("id", "created_at", "user")
+        expandable_fields = (
+            "first_position_detail",
+            "second_position_detail",
+            "third_position_detail",
+            "user",
+        )
+        select_related_fields = {
+            "race_name": ("race",),
+            "first_position_detail": ("first_position",),
+            "second_position_detail": ("second_position",),
+            "third_position_detail": ("third_position",),
+            "user": ("user",),
+        }
+
+    def validate(self, attrs):
+        race = attrs.get("race", getattr(self.instance, "race", None))
+        horses = [
+            attrs.get(field, getattr(self.instance, field, None))
+            for field in ("first_position", "second_position", "third_position")
+        ]
+        if len({horse.id for horse in horses if horse}) != len(horses):
+            raise serializers.ValidationError("同じ馬を複数回選択できません。")
+        if any(horse.race_id != race.id for horse in horses):
+            raise serializers.ValidationError("指定したレースに出走していない馬が含まれています。")
+        return attrs
 
 
-class UserProfileSerializer(serializers.ModelSerializer):
+class UserProfileSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     profile_image_url = serializers.SerializerMethodField()
 
@@ -87,6 +115,8 @@ class UserProfileSerializer(serializers.ModelSerializer):
         model = UserProfile
         fields = ("id", "user", "profile_image", "profile_image_url", "updated_at")
         read_only_fields = ("id", "user", "updated_at")
+        expandable_fields = ("user",)
+        select_related_fields = {"user": ("user",)}
 
     def get_profile_image_url(self, obj):
         request = self.context.get("request")
@@ -97,7 +127,7 @@ class UserProfileSerializer(serializers.ModelSerializer):
         return None
 
 
-class FollowSerializer(serializers.ModelSerializer):
+class FollowSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     follower = UserSerializer(read_only=True)
     followed = serializers.PrimaryKeyRelatedField(queryset=User.objects.all())
 
@@ -105,6 +135,8 @@ class FollowSerializer(serializers.ModelSerializer):
         model = Follow
         fields = ("id", "follower", "followed")
         read_only_fields = ("id", "follower")
+        expandable_fields = ("follower",)
+        select_related_fields = {"follower": ("follower",)}
 
     def validate_followed(self, value):
         request = self.context.get("request")
@@ -113,25 +145,43 @@ class FollowSerializer(serializers.ModelSerializer):
         return value
 
 
-class PredictionGroupSerializer(serializers.ModelSerializer):
+class PredictionGroupSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     members = UserSerializer(many=True, read_only=True)
+    # 一覧用の集計（prediction/membership.py の groups_with_activity が付ける）
+    member_count = serializers.IntegerField(read_only=True)
+    unread_count = serializers.IntegerField(read_only=True)
+    last_message = serializers.SerializerMethodField()
 
     class Meta:
         model = PredictionGroup
-        fields = ("id", "name", "members")
+        fields = ("id", "name", "members", "member_count", "unread_count", "last_message")
         read_only_fields = ("id",)
+        expandable_fields = ("members",)
+        prefetch_related_fields = {"members": ("members",)}
+
+    def get_last_message(self, obj):
+        if getattr(obj, "last_message_id", None) is None:
+            return None
+        return {
+            "id": obj.last_message_id,
+            "content": obj.last_message_content,
+            "sender": obj.last_message_sender,
+            "timestamp": obj.last_message_at,
+        }
 
 
-class GroupMessageSerializer(serializers.ModelSerializer):
+class GroupMessageSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     sender = UserSerializer(read_only=True)
 
     class Meta:
         model = GroupMessage
         fields = ("id", "group", "sender", "content", "timestamp")
         read_only_fields = ("id", "sender", "timestamp")
+        expandable_fields = ("sender",)
+        select_related_fields = {"sender": ("sender",)}
 
 
-class GroupPredictionSerializer(serializers.ModelSerializer):
+class GroupPredictionSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     race_name = serializers.CharField(source="race.name", read_only=True)
 
@@ -147,11 +197,14 @@ class GroupPredictionSerializer(serializers.ModelSerializer):
             "second_position",
             "third_position",
             "submitted_at",
+            "score",
         )
-        read_only_fields = ("id", "user", "submitted_at")
+        read_only_fields = ("id", "user", "submitted_at", "score")
+        expandable_fields = ("user",)
+        select_related_fields = {"user": ("user",), "race_name": ("race",)}
 
 
-class RaceResultSerializer(serializers.ModelSerializer):
+class RaceResultSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = RaceResult
         fields = (
@@ -165,13 +218,15 @@ class RaceResultSerializer(serializers.ModelSerializer):
         read_only_fields = ("id", "updated_at")
 
 
-class UserPointSerializer(serializers.ModelSerializer):
+class UserPointSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
 
     class Meta:
         model = UserPoint
         fields = ("id", "user", "points")
         read_only_fields = ("id", "user")
+        expandable_fields = ("user",)
+        select_related_fields = {"user": ("user",)}
 
 class TimelinePredictionSerializer(serializers.ModelSerializer):
     race_name = serializers.CharField(source="race.name", read_only=True)
@@ -0,0 +1,39 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from prediction.models import Follow, Prediction, Race, RaceResult, UserPoint, UserProfile
+from prediction.signals import predictions_bulk_created, races_scored
+from .async_views import invalidate_home
+
+
+@receiver([post_save, post_delete], sender=Prediction)
+@receiver([post_save, post_delete], sender=UserPoint)
+@receiver([post_save, post_delete], sender=UserProfile)
+def invalidate_user_home(sender, instance, **kwargs):
+    """本人のホーム画面キャッシュを破棄"""
+    invalidate_home(instance.user_id)
+
+
+@receiver(predictions_bulk_created)
+def invalidate_bulk_submitter_home(sender, user, **kwargs):
+    """一括投稿した本人のホーム画面キャッシュを破棄"""
+    invalidate_home(user.id)
+
+
+@receiver([post_save, post_delete], sender=Follow)
+def invalidate_follower_home(sender, instance, **kwargs):
+    """フォローした側のタイムラインが変わる"""
+    invalidate_home(instance.follower_id)
+
+
+@receiver([post_save, post_delete], sender=Race)
+@receiver([post_save, post_delete], sender=RaceResult)
+def invalidate_all_homes(sender, instance, **kwargs):
+    """受付中のレース・結果は全員に関わる"""
+    invalidate_home()
+
+
+@receiver(races_scored)
+def invalidate_homes_after_scoring(sender, **kwargs):
+    """採点でポイント・最新の結果が変わる（一括取り込みでは post_save が飛ばない）"""
+    invalidate_home()
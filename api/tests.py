@@ -1,3 +1,322 @@
-from django.test import TestCase
+import io
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, router
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from keiba_battle.routers import REPLICA_DB_ALIAS, ReplicaRoutingMiddleware
+from prediction.models import ChangeLog, Horse, IdempotencyKey, Prediction, Race, RaceResult, UserPoint, UserProfile
+
+
+def make_race(name, horses=5):
+    """出走馬つきのレース"""
+    race = Race.objects.create(name=name)
+    return race, [Horse.objects.create(name=f"{name}の馬{i}", race=race) for i in range(1, horses + 1)]
+
+
+class ReplicaRoutingTests(SimpleTestCase):
+    """読み取りレプリカへの振り分け（keiba_battle/routers.py）"""
+
+    def setUp(self):
+        # レプリカがある構成（接続はしないので、設定に名前があればよい）
+        databases = mock.patch.dict(settings.DATABASES, {REPLICA_DB_ALIAS: settings.DATABASES[DEFAULT_DB_ALIAS]})
+        databases.start()
+        self.addCleanup(databases.stop)
+        cache.clear()
+        self.factory = RequestFactory()
+
+    def handler(self, write=False):
+        """読み取り先（と書き込み先）を記録するビューの代わり"""
+        used = []
+
+        def get_response(request):
+            if write:
+                used.append(("write", router.db_for_write(User)))
+            used.append(("read", router.db_for_read(User)))
+            return "response"
+
+        return get_response, used
+
+    def test_get_reads_from_replica(self):
+        get_response, used = self.handler()
+        ReplicaRoutingMiddleware(get_response)(self.factory.get("/api/results/"))
+        self.assertEqual(used, [("read", REPLICA_DB_ALIAS)])
+
+    def test_post_reads_and_writes_primary(self):
+        get_response, used = self.handler(write=True)
+        ReplicaRoutingMiddleware(get_response)(self.factory.post("/api/predictions/"))
+        self.assertEqual(used, [("write", DEFAULT_DB_ALIAS), ("read", DEFAULT_DB_ALIAS)])
+
+    def test_reads_after_write_in_same_request_use_primary(self):
+        get_response, used = self.handler(write=True)
+        ReplicaRoutingMiddleware(get_response)(self.factory.get("/api/results/"))
+        self.assertEqual(used, [("write", DEFAULT_DB_ALIAS), ("read", DEFAULT_DB_ALIAS)])
+
+    def test_sticky_after_write(self):
+        credential = {"HTTP_AUTHORIZATION": "Token abc"}
+        write, _ = self.handler(write=True)
+        ReplicaRoutingMiddleware(write)(self.factory.post("/api/predictions/", **credential))
+
+        get_response, used = self.handler()
+        middleware = ReplicaRoutingMiddleware(get_response)
+        middleware(self.factory.get("/api/predictions/", **credential))
+        # 書き込んでいない別のユーザーはレプリカのまま
+        middleware(self.factory.get("/api/predictions/", HTTP_AUTHORIZATION="Token other"))
+        self.assertEqual(used, [("read", DEFAULT_DB_ALIAS), ("read", REPLICA_DB_ALIAS)])
+
+    def test_sticky_expires(self):
+        credential = {"HTTP_AUTHORIZATION": "Token abc"}
+        write, _ = self.handler(write=True)
+        with self.settings(REPLICA_STICKY_SECONDS=-1):  # すぐに期限切れ
+            ReplicaRoutingMiddleware(write)(self.factory.post("/api/predictions/", **credential))
+
+        get_response, used = self.handler()
+        ReplicaRoutingMiddleware(get_response)(self.factory.get("/api/predictions/", **credential))
+        self.assertEqual(used, [("read", REPLICA_DB_ALIAS)])
+
+    def test_async_path(self):
+        used = []
+
+        async def get_response(request):
+            used.append(router.db_for_read(User))
+            if request.method == "POST":
+                used.append(router.db_for_write(User))
+            return "response"
+
+        middleware = ReplicaRoutingMiddleware(get_response)
+        credential = {"HTTP_AUTHORIZATION": "Token async"}
+        async_to_sync(middleware)(self.factory.get("/api/async/home/", **credential))
+        async_to_sync(middleware)(self.factory.post("/api/async/home/", **credential))
+        async_to_sync(middleware)(self.factory.get("/api/async/home/", **credential))
+        self.assertEqual(used, [REPLICA_DB_ALIAS, DEFAULT_DB_ALIAS, DEFAULT_DB_ALIAS, DEFAULT_DB_ALIAS])
+
+    def test_outside_requests_use_primary(self):
+        self.assertEqual(router.db_for_read(User), DEFAULT_DB_ALIAS)
+        self.assertEqual(router.db_for_write(User), DEFAULT_DB_ALIAS)
+
+    def test_without_replica_everything_uses_primary(self):
+        del settings.DATABASES[REPLICA_DB_ALIAS]
+        get_response, used = self.handler()
+        ReplicaRoutingMiddleware(get_response)(self.factory.get("/api/results/"))
+        self.assertEqual(used, [("read", DEFAULT_DB_ALIAS)])
+
+    def test_database_cache_uses_primary(self):
+        cache_model = mock.Mock()
+        cache_model._meta.app_label = "django_cache"
+        reads = []
+
+        def get_response(request):
+            router.db_for_write(cache_model)
+            reads.append(router.db_for_read(cache_model))
+            reads.append(router.db_for_read(User))
+            return "response"
+
+        ReplicaRoutingMiddleware(get_response)(self.factory.get("/api/results/"))
+        # キャッシュへの書き込みでプライマリに固定しない
+        self.assertEqual(reads, [DEFAULT_DB_ALIAS, REPLICA_DB_ALIAS])
+
+
+class BulkPredictionTests(TestCase):
+    """開催まるごとの予想の一括投稿（/api/predictions/bulk/）"""
+
+    url = "/api/predictions/bulk/"
+
+    def setUp(self):
+        self.user = User.objects.create_user("bulk")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.races = [make_race(f"レース{i}") for i in range(3)]
+
+    def pick(self, n, order=(0, 1, 2), as_str=False):
+        race, horses = self.races[n]
+        ids = [race.id] + [horses[i].id for i in order]
+        if as_str:
+            ids = [str(value) for value in ids]
+        return dict(zip(("race", "first_position", "second_position", "third_position"), ids))
+
+    def post(self, items, key=None):
+        headers = {"HTTP_IDEMPOTENCY_KEY": key} if key else {}
+        return self.client.post(self.url, {"predictions": items}, format="json", **headers)
+
+    def test_partial_success(self):
+        response = self.post([self.pick(0), {**self.pick(1), "race": self.races[2][0].id}, self.pick(2)])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual((response.data["created"], response.data["failed"]), (2, 1))
+        self.assertIn("error", response.data["results"][1])
+        self.assertEqual(Prediction.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(UserProfile.objects.get(user=self.user).predictions_count, 2)
+
+    def test_replay_returns_first_response(self):
+        first = self.post([self.pick(0), self.pick(1)], key="meeting-1")
+        # ID を文字列で送り直しても同じ内容として扱う
+        replay = self.post([self.pick(0, as_str=True), self.pick(1, as_str=True)], key="meeting-1")
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual((replay.status_code, replay.data), (201, first.data))
+        self.assertEqual(Prediction.objects.filter(user=self.user).count(), 2)
+
+    def test_same_key_with_different_predictions(self):
+        self.post([self.pick(0)], key="meeting-1")
+        response = self.post([self.pick(0, order=(2, 1, 0))], key="meeting-1")
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(
+            list(Prediction.objects.filter(user=self.user).values_list("first_position_id", flat=True)),
+            [self.races[0][1][0].id],
+        )
+
+    def test_keys_are_per_user(self):
+        self.post([self.pick(0)], key="meeting-1")
+        other = User.objects.create_user("other")
+        self.client.force_authenticate(other)
+        response = self.post([self.pick(0, order=(2, 1, 0))], key="meeting-1")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(IdempotencyKey.objects.filter(key="meeting-1").count(), 2)
+
+    def test_long_key_is_rejected(self):
+        response = self.post([self.pick(0)], key="k" * 65)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Prediction.objects.exists())
+        self.assertEqual(self.post([self.pick(0)], key="k" * 64).status_code, 201)
+
+
+class ResultsListTests(TestCase):
+    """予想結果一覧（/api/results/）は保存した得点を返す"""
+
+    def test_shows_stored_score(self):
+        user = User.objects.create_user("results")
+        race, horses = make_race("ジャパンC")
+        Prediction.objects.create(
+            user=user, race=race, first_position=horses[0], second_position=horses[1], third_position=horses[2]
+        )
+        RaceResult.objects.create(race=race, first_place=horses[0], second_place=horses[1], third_place=horses[2])
+
+        client = APIClient()
+        client.force_authenticate(user)
+        # 採点し直すまではルールを変えてもポイントと同じ得点のまま
+        with self.settings(SCORING_RULES={"exact": (10, 5, 1)}):
+            response = client.get("/api/results/")
+        self.assertEqual([row["score"] for row in response.data], [6])
+        self.assertEqual(UserPoint.objects.get(user=user).points, 6)
+
+
+class ChangeFeedTests(TestCase):
+    """差分同期（/api/changes/）と変更ログの圧縮"""
+
+    def setUp(self):
+        self.user = User.objects.create_user("sync")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_race(self, name):
+        # seq は記録のコミット後に振られる
+        with self.captureOnCommitCallbacks(execute=True):
+            return Race.objects.create(name=name)
+
+    def poll(self, since):
+        response = self.client.get("/api/changes/", {"since": since})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_changes_in_commit_order(self):
+        first = self.create_race("first")
+        data = self.poll(0)
+        self.assertEqual([(change["type"], change["id"]) for change in data["changes"]], [("race", first.id)])
+        since = data["next"]
+
+        # seq がまだない行（コミット後に seq を振る前に落ちたなど）は配信せず、読み取りでは振らない
+        late = Race.objects.create(name="late")
+        pending = ChangeLog.objects.get(kind="race", object_id=late.id)
+        self.assertEqual(self.poll(since)["changes"], [])
+        pending.refresh_from_db()
+        self.assertIsNone(pending.seq)
+
+        # 次に seq を振るときに、配信済みの位置より後ろに入る
+        second = self.create_race("second")
+        data = self.poll(since)
+        self.assertEqual([change["id"] for change in data["changes"]], [late.id, second.id])
+        self.assertEqual([change["data"]["name"] for change in data["changes"]], ["late", "second"])
+
+    def test_only_own_predictions(self):
+        race, horses = make_race("レース")
+        other = User.objects.create_user("other")
+        with self.captureOnCommitCallbacks(execute=True):
+            for user in (self.user, other):
+                Prediction.objects.create(
+                    user=user, race=race,
+                    first_position=horses[0], second_position=horses[1], third_position=horses[2],
+                )
+        predictions = [change for change in self.poll(0)["changes"] if change["type"] == "prediction"]
+        self.assertEqual([change["id"] for change in predictions], [Prediction.objects.get(user=self.user).id])
+
+    def test_update_then_delete_is_served_as_delete(self):
+        race = self.create_race("消えるレース")
+        with self.captureOnCommitCallbacks(execute=True):
+            race.name = "名前を変更"
+            race.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            race.delete()
+        changes = [change for change in self.poll(0)["changes"] if change["type"] == "race"]
+        self.assertEqual([(change["op"], "data" in change) for change in changes], [(ChangeLog.DELETE, False)])
+
+    def test_compaction_keeps_latest_by_seq(self):
+        race = self.create_race("圧縮")
+        ChangeLog.objects.filter(kind="race").delete()
+        # id は小さいがあとからコミットされた（seq が大きい）行を残す
+        committed_late = ChangeLog.objects.create(kind="race", object_id=race.id, op=ChangeLog.DELETE, seq=11)
+        ChangeLog.objects.create(kind="race", object_id=race.id, op=ChangeLog.UPSERT, seq=10)
+        # seq のない行には先に seq を振る
+        unassigned = ChangeLog.objects.create(kind="horse", object_id=1, op=ChangeLog.DELETE)
+
+        call_command("compact_change_log", stdout=io.StringIO())
+
+        self.assertEqual(
+            list(ChangeLog.objects.filter(kind="race").values_list("id", "op")),
+            [(committed_late.id, ChangeLog.DELETE)],
+        )
+        unassigned.refresh_from_db()
+        self.assertGreater(unassigned.seq, 11)
+
+
+class RankingTests(TestCase):
+    """ランキングは採点で保存した的中率・プロフィールの予想数を読む（同期版・非同期版で同じ）"""
+
+    def setUp(self):
+        self.users = []
+        for name, points, hit_rate, predictions_count in [
+            ("high", 30, 20.0, 5), ("accurate", 10, 80.0, 3), ("few", 50, 100.0, 2),
+        ]:
+            user = User.objects.create_user(name)
+            UserPoint.objects.create(user=user, points=points, hit_rate=hit_rate)
+            UserProfile.objects.filter(user=user).update(predictions_count=predictions_count)
+            self.users.append(user)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.get(pk=self.users[0].pk))
+
+    def rows(self, response, *fields):
+        self.assertEqual(response.status_code, 200)
+        return [tuple(row[field] for field in fields) for row in response.json()]
+
+    def test_hit_rate_ranking(self):
+        # 予想が3件未満のユーザーは対象外
+        rows = self.rows(self.client.get("/api/rankings/hit-rate/"), "rank", "username", "hit_rate", "points")
+        self.assertEqual(rows, [(1, "accurate", 80.0, 10), (2, "high", 20.0, 30)])
+
+    def test_points_ranking_matches_async(self):
+        fields = ("rank", "username", "points", "hit_rate", "predictions_count")
+        rows = self.rows(self.client.get("/api/rankings/points/"), *fields)
+        self.assertEqual(rows, [(1, "few", 50, 100.0, 2), (2, "high", 30, 20.0, 5), (3, "accurate", 10, 80.0, 3)])
+
+        token = Token.objects.create(user=self.users[0])
+        async_client = Client(HTTP_AUTHORIZATION=f"Token {token.key}")
+        self.assertEqual(self.rows(async_client.get("/api/async/rankings/points/"), *fields), rows)
+
+    def test_profile_reads_stored_hit_rate(self):
+        data = self.client.get("/api/users/me/profile/").data
+        self.assertEqual((data["points"], data["hit_rate"], data["predictions_count"]), (30, 20.0, 5))
+        self.assertEqual(self.client.get("/api/user-points/").data, {"points": 30, "hit_rate": 20.0})
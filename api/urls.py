@@ -1,5 +1,5 @@
 from django.urls import include, path
-from . import views
+from . import async_views, views
 from rest_framework.routers import DefaultRouter
 
 from .views import (
@@ -32,11 +32,25 @@ urlpatterns = [
     path("auth/signup/", SignUpView.as_view(), name="api-signup"),
     path("auth/login/", CustomAuthToken.as_view(), name="api-login"),
     path("auth/logout/", LogoutView.as_view(), name="api-logout"),
+    path('users/me/', views.delete_account, name='delete-account'),
     path('users/me/profile/', views.user_profile, name='user-profile'),
     path('results/', views.results_list, name='results-list'),
     path('user-points/', views.user_points, name='user-points'),
     path('rankings/points/', views.points_ranking, name='points-ranking'),
     path('rankings/hit-rate/', views.hit_rate_ranking, name='hit-rate-ranking'),
+    path('rankings/friends/', views.friends_ranking, name='friends-ranking'),
+    path('rankings/me/', views.my_rank, name='my-rank'),
+    path('rankings/around/', views.ranking_around_me, name='ranking-around-me'),
+    path('rankings/period/', views.ranking_for_period, name='ranking-for-period'),
+    path('changes/', views.changes, name='changes'),
+    path('scoring/backtest/', views.scoring_backtest, name='scoring-backtest'),
+    # 非同期版（ASGI サーバー向け）
+    path("async/races/", async_views.races, name="async-races"),
+    path("async/horses/", async_views.horses_by_race, name="async-horses"),
+    path("async/timeline/", async_views.timeline, name="async-timeline"),
+    path("async/rankings/points/", async_views.points_ranking, name="async-points-ranking"),
+    path("async/users/me/profile/", async_views.user_profile, name="async-user-profile"),
+    path("async/home/", async_views.home, name="async-home"),
     path("", include(router.urls)),
 ]
 
@@ -1,5 +1,11 @@
+import json
+from collections import defaultdict
+from datetime import date, timedelta
+
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db.models import Prefetch
+from django.db.models import Q
+from django.shortcuts import get_object_or_404
 from rest_framework import generics, permissions, viewsets
 from rest_framework.exceptions import PermissionDenied
 from rest_framework.authtoken.models import Token
@@ -9,7 +15,21 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from prediction.backtest import backtest
+from prediction.change_log import fetch_rows
+from prediction.consensus import prediction_picks, race_consensus
+from prediction.deletion import request_user_deletion
+from prediction.result_import import ResultImportError, import_results, parse_results
+from prediction.follow_cache import following_ids
+from prediction.group_standings import group_ranking
+from prediction.leaderboard import get_leaderboard
+from prediction.membership import groups_with_activity, is_member, mark_read
+from prediction.rankings import friends_ranking as ranking_among_friends
+from prediction.rankings import period_bounds, period_ranking
+from prediction.scoring import ScoringRules
+from prediction.simulation import simulate_prediction
 from prediction.models import (
+    ChangeLog,
     Follow,
     GroupMessage,
     GroupPrediction,
@@ -20,6 +40,7 @@ from prediction.models import (
     UserPoint,
     UserProfile,
 )
+from .mixins import SparseFieldsetMixin
 from .serializers import (
     FollowSerializer,
     GroupMessageSerializer,
@@ -67,30 +88,28 @@ class SignUpView(generics.CreateAPIView):
     serializer_class = UserRegistrationSerializer
 
 
-class RaceViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Race.objects.prefetch_related(
-        Prefetch("horses")
-    )
+class RaceViewSet(SparseFieldsetMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = RaceSerializer
     permission_classes = [permissions.AllowAny]
 
+    # JOIN / prefetch は ?fields= / ?expand= に応じて SparseFieldsetMixin が付ける
     def get_queryset(self):
-        return Race.objects.prefetch_related("horses").order_by("name")
+        return Race.objects.order_by("name")
+
+    @action(detail=True, methods=["get"], url_path="consensus")
+    def consensus(self, request, pk=None):
+        """みんなの予想（馬ごとの着順別の予想数・3着以内に選んだ割合・いちばん人気の3連単）"""
+        race = self.get_object()
+        return Response(race_consensus(race.id))
 
 
-class PredictionViewSet(viewsets.ModelViewSet):
+class PredictionViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     serializer_class = PredictionSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
         return (
             Prediction.objects.filter(user=self.request.user)
-            .select_related(
-                "race",
-                "first_position",
-                "second_position",
-                "third_position",
-            )
             .order_by("-created_at")
         )
 
@@ -105,10 +124,7 @@ class PredictionViewSet(viewsets.ModelViewSet):
     )
     def timeline(self, request):
         race_id = request.query_params.get("race_id")
-        following_ids = list(
-            request.user.following.values_list("followed_id", flat=True)
-        )
-        user_ids = following_ids + [request.user.id]
+        user_ids = list(following_ids(request.user.id)) + [request.user.id]
 
         queryset = (
             Prediction.objects.filter(user__id__in=user_ids)
@@ -131,21 +147,28 @@ class PredictionViewSet(viewsets.ModelViewSet):
         )
         return Response(serializer.data)
 
+    @action(detail=True, methods=["get"], url_path="simulation")
+    def simulation(self, request, pk=None):
+        """みんなの予想から着順を抽選した、この予想の期待得点・的中確率・勝率"""
+        prediction = self.get_object()
+        result = simulate_prediction(prediction.race_id, prediction_picks(prediction)[1])
+        if result is None:
+            return Response({"error": "出走馬が3頭未満のレースはシミュレーションできません"}, status=400)
+        return Response({"prediction": prediction.id, "race": prediction.race_id, **result})
+
 
-class FollowViewSet(viewsets.ModelViewSet):
+class FollowViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     serializer_class = FollowSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return Follow.objects.filter(follower=self.request.user).select_related(
-            "followed"
-        )
+        return Follow.objects.filter(follower=self.request.user)
 
     def perform_create(self, serializer):
         serializer.save(follower=self.request.user)
 
 
-class UserProfileViewSet(viewsets.ModelViewSet):
+class UserProfileViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     serializer_class = UserProfileSerializer
     permission_classes = [permissions.IsAuthenticated]
 
@@ -153,12 +176,14 @@ class UserProfileViewSet(viewsets.ModelViewSet):
         return UserProfile.objects.filter(user=self.request.user)
 
 
-class PredictionGroupViewSet(viewsets.ModelViewSet):
+class PredictionGroupViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     serializer_class = PredictionGroupSerializer
     permission_classes = [permissions.IsAuthenticated]
+    lookup_value_regex = r"\d+"
 
     def get_queryset(self):
-        return self.request.user.prediction_groups.all().prefetch_related("members")
+        # メンバー数・未読数・最新のメッセージ付き（1クエリ）
+        return groups_with_activity(self.request.user)
 
     def perform_create(self, serializer):
         group = serializer.save()
@@ -166,60 +191,101 @@ class PredictionGroupViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=["post"], permission_classes=[permissions.IsAuthenticated])
     def messages(self, request, pk=None):
-        group = self.get_object()
-        if request.user not in group.members.all():
+        if not is_member(request.user.id, int(pk)):
             return Response({"detail": "グループメンバーのみ送信できます。"}, status=403)
+        group = get_object_or_404(PredictionGroup, pk=pk)
         serializer = GroupMessageSerializer(data=request.data, context={"request": request})
         if serializer.is_valid():
             serializer.save(group=group, sender=request.user)
             return Response(serializer.data, status=201)
         return Response(serializer.errors, status=400)
 
+    @action(detail=True, methods=["post"], permission_classes=[permissions.IsAuthenticated])
+    def read(self, request, pk=None):
+        """グループのメッセージを最新まで既読にする"""
+        if not is_member(request.user.id, int(pk)):
+            return Response({"detail": "グループメンバーのみ操作できます。"}, status=403)
+        mark_read(request.user, int(pk))
+        return Response(status=204)
+
+    @action(detail=True, methods=["get"], permission_classes=[permissions.IsAuthenticated])
+    def standings(self, request, pk=None):
+        """グループ内の順位表（グループ予想の合計得点の高い順）"""
+        if not is_member(request.user.id, int(pk)):
+            return Response({"detail": "グループメンバーのみ閲覧できます。"}, status=403)
+        return Response([
+            {
+                "rank": standing.rank,
+                "user_id": standing.user_id,
+                "username": standing.user.username,
+                "points": standing.points,
+                "scored_predictions": standing.scored_predictions,
+            }
+            for standing in group_ranking(int(pk))
+        ])
+
 
-class GroupPredictionViewSet(viewsets.ModelViewSet):
+class GroupPredictionViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     serializer_class = GroupPredictionSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return GroupPrediction.objects.filter(group__members=self.request.user).select_related(
-            "group",
-            "race",
-            "user",
-        )
+        return GroupPrediction.objects.filter(group__members=self.request.user)
 
     def perform_create(self, serializer):
         group = serializer.validated_data["group"]
-        if self.request.user not in group.members.all():
+        if not is_member(self.request.user.id, group.id):
             raise PermissionDenied("グループメンバーのみ共有できます。")
         serializer.save(user=self.request.user)
 
 
-class GroupMessageViewSet(viewsets.ModelViewSet):
+class GroupMessageViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     serializer_class = GroupMessageSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return GroupMessage.objects.filter(group__members=self.request.user).select_related(
-            "group",
-            "sender",
-        )
+        return GroupMessage.objects.filter(group__members=self.request.user)
 
     def perform_create(self, serializer):
         group = serializer.validated_data["group"]
-        if self.request.user not in group.members.all():
+        if not is_member(self.request.user.id, group.id):
             raise PermissionDenied("グループメンバーのみ送信できます。")
         serializer.save(sender=self.request.user)
 
 
-class RaceResultViewSet(viewsets.ReadOnlyModelViewSet):
+class RaceResultViewSet(SparseFieldsetMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = RaceResultSerializer
     permission_classes = [permissions.IsAuthenticated]
-    queryset = RaceResult.objects.select_related(
-        "race", "first_place", "second_place", "third_place"
-    )
-
+    queryset = RaceResult.objects.all()
 
-class UserPointViewSet(viewsets.ReadOnlyModelViewSet):
+    @action(
+        detail=False,
+        methods=["post"],
+        url_path="import",
+        permission_classes=[permissions.IsAdminUser],
+    )
+    def bulk_import(self, request):
+        """
+        開催まるごとの結果を取り込み、まとめて採点する（スタッフのみ）
+        JSON: {"results": [{"race", "first_place", "second_place", "third_place"}, ...]}
+        または CSV / JSON ファイルを file で送信（レース・馬は ID でも名前でも可）
+        """
+        upload = request.FILES.get("file")
+        try:
+            if upload is not None:
+                fmt = "json" if upload.name.lower().endswith(".json") else "csv"
+                rows = parse_results(upload.read().decode("utf-8-sig"), fmt)
+            else:
+                rows = parse_results(json.dumps(request.data), "json")
+            summary = import_results(rows)
+        except UnicodeDecodeError:
+            return Response({"detail": "ファイルは UTF-8 で送信してください。"}, status=400)
+        except ResultImportError as exc:
+            return Response({"errors": exc.errors}, status=400)
+        return Response(summary)
+
+
+class UserPointViewSet(SparseFieldsetMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = UserPointSerializer
     permission_classes = [permissions.IsAuthenticated]
 
@@ -227,77 +293,22 @@ class UserPointViewSet(viewsets.ReadOnlyModelViewSet):
         return UserPoint.objects.filter(user=self.request.user)
 
 
-
-
-def calculate_hit_rate(user):
-    """
-    的中率を計算する
-    
-    計算方法:
-    1. ユーザーの全予想を取得
-    2. レース結果がある予想のみ対象
-    3. 的中した馬の数を数える
-    4. パーセンテージを計算
-    """
-    # ユーザーの全予想を取得
-    predictions = Prediction.objects.filter(user=user)
-    
-    # 予想した馬の総数（1予想 = 3頭）
-    total_horses = predictions.count() * 3
-    
-    # 予想がない場合
-    if total_horses == 0:
-        return 0
-    
-    # 的中数をカウント
-    hit_count = 0
-    
-    for prediction in predictions:
-        # このレースの結果があるか確認
-        try:
-            result = RaceResult.objects.get(race=prediction.race)
-            
-            # 1着が的中しているか
-            if prediction.first_position == result.first_place:
-                hit_count += 1
-            
-            # 2着が的中しているか
-            if prediction.second_position == result.second_place:
-                hit_count += 1
-            
-            # 3着が的中しているか
-            if prediction.third_position == result.third_place:
-                hit_count += 1
-                
-        except RaceResult.DoesNotExist:
-            # レース結果がまだない場合はスキップ
-            continue
-    
-    # 的中率を計算（小数点第1位まで）
-    hit_rate = round((hit_count / total_horses) * 100, 1)
-    
-    return hit_rate
-
-
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def user_profile(request):
     """現在のユーザーのプロフィール詳細を取得"""
     user = request.user
     
-    # 統計情報を集計
-    predictions_count = Prediction.objects.filter(user=user).count()
-    followers_count = Follow.objects.filter(followed=user).count()
+    # 件数はプロフィールに持っている値（prediction/profile_counters.py）
+    profile = getattr(user, 'userprofile', None)
+    counts = {name: getattr(profile, name, 0) for name in UserProfile.COUNTER_FIELDS}
     
-    # ポイントを取得
+    # ポイントと的中率（的中率は採点のたびに UserPoint に保存している）
     try:
         user_point = UserPoint.objects.get(user=user)
-        points = user_point.points
+        points, hit_rate = user_point.points, user_point.hit_rate
     except UserPoint.DoesNotExist:
-        points = 0
-    
-    # ✅ 的中率の計算
-    hit_rate = calculate_hit_rate(user)
+        points, hit_rate = 0, 0
     
     # プロフィール画像URLを取得
     profile_image_url = None
@@ -318,57 +329,61 @@ def user_profile(request):
             'profile_image_url': profile_image_url,
             'updated_at': user.userprofile.updated_at if hasattr(user, 'userprofile') else None,
         },
-        'predictions_count': predictions_count,
-        'followers_count': followers_count,
+        **counts,
         'hit_rate': hit_rate,
         'points': points,
     })
 
 
+@api_view(['DELETE'])
+@permission_classes([IsAuthenticated])
+def delete_account(request):
+    """
+    退会
+    DELETE /api/users/me/
+
+    すぐにログインできなくなり、データは process_user_deletions で順次削除される
+    """
+    request_user_deletion(request.user)
+    return Response({'detail': '退会を受け付けました。'}, status=202)
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def results_list(request):
     """ユーザーの予想結果一覧を取得"""
     user = request.user
     
-    # ユーザーの予想を取得
-    predictions = Prediction.objects.filter(user=user)
-    
+    # 結果が出ているレースの予想を、結果・馬名ごと1クエリで取得
+    predictions = list(
+        Prediction.objects.filter(user=user, race__raceresult__isnull=False).select_related(
+            'race',
+            'race__raceresult__first_place',
+            'race__raceresult__second_place',
+            'race__raceresult__third_place',
+            'first_position',
+            'second_position',
+            'third_position',
+        )
+    )
+
     results = []
-    
     for prediction in predictions:
-        # レース結果があるか確認
-        try:
-            race_result = RaceResult.objects.get(race=prediction.race)
-            
-            # ポイントを計算
-            score = 0
-            if prediction.first_position == race_result.first_place:
-                score += 3
-            if prediction.second_position == race_result.second_place:
-                score += 2
-            if prediction.third_position == race_result.third_place:
-                score += 1
-            
-            # レスポンスに追加
-            results.append({
-                'id': prediction.id,
-                'race_name': prediction.race.name,
-                # 'race_date': prediction.race.date.isoformat(),
-                'race_location': prediction.race.location,
-                'predicted_1': prediction.first_position.name,
-                'predicted_2': prediction.second_position.name,
-                'predicted_3': prediction.third_position.name,
-                'actual_1': race_result.first_place.name,
-                'actual_2': race_result.second_place.name,
-                'actual_3': race_result.third_place.name,
-                'score': score,
-            })
-            
-        except RaceResult.DoesNotExist:
-            # レース結果がまだない場合はスキップ
-            continue
-    
+        race_result = prediction.race.raceresult
+        results.append({
+            'id': prediction.id,
+            'race_name': prediction.race.name,
+            # 'race_date': prediction.race.date.isoformat(),
+            'race_location': prediction.race.location,
+            'predicted_1': prediction.first_position.name,
+            'predicted_2': prediction.second_position.name,
+            'predicted_3': prediction.third_position.name,
+            'actual_1': race_result.first_place.name if race_result.first_place else None,
+            'actual_2': race_result.second_place.name if race_result.second_place else None,
+            'actual_3': race_result.third_place.name if race_result.third_place else None,
+            'score': prediction.score,
+        })
+
     return Response(results)
 
 @api_view(['GET'])
@@ -377,15 +392,12 @@ def user_points(request):
     """ユーザーの合計ポイントと的中率を取得"""
     user = request.user
     
-    # ポイントを取得
+    # ポイントと的中率（的中率は採点のたびに UserPoint に保存している）
     try:
         user_point = UserPoint.objects.get(user=user)
-        points = user_point.points
+        points, hit_rate = user_point.points, user_point.hit_rate
     except UserPoint.DoesNotExist:
-        points = 0
-    
-    # ✅ 的中率を計算
-    hit_rate = calculate_hit_rate(user)
+        points, hit_rate = 0, 0
     
     return Response({
         'points': points,
@@ -402,12 +414,11 @@ def points_ranking(request):
     
     # UserPointが存在するユーザーを取得
     rankings = []
-    user_points = UserPoint.objects.select_related('user').order_by('-points')[:20]
+    user_points = UserPoint.objects.select_related('user', 'user__userprofile').order_by('-points')[:20]
     
     for rank, user_point in enumerate(user_points, start=1):
         user = user_point.user
-        predictions_count = Prediction.objects.filter(user=user).count()
-        hit_rate = calculate_hit_rate(user)
+        predictions_count = user.userprofile.predictions_count if hasattr(user, 'userprofile') else 0
         
         # プロフィール画像URL
         profile_image_url = None
@@ -420,56 +431,246 @@ def points_ranking(request):
             'username': user.username,
             'profile_image_url': profile_image_url,
             'points': user_point.points,
-            'hit_rate': hit_rate,
+            'hit_rate': user_point.hit_rate,
             'predictions_count': predictions_count,
         })
     
     return Response(rankings)
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def friends_ranking(request):
+    """
+    友達内ランキング（自分とフォロー中のユーザー）
+    GET /api/rankings/friends/?limit=100
+
+    上位 limit 人と、自分の順位（me）を返す
+    """
+    try:
+        limit = min(int(request.query_params.get('limit', settings.FRIENDS_RANKING_PAGE_SIZE)), 1000)
+    except ValueError:
+        return Response({'error': 'limit は数値で指定してください'}, status=400)
+
+    rows = ranking_among_friends(request.user)
+
+    def with_image(row):
+        row = dict(row)
+        image = row.pop('profile_image')
+        row['profile_image_url'] = (
+            request.build_absolute_uri(f"{settings.MEDIA_URL}{image}") if image else None
+        )
+        return row
+
+    me = next((row for row in rows if row['user_id'] == request.user.id), None)
+    return Response({
+        'rankings': [with_image(row) for row in rows[:max(limit, 0)]],
+        'me': with_image(me) if me else None,
+        'total': len(rows),
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def my_rank(request):
+    """
+    自分の順位（ポイントの高い順。同点は同じ順位）
+    GET /api/rankings/me/
+
+    まだポイントがなければ rank は None
+    """
+    board = get_leaderboard()
+    entry = board.rank(request.user.id)
+    rank, points = entry if entry else (None, 0)
+    return Response({
+        'user_id': request.user.id,
+        'points': points,
+        'rank': rank,
+        'total': len(board),
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def ranking_around_me(request):
+    """
+    自分の前後の順位
+    GET /api/rankings/around/?radius=5
+
+    自分の前後 radius 人（まだポイントがなければ rankings は空）
+    """
+    try:
+        radius = min(int(request.query_params.get('radius', 5)), settings.LEADERBOARD_AROUND_MAX_RADIUS)
+    except ValueError:
+        return Response({'error': 'radius は数値で指定してください'}, status=400)
+
+    board = get_leaderboard()
+    rows = board.around(request.user.id, max(radius, 0))
+    usernames = dict(
+        User.objects.filter(id__in=[row['user_id'] for row in rows]).values_list('id', 'username')
+    )
+    for row in rows:
+        row['username'] = usernames.get(row['user_id'])
+    return Response({
+        'rankings': rows,
+        'me': next((row for row in rows if row['user_id'] == request.user.id), None),
+        'total': len(board),
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def ranking_for_period(request):
+    """
+    期間ごとのポイントランキング
+    GET /api/rankings/period/?period=week&date=2026-10-19&limit=100
+    GET /api/rankings/period/?period=rolling&days=30
+
+    period: week（月曜から）/ month / season（1月〜12月）/ rolling（今日までの直近 days 日）
+    date: 期間に含む日（省略時は今日）
+    上位 limit 人と、自分の順位（me）を返す
+    """
+    params = request.query_params
+    try:
+        on = date.fromisoformat(params['date']) if params.get('date') else None
+        days = int(params['days']) if params.get('days') else None
+        limit = min(int(params.get('limit', settings.FRIENDS_RANKING_PAGE_SIZE)), 1000)
+    except ValueError:
+        return Response({'error': 'date は YYYY-MM-DD、days と limit は数値で指定してください'}, status=400)
+    try:
+        start, end = period_bounds(params.get('period', 'week'), on=on, days=days)
+    except ValueError as exc:
+        return Response({'error': str(exc)}, status=400)
+
+    rows = period_ranking(start, end)
+    return Response({
+        'period': params.get('period', 'week'),
+        'start': start,
+        'end': end - timedelta(days=1),
+        'rankings': rows[:max(limit, 0)],
+        'me': next((row for row in rows if row['user_id'] == request.user.id), None),
+        'total': len(rows),
+    })
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def hit_rate_ranking(request):
     """的中率ランキング（TOP 20）"""
     from django.contrib.auth.models import User
     
-    # 全ユーザーの的中率を計算
-    users_data = []
-    
-    for user in User.objects.all():
-        predictions_count = Prediction.objects.filter(user=user).count()
-        
-        # 予想が3件以上のユーザーのみ対象
-        if predictions_count >= 3:
-            hit_rate = calculate_hit_rate(user)
-            
-            try:
-                user_point = UserPoint.objects.get(user=user)
-                points = user_point.points
-            except UserPoint.DoesNotExist:
-                points = 0
-            
-            # プロフィール画像URL
-            profile_image_url = None
-            if hasattr(user, 'userprofile') and user.userprofile.profile_image:
-                profile_image_url = request.build_absolute_uri(user.userprofile.profile_image.url)
-            
-            users_data.append({
-                'user_id': user.id,
-                'username': user.username,
-                'profile_image_url': profile_image_url,
-                'points': points,
-                'hit_rate': hit_rate,
-                'predictions_count': predictions_count,
-            })
+    from django.db.models import F
     
-    # 的中率でソート
-    users_data.sort(key=lambda x: x['hit_rate'], reverse=True)
+    # 予想が3件以上のユーザーのみ対象（予想数はプロフィールの件数で絞り込む）。
+    # 的中率は採点のたびに UserPoint に保存しているので、並べ替えも DB で行う
+    top_users = User.objects.filter(
+        userprofile__predictions_count__gte=3
+    ).select_related('userprofile', 'userpoint').order_by(
+        F('userpoint__hit_rate').desc(nulls_last=True), 'id'
+    )[:20]
     
-    # TOP 20 + ランク番号を追加
     rankings = []
-    for rank, user_data in enumerate(users_data[:20], start=1):
-        user_data['rank'] = rank
-        rankings.append(user_data)
+    for rank, user in enumerate(top_users, start=1):
+        user_point = getattr(user, 'userpoint', None)
+        
+        # プロフィール画像URL
+        profile_image_url = None
+        if user.userprofile.profile_image:
+            profile_image_url = request.build_absolute_uri(user.userprofile.profile_image.url)
+        
+        rankings.append({
+            'rank': rank,
+            'user_id': user.id,
+            'username': user.username,
+            'profile_image_url': profile_image_url,
+            'points': user_point.points if user_point else 0,
+            'hit_rate': user_point.hit_rate if user_point else 0,
+            'predictions_count': user.userprofile.predictions_count,
+        })
     
     return Response(rankings)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def changes(request):
+    """
+    差分同期（オフラインファースト用）
+    GET /api/changes/?since=<seq>&limit=<n>
+
+    since より後の変更を seq 順に返す。同じオブジェクトの変更は最新の1件にまとめる。
+    次回は返ってきた next を since に指定し、has_more が false になるまで繰り返す。
+    初回は since=0（全件）。
+    """
+    try:
+        since = int(request.query_params.get('since', 0))
+        limit = int(request.query_params.get('limit', settings.CHANGE_FEED_PAGE_SIZE))
+    except ValueError:
+        return Response({'error': 'since と limit は整数で指定してください'}, status=400)
+    limit = max(1, min(limit, settings.CHANGE_FEED_MAX_PAGE_SIZE))
+
+    # seq はコミットの順なので、配信した seq より前にあとから行が増えることはない
+    # （seq がまだない行はコミット後に振られるまで配信しない）
+    entries = list(
+        ChangeLog.objects.filter(seq__gt=since)
+        .filter(Q(user__isnull=True) | Q(user=request.user))
+        .order_by('seq')
+        .values('seq', 'kind', 'object_id', 'op')[:limit + 1]
+    )
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    next_seq = entries[-1]['seq'] if entries else since
+
+    # ページ内で同じオブジェクトが複数回変わっていれば最新の1件だけ
+    latest = {}
+    for entry in entries:
+        latest[(entry['kind'], entry['object_id'])] = entry
+    entries = sorted(latest.values(), key=lambda entry: entry['seq'])
+
+    # 最新の値を種別ごとに1クエリで取得
+    upsert_ids = defaultdict(list)
+    for entry in entries:
+        if entry['op'] == ChangeLog.UPSERT:
+            upsert_ids[entry['kind']].append(entry['object_id'])
+    rows = {kind: fetch_rows(kind, ids) for kind, ids in upsert_ids.items()}
+
+    results = []
+    for entry in entries:
+        row = rows.get(entry['kind'], {}).get(entry['object_id'])
+        change = {
+            'seq': entry['seq'],
+            'type': entry['kind'],
+            'id': entry['object_id'],
+            # 更新のあとに削除されていれば削除として返す
+            'op': ChangeLog.UPSERT if row is not None else ChangeLog.DELETE,
+        }
+        if row is not None:
+            change['data'] = row
+        results.append(change)
+
+    return Response({
+        'changes': results,
+        'next': next_seq,
+        'has_more': has_more,
+    })
+
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAdminUser])
+def scoring_backtest(request):
+    """
+    採点ルール変更の試算（管理者のみ）
+    POST /api/scoring/backtest/  {"rules": {"in_top3": 1, "trifecta": 20}, "top": 20}
+
+    現在のルールとの比較（ポイントの分布・順位の変化・ユーザーごとの増減）を返す。
+    UserPoint には書き込まない。
+    """
+    try:
+        rules = ScoringRules.from_dict(request.data.get('rules', {}))
+        top = min(max(int(request.data.get('top', 20)), 0), 100)
+    except (TypeError, ValueError) as exc:
+        return Response({'error': str(exc)}, status=400)
+
+    report = backtest(rules, top=top)
+    report['rules'] = {'current': ScoringRules.from_settings().as_dict(), 'proposed': rules.as_dict()}
+    return Response(report)
@@ -0,0 +1,110 @@
+"""
+読み取りレプリカへの振り分け
+
+- GET/HEAD/OPTIONS のリクエスト中の読み取りはレプリカ（"replica"）へ
+- 書き込みと、POST 等のリクエスト中の読み取りはプライマリ（"default"）へ
+- 書き込みを行ったユーザーは REPLICA_STICKY_SECONDS の間プライマリから読む
+  （投稿した予想がレプリカの遅延で一覧に出ない、を防ぐ）
+- リクエスト外（管理コマンド・シェル等）は常にプライマリ
+- キャッシュのテーブル（CACHE_BACKEND=database）は常にプライマリ（破棄がすぐ見えるように）
+"""
+
+import hashlib
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+REPLICA_DB_ALIAS = "replica"
+
+# DatabaseCache のテーブルの app_label
+CACHE_APP_LABEL = "django_cache"
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# リクエスト単位の状態（dict を入れて書き込みの有無も記録する）
+_routing_state = ContextVar("db_routing_state", default=None)
+
+
+def _sticky_cache_key(request):
+    """認証情報（トークン or セッション）からユーザーごとのキーを作る"""
+    credential = request.META.get("HTTP_AUTHORIZATION") or request.COOKIES.get(
+        settings.SESSION_COOKIE_NAME
+    )
+    if not credential:
+        return None
+    return "db:sticky:" + hashlib.sha256(credential.encode()).hexdigest()
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == CACHE_APP_LABEL:
+            return DEFAULT_DB_ALIAS
+        state = _routing_state.get()
+        if state and state["replica"] and not state["wrote"]:
+            return REPLICA_DB_ALIAS
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _routing_state.get()
+        if state and model._meta.app_label != CACHE_APP_LABEL:
+            state["wrote"] = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # レプリカとプライマリは同じデータなので関連付けは常に許可
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # レプリカにはレプリケーションで反映される
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def _use_replica(self, request, pinned):
+        return (
+            REPLICA_DB_ALIAS in settings.DATABASES
+            and request.method in SAFE_METHODS
+            and not pinned
+        )
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        sticky_key = _sticky_cache_key(request)
+        pinned = bool(sticky_key and cache.get(sticky_key))
+        state = {"replica": self._use_replica(request, pinned), "wrote": False}
+        token = _routing_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _routing_state.reset(token)
+
+        if state["wrote"] and sticky_key:
+            cache.set(sticky_key, True, settings.REPLICA_STICKY_SECONDS)
+        return response
+
+    async def __acall__(self, request):
+        sticky_key = _sticky_cache_key(request)
+        pinned = bool(sticky_key and await cache.aget(sticky_key))
+        state = {"replica": self._use_replica(request, pinned), "wrote": False}
+        token = _routing_state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _routing_state.reset(token)
+
+        if state["wrote"] and sticky_key:
+            await cache.aset(sticky_key, True, settings.REPLICA_STICKY_SECONDS)
+        return response
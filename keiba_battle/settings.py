@@ -13,6 +13,8 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 from pathlib import Path
 import os  # ← 追加
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -81,6 +83,7 @@ INTERNAL_IPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "keiba_battle.routers.ReplicaRoutingMiddleware",  # DB の読み取り先を決める（セッション・認証より前）
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",  # ← これを追加（CommonMiddlewareの前）
     "django.middleware.common.CommonMiddleware",
@@ -113,12 +116,117 @@ WSGI_APPLICATION = "keiba_battle.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+DB_ENGINE = os.environ.get("DB_ENGINE", "sqlite")
+
+# 既存の SQLite ファイル（PostgreSQL への移行元としても使う）
+SQLITE_PATH = BASE_DIR / "db.sqlite3"
+
+if DB_ENGINE == "postgresql":
+    DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", 10))
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.environ.get("DB_NAME", "keiba_battle"),
+            "USER": os.environ.get("DB_USER", "postgres"),
+            "PASSWORD": os.environ.get("DB_PASSWORD", ""),
+            "HOST": os.environ.get("DB_HOST", "localhost"),
+            "PORT": os.environ.get("DB_PORT", "5432"),
+            # プール利用時は接続の使い回しをプールに任せる（CONN_MAX_AGE は 0 必須）
+            "CONN_MAX_AGE": 0 if DB_POOL_MAX_SIZE else int(os.environ.get("DB_CONN_MAX_AGE", 60)),
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {},
+        }
     }
-}
+    if DB_POOL_MAX_SIZE:
+        # Django 標準のコネクションプール（psycopg[pool] が必要）
+        DATABASES["default"]["OPTIONS"]["pool"] = {
+            "min_size": int(os.environ.get("DB_POOL_MIN_SIZE", 2)),
+            "max_size": DB_POOL_MAX_SIZE,
+            "timeout": int(os.environ.get("DB_POOL_TIMEOUT", 10)),
+        }
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.environ.get("DB_NAME", SQLITE_PATH),
+            # 接続を使い回す秒数（0 = リクエスト毎に接続し直す）
+            "CONN_MAX_AGE": int(os.environ.get("DB_CONN_MAX_AGE", 60)),
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {
+                # ロック解放を待つ秒数（sqlite3 の busy_timeout）
+                "timeout": int(os.environ.get("SQLITE_BUSY_TIMEOUT", 20)),
+                # トランザクション開始時に書き込みロックを取る。
+                # DEFERRED だと読み取り→書き込みへの昇格で待たずに
+                # "database is locked" になるため
+                "transaction_mode": "IMMEDIATE",
+                # 接続作成時に毎回実行される
+                "init_command": (
+                    "PRAGMA journal_mode=WAL;"
+                    "PRAGMA synchronous=NORMAL;"
+                    "PRAGMA cache_size=-20000;"
+                    "PRAGMA temp_store=MEMORY;"
+                ),
+            },
+        }
+    }
+
+# 読み取りレプリカ（DB_REPLICA_HOST か DB_REPLICA_NAME を設定すると有効）
+if os.environ.get("DB_REPLICA_HOST") or os.environ.get("DB_REPLICA_NAME"):
+    DATABASES["replica"] = {
+        **DATABASES["default"],
+        "NAME": os.environ.get("DB_REPLICA_NAME", DATABASES["default"]["NAME"]),
+        "HOST": os.environ.get("DB_REPLICA_HOST", DATABASES["default"].get("HOST", "")),
+        "PORT": os.environ.get("DB_REPLICA_PORT", DATABASES["default"].get("PORT", "")),
+        "OPTIONS": dict(DATABASES["default"]["OPTIONS"]),
+        # テストではプライマリをそのまま使う
+        "TEST": {"MIRROR": "default"},
+    }
+
+DATABASE_ROUTERS = ["keiba_battle.routers.PrimaryReplicaRouter"]
+
+# 書き込み後にプライマリから読み続ける秒数（レプリカの遅延対策）
+REPLICA_STICKY_SECONDS = int(os.environ.get("DB_REPLICA_STICKY_SECONDS", 5))
+
+
+# Cache
+# フォロー先・メンバー判定・ランキングなどのキャッシュは、書き込んだプロセスで破棄する（版を変える）ので、
+# ワーカーが複数なら全プロセスで共有するキャッシュを使う
+#   CACHE_BACKEND=redis     CACHE_URL=redis://localhost:6379/0（redis-py が必要）
+#   CACHE_BACKEND=database  python manage.py createcachetable でテーブルを作る
+# 既定の locmem はプロセスごと（開発用）。他のプロセスでの破棄が届かないので、
+# 下のキャッシュの期限はすべて LOCAL_CACHE_MAX_SECONDS までに縮める
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "locmem")
+if CACHE_BACKEND == "redis":
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.environ.get("CACHE_URL", "redis://localhost:6379/0"),
+            "KEY_PREFIX": "keiba",
+        }
+    }
+elif CACHE_BACKEND == "database":
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+            "LOCATION": "django_cache",
+        }
+    }
+elif CACHE_BACKEND == "locmem":
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+else:
+    raise ImproperlyConfigured(f"CACHE_BACKEND は redis, database, locmem のどれかです: {CACHE_BACKEND}")
+
+SHARED_CACHE = CACHE_BACKEND != "locmem"
+LOCAL_CACHE_MAX_SECONDS = 5
+
+
+def _cache_seconds(seconds):
+    """共有キャッシュでなければ、破棄が届かない他のプロセスのため期限を縮める"""
+    return seconds if SHARED_CACHE else min(seconds, LOCAL_CACHE_MAX_SECONDS)
 
 
 # Password validation
@@ -180,6 +288,73 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# ホーム画面API（/api/async/home/）
+HOME_CACHE_SECONDS = _cache_seconds(30)
+HOME_RESULTS_LIMIT = 10
+HOME_TIMELINE_LIMIT = 20
+
+# 差分同期API（/api/changes/）
+CHANGE_FEED_PAGE_SIZE = 500
+CHANGE_FEED_MAX_PAGE_SIZE = 2000
+
+# 一括予想投稿（/api/predictions/bulk/）
+PREDICTION_BATCH_MAX_SIZE = 50
+IDEMPOTENCY_KEY_TTL = 60 * 60 * 24
+
+# 採点ルール（prediction/scoring.py）。変更したら manage.py rescore_races で採点し直す
+SCORING_RULES = {
+    "exact": (3, 2, 1),  # 1着・2着・3着をその着順で的中
+    "in_top3": 0,  # 3着以内には入ったが着順が違う馬（1頭あたり）
+    "exacta": 0,  # 馬単（1着・2着を着順どおり）のボーナス
+    "trio": 0,  # 3連複（3頭とも3着以内、順不同）のボーナス
+    "trifecta": 0,  # 3連単（3頭とも着順どおり）のボーナス
+}
+# 予想の期待得点のシミュレーション（prediction/simulation.py）
+SIMULATION_RUNS = 20000
+SIMULATION_CPU_BUDGET_MS = 200  # 1回の計算で使う（そのスレッドの）CPU 時間の上限。超えたらそこまでの回数で打ち切る
+SIMULATION_CACHE_SECONDS = _cache_seconds(60 * 10)
+SIMULATION_TRUNCATED_CACHE_SECONDS = _cache_seconds(10)  # 打ち切った結果は短く（次は全回数を計算できるかもしれない）
+
+# 予想が似ているユーザー（prediction/similarity.py、/api/friends/suggestions/）
+SIMILAR_USERS_PER_USER = 20
+SIMILARITY_MIN_COMMON_PICKS = 2  # 同じ馬を同じ着順に選んだ数がこれ未満の相手は出さない
+
+# フォローグラフ（prediction/follow_graph.py、/api/friends/suggestions/mutual/）
+FOLLOW_GRAPH_REFRESH_SECONDS = 2  # 他のプロセスでのフォロー・解除を取り込む間隔
+FOLLOW_GRAPH_MAX_OVERLAY = 10000  # 差分がこれを超えたら配列を作り直す
+FRIEND_SUGGESTIONS_PAGE_SIZE = 20
+USER_LIST_PAGE_SIZE = 50  # フレンド一覧（/users/）
+
+# ユーザーごとのフォロー先のキャッシュ（prediction/follow_cache.py）
+FOLLOW_SET_CACHE_SECONDS = _cache_seconds(60 * 60)  # フォロー・解除のたびに破棄するので長めでよい
+FOLLOW_CHECK_MAX_IDS = 200  # /api/friends/following/check/ で一度に調べられる人数
+
+# グループのメンバー判定のキャッシュ（prediction/membership.py）。メンバーが変わったら破棄される
+GROUP_MEMBERSHIP_CACHE_SECONDS = _cache_seconds(60)
+
+# 友達内ランキング（prediction/rankings.py、/api/rankings/friends/）
+# フォロー・解除や採点でキーが変わるので、期限はプロフィール画像などの変更を拾う程度
+FRIENDS_RANKING_CACHE_SECONDS = _cache_seconds(60 * 5)
+FRIENDS_RANKING_PAGE_SIZE = 100
+
+# ポイントの順位表（prediction/leaderboard.py、/api/rankings/me/・/api/rankings/around/）
+# 各プロセスはスナップショット（DB ごとに1ファイル）をメモリマップで読み、置き換わっていればこの間隔で読み直す
+LEADERBOARD_SNAPSHOT_DIR = BASE_DIR / "var"
+LEADERBOARD_REFRESH_SECONDS = 1
+LEADERBOARD_VERIFY_SECONDS = 60  # 人数・ポイントの合計を DB と比べる間隔（違えば作り直す）
+# ポイントの変化はこの間まとめてから別スレッドでスナップショットに反映する（0 ならコミット後すぐ、その場で）
+LEADERBOARD_FLUSH_SECONDS = 2
+LEADERBOARD_AROUND_MAX_RADIUS = 50
+
+# 期間ごとのランキング（prediction/rankings.py、/api/rankings/period/）
+# 日ごとのポイント（PointBucket）はこの日数より前の月の分を compact_point_buckets で月ごとにまとめる
+# （週間・直近N日のランキングはこの日数まで）
+POINT_BUCKET_DAILY_DAYS = 92
+PERIOD_RANKING_CACHE_SECONDS = _cache_seconds(60 * 5)
+
+# 採点ルール変更の試算（prediction/backtest.py）で使う、採点済みの予想の配列のキャッシュ
+BACKTEST_CACHE_PATH = BASE_DIR / "var" / "scoring_history.npz"
+
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
         "rest_framework.authentication.TokenAuthentication",
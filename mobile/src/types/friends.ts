@@ -3,6 +3,7 @@ export type User = {
   username: string;
   email: string;
   bio?: string;
+  is_followed?: boolean;
 };
 
 export type FriendsData = {
@@ -35,4 +35,6 @@ export type UserDetail = {
   points?: number;
   followers_count?: number;
   following_count?: number;
+  groups_count?: number;
+  messages_count?: number;
 }
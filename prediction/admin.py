@@ -1,9 +1,14 @@
 from django.contrib import admin
-from .models import Prediction, PredictionGroup, RaceResult
+from .models import Prediction, PredictionGroup, RaceResult, ScoreCorrection
 
 @admin.register(RaceResult)
 class RaceResultAdmin(admin.ModelAdmin):
     list_display = ('race', 'first_place', 'second_place', 'third_place', 'updated_at')
 
+@admin.register(ScoreCorrection)
+class ScoreCorrectionAdmin(admin.ModelAdmin):
+    list_display = ('race', 'previous_places', 'new_places', 'affected_predictions', 'created_at')
+    readonly_fields = ('race', 'previous_places', 'new_places', 'affected_predictions', 'user_deltas', 'created_at')
+
 admin.site.register(Prediction)
 admin.site.register(PredictionGroup)
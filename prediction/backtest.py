@@ -0,0 +1,171 @@
+"""
+採点ルール変更の試算（manage.py backtest_scoring / POST /api/scoring/backtest/）
+
+結果の出ているレースの予想を (ユーザー, 予想3頭, 着順3頭) の列ごとの配列にして
+ディスク（settings.BACKTEST_CACHE_PATH）に保存しておき、現在のルールと別のルールで
+まとめて採点し直して、ランキングと得点の分布がどう変わるかを比べる。
+
+- DB からの読み込みは予想・結果が変わったときだけ（それ以外はキャッシュを読む）
+- UserPoint や Prediction.score には一切書き込まない
+- ランキングは予想の得点の合計で比べる（ポイントの手動調整などは含まない）
+"""
+
+import os
+import tempfile
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import Max
+
+from .models import ChangeLog, Prediction, RaceResult
+from .scoring import NO_HORSE, ScoringRules
+
+HISTORY_COLUMNS = ("user_ids", "picks", "placings")
+
+
+def history_signature():
+    """予想・結果が変わると変わる値（キャッシュが使えるかの判定用）"""
+    latest_change = ChangeLog.objects.filter(
+        kind__in=("prediction", "race_result"),
+    ).aggregate(latest=Max("id"))["latest"]
+    return np.array(
+        [latest_change or 0, Prediction.objects.count(), RaceResult.objects.count()],
+        dtype=np.int64,
+    )
+
+
+def _read_history():
+    rows = list(
+        Prediction.objects.filter(race__raceresult__isnull=False).order_by().values_list(
+            "user_id",
+            "first_position_id",
+            "second_position_id",
+            "third_position_id",
+            "race__raceresult__first_place_id",
+            "race__raceresult__second_place_id",
+            "race__raceresult__third_place_id",
+        )
+    )
+    if not rows:
+        return {
+            "user_ids": np.empty(0, dtype=np.int64),
+            "picks": np.empty((0, 3), dtype=np.int64),
+            "placings": np.empty((0, 3), dtype=np.int64),
+        }
+    table = np.array(
+        [[NO_HORSE if value is None else value for value in row] for row in rows],
+        dtype=np.int64,
+    )
+    return {
+        "user_ids": np.ascontiguousarray(table[:, 0]),
+        "picks": np.ascontiguousarray(table[:, 1:4]),
+        "placings": np.ascontiguousarray(table[:, 4:7]),
+    }
+
+
+def load_history(path=None, refresh=False):
+    """
+    採点済みの予想を列ごとの配列で返す {"user_ids": (n,), "picks": (n, 3), "placings": (n, 3)}
+
+    キャッシュが古ければ（予想・結果が変わっていれば）DB から読み直して保存する。
+    """
+    path = str(path or settings.BACKTEST_CACHE_PATH)
+    signature = history_signature()
+    if not refresh and os.path.exists(path):
+        with np.load(path) as cached:
+            if np.array_equal(cached["signature"], signature):
+                return {column: cached[column] for column in HISTORY_COLUMNS}
+
+    history = _read_history()
+    # 書き込み途中のファイルを他のプロセスが読まないよう、別名で書いてから置き換える
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".npz")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, signature=signature, **history)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return history
+
+
+def _user_totals(user_index, user_count, scores):
+    return np.bincount(user_index, weights=scores, minlength=user_count).astype(np.int64)
+
+
+def _ranks(totals, users):
+    """ポイントの多い順の順位（同点はユーザーIDの小さい順。ランキングAPIと同じく連番）"""
+    order = np.lexsort((users, -totals))
+    ranks = np.empty(len(totals), dtype=np.int64)
+    ranks[order] = np.arange(1, len(totals) + 1)
+    return ranks
+
+
+def _distribution(totals):
+    if not len(totals):
+        return {"total": 0, "mean": 0, "median": 0, "p90": 0, "max": 0, "std": 0}
+    return {
+        "total": int(totals.sum()),
+        "mean": round(float(totals.mean()), 2),
+        "median": round(float(np.median(totals)), 2),
+        "p90": round(float(np.percentile(totals, 90)), 2),
+        "max": int(totals.max()),
+        "std": round(float(totals.std()), 2),
+    }
+
+
+def backtest(rules, history=None, top=20):
+    """
+    現在のルールと rules（ScoringRules）で採点し直した結果を比べる
+
+    戻り値: {"predictions", "users", "current", "proposed", "rank_changes", "movers", "deltas"}
+    """
+    history = history if history is not None else load_history()
+    users, user_index = np.unique(history["user_ids"], return_inverse=True)
+
+    current = _user_totals(
+        user_index, len(users),
+        ScoringRules.from_settings().evaluate(history["picks"], history["placings"]),
+    )
+    proposed = _user_totals(
+        user_index, len(users), rules.evaluate(history["picks"], history["placings"]),
+    )
+    current_ranks = _ranks(current, users)
+    proposed_ranks = _ranks(proposed, users)
+    rank_shift = current_ranks - proposed_ranks  # 正なら順位が上がる
+
+    # 大きく動いたユーザー（順位の変化 → ポイントの変化の大きい順）
+    moved = np.flatnonzero(rank_shift)
+    moved = moved[np.lexsort((users[moved], -np.abs(proposed - current)[moved], -np.abs(rank_shift[moved])))][:top]
+    usernames = dict(User.objects.filter(id__in=users[moved].tolist()).values_list("id", "username"))
+
+    def entry(i):
+        return {
+            "user_id": int(users[i]),
+            "username": usernames.get(int(users[i])),
+            "rank": [int(current_ranks[i]), int(proposed_ranks[i])],
+            "points": [int(current[i]), int(proposed[i])],
+        }
+
+    return {
+        "predictions": int(len(user_index)),
+        "users": int(len(users)),
+        "current": _distribution(current),
+        "proposed": _distribution(proposed),
+        "rank_changes": {
+            "moved": int(len(np.flatnonzero(rank_shift))),
+            "up": int((rank_shift > 0).sum()),
+            "down": int((rank_shift < 0).sum()),
+            "max_shift": int(np.abs(rank_shift).max()) if len(rank_shift) else 0,
+        },
+        "movers": [entry(i) for i in moved],
+        "deltas": {
+            str(user_id): int(delta)
+            for user_id, delta in zip(users.tolist(), (proposed - current).tolist())
+            if delta
+        },
+    }
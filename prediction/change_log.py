@@ -0,0 +1,113 @@
+"""
+差分同期用の変更ログ（ChangeLog）への記録と、配信時の最新値の取得
+
+- 記録はシグナル（prediction/signals.py）から。bulk_create / update など
+  シグナルが飛ばない一括処理では record_changes() を直接呼ぶ
+- 変更と同じ接続・同じトランザクションで書く（atomic 内の変更がロールバックされればログも残らない）
+- 同期位置（seq）はコミット後に assign_seqs() で振る。書き込みを直列にして、
+  コミット済みでまだ seq のない行に id 順で続きの番号を付けるので、seq はコミットの順に増える
+  （まだコミットされていない行は見えないので、あとから必ず大きい seq になる）。
+  コミット後に落ちたプロセスの行は、定期実行の compact_change_log で seq を振る
+"""
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Max
+
+from .models import ChangeLog, Follow, Horse, Prediction, Race, RaceResult
+
+# assign_seqs を直列にする PostgreSQL のアドバイザリーロックのキー
+SEQ_LOCK_ID = 720401
+
+# モデル → (種別, 配信するフィールド, 対象ユーザーの属性 or None=全員)
+TRACKED_MODELS = {
+    Race: ("race", ("id", "name", "date", "location"), None),
+    Horse: ("horse", ("id", "name", "race_id"), None),
+    RaceResult: (
+        "race_result",
+        ("id", "race_id", "first_place_id", "second_place_id", "third_place_id", "updated_at"),
+        None,
+    ),
+    Prediction: (
+        "prediction",
+        (
+            "id",
+            "race_id",
+            "first_position_id",
+            "second_position_id",
+            "third_position_id",
+            "comment",
+            "created_at",
+        ),
+        "user_id",
+    ),
+    Follow: ("follow", ("id", "follower_id", "followed_id"), "follower_id"),
+}
+
+MODELS_BY_KIND = {kind: model for model, (kind, _, _) in TRACKED_MODELS.items()}
+
+
+def record_change(instance, op):
+    """1オブジェクトの変更を記録する"""
+    kind, _, audience = TRACKED_MODELS[type(instance)]
+    ChangeLog.objects.create(
+        kind=kind,
+        object_id=instance.pk,
+        op=op,
+        user_id=getattr(instance, audience) if audience else None,
+    )
+    transaction.on_commit(assign_seqs, robust=True)
+
+
+def record_changes(model, objects, op):
+    """一括処理（bulk_create など）の変更をまとめて記録する"""
+    kind, _, audience = TRACKED_MODELS[model]
+    ChangeLog.objects.bulk_create(
+        ChangeLog(
+            kind=kind,
+            object_id=obj.pk,
+            op=op,
+            user_id=getattr(obj, audience) if audience else None,
+        )
+        for obj in objects
+    )
+    transaction.on_commit(assign_seqs, robust=True)
+
+
+def assign_seqs(batch_size=5000):
+    """
+    コミット済みでまだ seq のない行に seq を振る（戻り値: 振った行数）
+
+    記録のコミット後に呼ぶ。コミット後に落ちたプロセスの分は compact_change_log が拾う
+    （差分同期 API の読み取りでは書き込みのロックを取らないよう呼ばない）
+    """
+    logs = ChangeLog.objects.using(DEFAULT_DB_ALIAS)
+    if not logs.filter(seq__isnull=True).exists():
+        return 0
+
+    assigned = 0
+    while True:
+        with transaction.atomic(using=DEFAULT_DB_ALIAS):
+            # SQLite は IMMEDIATE のトランザクションで書き込みが直列になる
+            connection = connections[DEFAULT_DB_ALIAS]
+            if connection.vendor == "postgresql":
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT pg_advisory_xact_lock(%s)", [SEQ_LOCK_ID])
+            pending = list(
+                logs.filter(seq__isnull=True).order_by("id").values_list("id", flat=True)[:batch_size]
+            )
+            last = logs.aggregate(seq=Max("seq"))["seq"] or 0
+            logs.bulk_update(
+                [ChangeLog(id=log_id, seq=last + n) for n, log_id in enumerate(pending, 1)],
+                ["seq"],
+                batch_size=500,
+            )
+        assigned += len(pending)
+        if len(pending) < batch_size:
+            return assigned
+
+
+def fetch_rows(kind, ids):
+    """種別ごとに最新の値をまとめて取得する（id → dict）"""
+    model = MODELS_BY_KIND[kind]
+    _, fields, _ = TRACKED_MODELS[model]
+    return {row["id"]: row for row in model.objects.filter(id__in=ids).values(*fields)}
@@ -0,0 +1,209 @@
+"""
+みんなの予想（レースごとの予想の分布）
+
+予想の登録・修正・削除のたびに HorsePickCount / TrifectaPickCount を増減させておき、
+表示のときは出走馬の数だけの行を読む（そのレースの予想を数え直さない）。
+
+- 増減はシグナル（prediction/signals.py）から。一括登録は predictions_bulk_created
+- 1回の増減はレースごとに UPDATE 2本（馬・組み合わせ）。増やす行がなければ先に作る
+- ずれたとき（シグナルを通らない更新など）は manage.py rebuild_consensus で数え直す
+"""
+
+import uuid
+from collections import Counter, defaultdict
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Q, Value, When
+
+from .models import Horse, HorsePickCount, Prediction, TrifectaPickCount
+
+POSITIONS = ("first", "second", "third")
+
+
+def _version_key(race_id):
+    return f"consensus_version:{race_id}"
+
+
+def consensus_version(race_id):
+    """レースの集計の版（集計が変わると変わる。集計から作ったキャッシュのキーに使う）"""
+    return cache.get(_version_key(race_id), 0)
+
+
+def _bump_versions(race_ids):
+    cache.set_many({_version_key(race_id): uuid.uuid4().hex for race_id in race_ids}, None)
+
+
+def prediction_picks(prediction):
+    return prediction.race_id, (
+        prediction.first_position_id,
+        prediction.second_position_id,
+        prediction.third_position_id,
+    )
+
+
+def apply_picks(added=(), removed=()):
+    """
+    予想 [(race_id, (1着, 2着, 3着)), ...] を集計に足す / 集計から引く
+    """
+    horse_deltas = defaultdict(Counter)  # race_id → {(horse_id, 着順): 増減}
+    trifecta_deltas = defaultdict(Counter)  # race_id → {(1着, 2着, 3着): 増減}
+    for picks, sign in ((added, 1), (removed, -1)):
+        for race_id, horses in picks:
+            for horse_id, position in zip(horses, POSITIONS):
+                horse_deltas[race_id][horse_id, position] += sign
+            trifecta_deltas[race_id][tuple(horses)] += sign
+    if not horse_deltas:
+        return
+
+    with transaction.atomic():
+        # 行を作るのは増やすときだけ（削除のカスケード中に、消えた馬の行を作り直さないため）
+        HorsePickCount.objects.bulk_create(
+            [
+                HorsePickCount(horse_id=horse_id, race_id=race_id)
+                for race_id, deltas in horse_deltas.items()
+                for horse_id in {horse_id for (horse_id, _), delta in deltas.items() if delta > 0}
+            ],
+            ignore_conflicts=True,
+        )
+        TrifectaPickCount.objects.bulk_create(
+            [
+                TrifectaPickCount(
+                    race_id=race_id,
+                    first_position_id=first,
+                    second_position_id=second,
+                    third_position_id=third,
+                )
+                for race_id, deltas in trifecta_deltas.items()
+                for (first, second, third), delta in deltas.items()
+                if delta > 0
+            ],
+            ignore_conflicts=True,
+        )
+
+        for race_id, deltas in horse_deltas.items():
+            HorsePickCount.objects.filter(
+                race_id=race_id, horse_id__in={horse_id for horse_id, _ in deltas},
+            ).update(**{
+                position: F(position) + _delta_case(
+                    [(Q(horse_id=horse_id), delta) for (horse_id, p), delta in deltas.items() if p == position]
+                )
+                for position in POSITIONS
+                if any(p == position for _, p in deltas)
+            })
+
+        for race_id, deltas in trifecta_deltas.items():
+            combinations = [
+                (Q(first_position_id=first, second_position_id=second, third_position_id=third), delta)
+                for (first, second, third), delta in deltas.items()
+            ]
+            TrifectaPickCount.objects.filter(
+                race_id=race_id, first_position_id__in={first for first, _, _ in deltas},
+            ).update(count=F("count") + _delta_case(combinations))
+
+        race_ids = list(horse_deltas)
+        transaction.on_commit(lambda: _bump_versions(race_ids))
+
+
+def _delta_case(conditions):
+    return Case(
+        *(When(condition, then=Value(delta)) for condition, delta in conditions),
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def race_consensus(race_id):
+    """
+    レースのみんなの予想（2クエリ。出走馬の数に比例）
+
+    戻り値: {"race_id", "predictions", "horses": [...], "top_trifecta": {...} or None}
+    share は予想のうちその馬を3着以内に選んだ割合（%）
+    """
+    horses = list(
+        Horse.objects.filter(race_id=race_id).order_by("id").values(
+            "id", "name", "pick_count__first", "pick_count__second", "pick_count__third",
+        )
+    )
+    # 1予想につき1着に選ばれる馬はちょうど1頭
+    total = sum(horse["pick_count__first"] or 0 for horse in horses)
+
+    rows = []
+    for horse in horses:
+        counts = {position: horse[f"pick_count__{position}"] or 0 for position in POSITIONS}
+        rows.append({
+            "horse_id": horse["id"],
+            "horse_name": horse["name"],
+            **counts,
+            "share": round(sum(counts.values()) / total * 100, 1) if total else 0,
+        })
+    rows.sort(key=lambda row: (-row["share"], -row["first"], row["horse_id"]))
+
+    top = (
+        TrifectaPickCount.objects.filter(race_id=race_id, count__gt=0)
+        .order_by("-count", "id")
+        .values("first_position_id", "second_position_id", "third_position_id", "count")
+        .first()
+    )
+    top_trifecta = None
+    if top:
+        names = {row["horse_id"]: row["horse_name"] for row in rows}
+        top_trifecta = {
+            "horses": [
+                {"horse_id": horse_id, "horse_name": names.get(horse_id)}
+                for horse_id in (top["first_position_id"], top["second_position_id"], top["third_position_id"])
+            ],
+            "count": top["count"],
+            "share": round(top["count"] / total * 100, 1) if total else 0,
+        }
+
+    return {"race_id": race_id, "predictions": total, "horses": rows, "top_trifecta": top_trifecta}
+
+
+def rebuild_consensus(race_ids=None):
+    """予想を数え直して集計を作り直す（race_ids を省略すると全レース。戻り値: 集計した馬の数）"""
+    predictions = Prediction.objects.all()
+    horse_counts, trifecta_counts = HorsePickCount.objects.all(), TrifectaPickCount.objects.all()
+    if race_ids is not None:
+        predictions = predictions.filter(race_id__in=race_ids)
+        horse_counts = horse_counts.filter(race_id__in=race_ids)
+        trifecta_counts = trifecta_counts.filter(race_id__in=race_ids)
+
+    counts = defaultdict(lambda: dict.fromkeys(POSITIONS, 0))
+    for position in POSITIONS:
+        for horse_id, race_id, n in (
+            predictions.values_list(f"{position}_position_id", "race_id")
+            .annotate(n=Count("id")).order_by()
+        ):
+            counts[horse_id, race_id][position] = n
+
+    with transaction.atomic():
+        horse_counts.delete()
+        trifecta_counts.delete()
+        HorsePickCount.objects.bulk_create(
+            [
+                HorsePickCount(horse_id=horse_id, race_id=race_id, **positions)
+                for (horse_id, race_id), positions in counts.items()
+            ],
+            batch_size=500,
+        )
+        TrifectaPickCount.objects.bulk_create(
+            [
+                TrifectaPickCount(
+                    race_id=race_id,
+                    first_position_id=first,
+                    second_position_id=second,
+                    third_position_id=third,
+                    count=n,
+                )
+                for race_id, first, second, third, n in (
+                    predictions.values_list(
+                        "race_id", "first_position_id", "second_position_id", "third_position_id",
+                    ).annotate(n=Count("id")).order_by()
+                )
+            ],
+            batch_size=500,
+        )
+        changed_races = {race_id for _, race_id in counts} | set(race_ids or ())
+        transaction.on_commit(lambda: _bump_versions(changed_races))
+    return len(counts)
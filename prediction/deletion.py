@@ -0,0 +1,128 @@
+"""
+予想・履歴の多いユーザーの退会処理
+
+User.delete() は予想・グループ予想・フォロー・メッセージをすべて1トランザクションで
+カスケード削除するため、履歴が多いと書き込みロックを数秒間握ってしまう。
+
+- request_user_deletion(): ログインできなくして受付だけ行う（即時）
+- delete_user_in_chunks(): 関連データを少しずつ短いトランザクションで消し、
+  最後にユーザー本体を消す（process_user_deletions コマンドから実行）
+
+削除中のユーザーの予想については、ポイントの取り消しなどの集計更新を行わない。
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from .membership import invalidate_members
+from .models import (
+    ChangeLog,
+    Follow,
+    GroupMessage,
+    GroupPrediction,
+    IdempotencyKey,
+    Prediction,
+    PredictionGroup,
+    SimilarUser,
+    UserPoint,
+    UserProfile,
+)
+
+_deleting_user_ids = ContextVar("deleting_user_ids", default=frozenset())
+
+
+def is_being_deleted(user_id):
+    """退会処理中のユーザーか（集計の更新を省くため）"""
+    return user_id in _deleting_user_ids.get()
+
+
+@contextmanager
+def deleting(user_id):
+    token = _deleting_user_ids.set(_deleting_user_ids.get() | {user_id})
+    try:
+        yield
+    finally:
+        _deleting_user_ids.reset(token)
+
+
+def request_user_deletion(user):
+    """退会を受け付ける。ログインとAPIを即座に止め、データの削除は後で行う"""
+    with transaction.atomic():
+        User.objects.filter(pk=user.pk).update(is_active=False)
+        Token.objects.filter(user=user).delete()
+        UserProfile.objects.update_or_create(
+            user=user, defaults={"deletion_requested_at": timezone.now()}
+        )
+
+
+def _delete_in_chunks(queryset, chunk_size, pause, before_delete=None):
+    """
+    主キーで chunk_size 件ずつ、別々のトランザクションで削除する
+
+    before_delete: 各チャンクを消す直前に（同じトランザクションで）主キーのリストを渡して呼ぶ
+    """
+    model = queryset.model
+    deleted = 0
+    while True:
+        ids = list(queryset.order_by("pk").values_list("pk", flat=True)[:chunk_size])
+        if not ids:
+            return deleted
+        with transaction.atomic():
+            if before_delete is not None:
+                before_delete(ids)
+            model.objects.filter(pk__in=ids).delete()
+        deleted += len(ids)
+        if pause:
+            time.sleep(pause)
+
+
+def _invalidate_memberships(ids):
+    """
+    所属の行を消すグループのメンバー判定のキャッシュを、コミット後に破棄する
+    （queryset の削除では m2m_changed が飛ばない）
+    """
+    group_ids = list(
+        PredictionGroup.members.through.objects.filter(pk__in=ids).values_list("predictiongroup_id", flat=True)
+    )
+    transaction.on_commit(lambda: invalidate_members(group_ids))
+
+
+def delete_user_in_chunks(user_id, chunk_size=500, pause=0.05):
+    """
+    ユーザーの関連データを少しずつ削除してから、ユーザー本体を削除する
+
+    途中で止まっても、もう一度実行すれば続きから消せる。
+    戻り値: {テーブル名: 削除件数}
+    """
+    memberships = PredictionGroup.members.through
+    steps = [
+        ("group_messages", GroupMessage.objects.filter(sender_id=user_id)),
+        ("group_predictions", GroupPrediction.objects.filter(user_id=user_id)),
+        ("group_memberships", memberships.objects.filter(user_id=user_id)),
+        ("follows", Follow.objects.filter(Q(follower_id=user_id) | Q(followed_id=user_id))),
+        ("predictions", Prediction.objects.filter(user_id=user_id)),
+        ("change_log", ChangeLog.objects.filter(user_id=user_id)),
+        ("idempotency_keys", IdempotencyKey.objects.filter(user_id=user_id)),
+        ("similar_users", SimilarUser.objects.filter(Q(user_id=user_id) | Q(similar_user_id=user_id))),
+    ]
+
+    before_delete = {"group_memberships": _invalidate_memberships}
+
+    counts = {}
+    with deleting(user_id):
+        for name, queryset in steps:
+            counts[name] = _delete_in_chunks(queryset, chunk_size, pause, before_delete.get(name))
+
+        # 残りはユーザー1人分の小さな行だけ
+        with transaction.atomic():
+            UserPoint.objects.filter(user_id=user_id).delete()
+            _, deleted = User.objects.filter(pk=user_id).delete()
+        counts["user"] = deleted.get(User._meta.label, 0)
+    return counts
@@ -0,0 +1,91 @@
+"""
+ユーザーごとのフォロー先のキャッシュ
+
+タイムライン・ユーザー検索・フレンド一覧などで毎回 Follow を引かないよう、
+フォロー先のユーザーID を昇順の int64 配列（array('q') のバイト列）にして
+キャッシュに置く。
+
+- Follow の登録・削除のシグナル（prediction/signals.py）でフォローした側の分を破棄
+  （すぐに1回、コミット後にもう1回。コミット前に古い集合を入れ直されても消える）
+- 念のため FOLLOW_SET_CACHE_SECONDS で期限切れにする（プロセスごとのキャッシュでは数秒。settings.CACHE_BACKEND）
+- フォロー先から作った別のキャッシュ（友達内ランキングなど）のキーには
+  following_version() を入れる（破棄のたびに変わる）
+- フォロー中かどうかは配列の二分探索で調べる（is_following）
+"""
+
+import uuid
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Follow
+
+
+def _key(user_id):
+    return f"following:{user_id}"
+
+
+def _version_key(user_id):
+    return f"following_version:{user_id}"
+
+
+def _pack(followed_ids):
+    return array("q", sorted(followed_ids)).tobytes()
+
+
+def _unpack(data):
+    followed = array("q")
+    followed.frombytes(data)
+    return followed
+
+
+def following_ids(user_id):
+    """フォロー先のユーザーID（昇順の array('q')）"""
+    data = cache.get(_key(user_id))
+    if data is None:
+        data = _pack(Follow.objects.filter(follower_id=user_id).values_list("followed_id", flat=True))
+        cache.set(_key(user_id), data, settings.FOLLOW_SET_CACHE_SECONDS)
+    return _unpack(data)
+
+
+async def afollowing_ids(user_id):
+    """following_ids() の async 版"""
+    data = await cache.aget(_key(user_id))
+    if data is None:
+        data = _pack([
+            followed_id
+            async for followed_id in Follow.objects.filter(follower_id=user_id).values_list("followed_id", flat=True)
+        ])
+        await cache.aset(_key(user_id), data, settings.FOLLOW_SET_CACHE_SECONDS)
+    return _unpack(data)
+
+
+def contains(followed, user_id):
+    """following_ids() の配列に user_id が含まれるか"""
+    i = bisect_left(followed, user_id)
+    return i < len(followed) and followed[i] == user_id
+
+
+def is_following(user_id, target_ids):
+    """user_id が target_ids のそれぞれをフォローしているか {target_id: bool}"""
+    followed = following_ids(user_id)
+    return {target_id: contains(followed, target_id) for target_id in target_ids}
+
+
+def following_version(user_id):
+    """user_id のフォロー先の版（フォロー・解除のたびに変わる）"""
+    return cache.get(_version_key(user_id), 0)
+
+
+def invalidate_following(user_id):
+    """user_id のフォロー先のキャッシュを破棄する"""
+
+    def invalidate():
+        cache.delete(_key(user_id))
+        cache.set(_version_key(user_id), uuid.uuid4().hex, None)
+
+    invalidate()
+    transaction.on_commit(invalidate)
@@ -0,0 +1,214 @@
+"""
+フォローグラフ（メモリ上の CSR 隣接リスト）
+
+Follow をフォローする側ごとに並べた配列（CSR: indptr / indices）で持ち、
+「フォローしている人がフォローしている人」（友達の友達）のおすすめと、
+共通のフォローの数をリクエストのたびに DB を引かずに計算する。
+
+- 各プロセスに1つ（get_graph()）。初回に Follow を1回読み込む
+- このプロセスでのフォロー・解除はシグナルからコミット後にすぐ反映
+- 他のプロセスでの変更は変更ログ（ChangeLog の follow）から追いつく
+  （FOLLOW_GRAPH_REFRESH_SECONDS に1回まで）
+- 変更は配列を作り直さずに差分（追加・削除）として持ち、
+  FOLLOW_GRAPH_MAX_OVERLAY を超えたら配列に畳み込む
+"""
+
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Max
+
+from .models import ChangeLog, Follow
+
+_EMPTY = np.empty(0, dtype=np.int64)
+
+
+class FollowGraph:
+    def __init__(self, edge_ids, followers, followeds, seq=0):
+        edge_ids = np.asarray(edge_ids, dtype=np.int64)
+        followers = np.asarray(followers, dtype=np.int64)
+        followeds = np.asarray(followeds, dtype=np.int64)
+
+        order = np.lexsort((followeds, followers))
+        followers = followers[order]
+        # CSR: row_users[i] のフォロー先は indices[indptr[i]:indptr[i + 1]]（昇順）
+        self.row_users, starts = np.unique(followers, return_index=True)
+        self.indptr = np.append(starts, len(followers)).astype(np.int64)
+        self.indices = followeds[order]
+        self.edge_ids = edge_ids[order]
+        self.alive = np.ones(len(self.indices), dtype=bool)
+        # フォローのIDから配列の位置を引く
+        self._edge_order = np.argsort(self.edge_ids, kind="stable")
+        self._sorted_edge_ids = self.edge_ids[self._edge_order]
+
+        self.added = {}  # 配列に入っていないフォロー {follow_id: (follower_id, followed_id)}
+        self.removed = 0  # 配列のうち削除済みの数
+        self.seq = seq  # 反映済みの変更ログの位置
+        self.refreshed_at = time.monotonic()
+        self.lock = threading.RLock()
+
+    @classmethod
+    def load(cls):
+        """Follow をすべて読み込む"""
+        # 先に位置を取るので、読み込み中の変更は次の refresh() でもう一度反映される（冪等）
+        seq = ChangeLog.objects.filter(kind="follow").aggregate(seq=Max("seq"))["seq"] or 0
+        rows = np.array(
+            list(Follow.objects.values_list("id", "follower_id", "followed_id").order_by()),
+            dtype=np.int64,
+        ).reshape(-1, 3)
+        return cls(rows[:, 0], rows[:, 1], rows[:, 2], seq=seq)
+
+    def __len__(self):
+        return len(self.indices) - self.removed + len(self.added)
+
+    # --- 更新 -------------------------------------------------------------
+
+    def _position(self, follow_id):
+        i = np.searchsorted(self._sorted_edge_ids, follow_id)
+        if i < len(self._sorted_edge_ids) and self._sorted_edge_ids[i] == follow_id:
+            return int(self._edge_order[i])
+        return None
+
+    def add(self, follow_id, follower_id, followed_id):
+        with self.lock:
+            position = self._position(follow_id)
+            if (position is not None and self.alive[position]) or follow_id in self.added:
+                return
+            if position is not None:
+                # 削除済みの印が付いた辺（同じ ID）は生き返らせる
+                self.alive[position] = True
+                self.removed -= 1
+            else:
+                self.added[follow_id] = (follower_id, followed_id)
+            self._maybe_compact()
+
+    def remove(self, follow_id):
+        with self.lock:
+            if self.added.pop(follow_id, None) is not None:
+                return
+            position = self._position(follow_id)
+            if position is not None and self.alive[position]:
+                self.alive[position] = False
+                self.removed += 1
+                self._maybe_compact()
+
+    def _maybe_compact(self):
+        if len(self.added) + self.removed <= settings.FOLLOW_GRAPH_MAX_OVERLAY:
+            return
+        row_of_edge = np.repeat(self.row_users, np.diff(self.indptr))
+        added = np.array(
+            [(follow_id, a, b) for follow_id, (a, b) in self.added.items()], dtype=np.int64,
+        ).reshape(-1, 3)
+        compacted = FollowGraph(
+            np.concatenate([self.edge_ids[self.alive], added[:, 0]]),
+            np.concatenate([row_of_edge[self.alive], added[:, 1]]),
+            np.concatenate([self.indices[self.alive], added[:, 2]]),
+            seq=self.seq,
+        )
+        for name in ("row_users", "indptr", "indices", "edge_ids", "alive", "_edge_order", "_sorted_edge_ids"):
+            setattr(self, name, getattr(compacted, name))
+        self.added, self.removed = {}, 0
+
+    def refresh(self, force=False):
+        """他のプロセスでの変更を変更ログから反映する"""
+        with self.lock:
+            if not force and time.monotonic() - self.refreshed_at < settings.FOLLOW_GRAPH_REFRESH_SECONDS:
+                return
+            self.refreshed_at = time.monotonic()
+            changes = list(
+                ChangeLog.objects.filter(kind="follow", seq__gt=self.seq)
+                .order_by("seq")
+                .values_list("seq", "object_id", "op")
+            )
+            if not changes:
+                return
+            upserted = {object_id for _, object_id, op in changes if op == ChangeLog.UPSERT}
+            current = {
+                follow_id: (a, b)
+                for follow_id, a, b in Follow.objects.filter(id__in=upserted)
+                .values_list("id", "follower_id", "followed_id")
+            }
+            for _, object_id, op in changes:
+                if op == ChangeLog.DELETE or object_id not in current:
+                    self.remove(object_id)
+                else:
+                    self.add(object_id, *current[object_id])
+            # seq はコミットの順なので、ここより前にあとから行が増えることはない
+            self.seq = changes[-1][0]
+
+    # --- 参照 -------------------------------------------------------------
+
+    def following(self, user_id):
+        """フォロー先のユーザーID（配列）"""
+        with self.lock:
+            return self._following_many(np.array([user_id], dtype=np.int64))
+
+    def _following_many(self, user_ids):
+        """user_ids のフォロー先をまとめて（重複あり）"""
+        rows = np.searchsorted(self.row_users, user_ids)
+        found = rows < len(self.row_users)
+        found[found] = self.row_users[rows[found]] == user_ids[found]
+        rows = rows[found]
+        starts, ends = self.indptr[rows], self.indptr[rows + 1]
+        lengths = ends - starts
+        if lengths.sum():
+            # 各行の [start, end) をつなげた位置の配列
+            positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+            positions = positions[self.alive[positions]]
+            targets = self.indices[positions]
+        else:
+            targets = _EMPTY
+        if self.added:
+            wanted = set(user_ids.tolist())
+            extra = [b for a, b in self.added.values() if a in wanted]
+            if extra:
+                targets = np.concatenate([targets, np.array(extra, dtype=np.int64)])
+        return targets
+
+    def suggestions(self, user_id, exclude=()):
+        """
+        友達の友達（フォローしている人がフォローしている、まだフォローしていない人）
+
+        戻り値: (ユーザーID の配列, 共通のフォローの数の配列)。共通の数の多い順
+        """
+        with self.lock:
+            followees = np.unique(self.following(user_id))
+            candidates = self._following_many(followees)
+        if not len(candidates):
+            return _EMPTY, _EMPTY
+        users, counts = np.unique(candidates, return_counts=True)
+        keep = ~np.isin(users, followees) & (users != user_id)
+        if exclude:
+            keep &= ~np.isin(users, np.fromiter(exclude, dtype=np.int64))
+        users, counts = users[keep], counts[keep]
+        order = np.lexsort((users, -counts))
+        return users[order], counts[order]
+
+    def mutual_count(self, user_id, other_id):
+        """user_id がフォローしている人のうち、other_id をフォローしている人の数"""
+        with self.lock:
+            followees = np.unique(self.following(user_id))
+            return int(np.count_nonzero(self._following_many(followees) == other_id))
+
+
+_graph = None
+_graph_lock = threading.Lock()
+
+
+def get_graph():
+    """このプロセスのフォローグラフ（なければ読み込む。古ければ変更ログから追いつく）"""
+    global _graph
+    if _graph is None:
+        with _graph_lock:
+            if _graph is None:
+                _graph = FollowGraph.load()
+                return _graph
+    _graph.refresh()
+    return _graph
+
+
+def loaded_graph():
+    """読み込み済みならそのグラフ、まだなら None（シグナルから使う。読み込みはしない）"""
+    return _graph
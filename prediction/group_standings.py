@@ -0,0 +1,46 @@
+"""
+グループ内の順位表（GroupStanding）
+
+- 得点の増減は採点（prediction/scoring.py）から。結果が入ったレースの
+  グループ予想は score_races がまとめて、結果の出たレースの予想をあとから
+  共有したときは score_group_predictions がその予想だけを採点する
+- メンバーに加わったら 0 点の行を作る（まだ採点された予想がなくても順位表に出る）
+- 順位表は group_ranking() の1クエリ（(グループ, 得点) の索引を使い、
+  グループの予想の数によらない）。グループを抜けたメンバーは出さない
+"""
+
+from django.db.models import Exists, F, OuterRef, Window
+from django.db.models.functions import Rank
+
+from .models import GroupStanding, PredictionGroup
+
+
+def ensure_standings(pairs):
+    """(group_id, user_id) の行がなければ 0 点で作る"""
+    GroupStanding.objects.bulk_create(
+        [GroupStanding(group_id=group_id, user_id=user_id) for group_id, user_id in pairs],
+        ignore_conflicts=True,
+    )
+
+
+def retract_group_prediction(prediction):
+    """削除されたグループ予想の得点を順位表から引く"""
+    if prediction.score is None:
+        return
+    GroupStanding.objects.filter(group_id=prediction.group_id, user_id=prediction.user_id).update(
+        points=F("points") - prediction.score,
+        scored_predictions=F("scored_predictions") - 1,
+    )
+
+
+def group_ranking(group_id):
+    """グループの順位表（得点の高い順。同点は同じ順位）"""
+    is_member = PredictionGroup.members.through.objects.filter(
+        predictiongroup_id=group_id, user_id=OuterRef("user_id")
+    )
+    return (
+        GroupStanding.objects.filter(Exists(is_member), group_id=group_id)
+        .annotate(rank=Window(Rank(), order_by=F("points").desc()))
+        .select_related("user")
+        .order_by("-points", "user_id")
+    )
@@ -0,0 +1,351 @@
+"""
+ポイントの順位表（ソート済み配列 + メモリマップしたスナップショット）
+
+「自分の順位」や「自分の前後の順位」を、UserPoint を全件並べ替えずに二分探索で返す。
+
+- 各ユーザーを キー = (-ポイント) << 32 | ユーザーID の int64 にし、昇順に並べる
+  （ポイントの高い順、同点はユーザーIDの小さい順）。順位は「自分より多いポイントの人数 + 1」
+  （同点は同じ順位）で、キーの配列の二分探索1回で求まる
+- ユーザーIDからキーを引くため、ユーザーID順の配列も持つ
+- 配列はスナップショット（settings.LEADERBOARD_SNAPSHOT_DIR の leaderboard-<DBの識別子>.npy）に
+  保存し、各プロセスはメモリマップで読む（ワーカーが何個あってもページキャッシュは1つ）。
+  ファイルが置き換わったら LEADERBOARD_REFRESH_SECONDS 以内に読み直す
+- ポイントが変わったら（points_changed のシグナル、コミット後）、変わったユーザーを
+  ためておき、LEADERBOARD_FLUSH_SECONDS ごとに別スレッドでまとめて、ファイルロックを取って
+  最新のスナップショットに今のポイント（DB の値）を反映し、書き直す（書き直しは人数に比例
+  するので、リクエストの中ではやらない）。失敗したらログに残してスナップショットを捨てる
+  （次に使うときに作り直す）
+- スナップショットには DB の識別子と、人数・ポイントの合計を入れておき、
+  LEADERBOARD_VERIFY_SECONDS に1回 DB と比べる。違っていれば（反映に失敗した、
+  DB を復元・移行したなど）UserPoint から作り直す
+- スナップショットがなければ最初に使うときに UserPoint から作る
+  （デプロイ時に manage.py build_leaderboard で作っておくとよい）
+
+ユーザーIDは 2^32 未満、ポイントは ±2^31 の範囲を前提にしている。
+"""
+
+import fcntl
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, connections
+from django.db.models import Count, Sum
+
+from .models import UserPoint
+
+logger = logging.getLogger(__name__)
+
+_USER_BITS = 32
+_USER_MASK = (1 << _USER_BITS) - 1
+
+
+def _make_keys(user_ids, points):
+    return np.left_shift(-np.asarray(points, dtype=np.int64), _USER_BITS) | np.asarray(user_ids, dtype=np.int64)
+
+
+def _points(keys):
+    return -np.right_shift(keys, _USER_BITS)
+
+
+def _user_ids(keys):
+    return keys & _USER_MASK
+
+
+def _table(db_identity, keys, user_ids, user_keys):
+    stamp = np.array([[db_identity], [len(keys)], [int(_points(keys).sum())]], dtype=np.int64)
+    return np.hstack([stamp, np.stack([keys, user_ids, user_keys])])
+
+
+class Leaderboard:
+    def __init__(self, table):
+        # table: (3, n + 1)。
+        # 列 0 は (DB の識別子, 人数, ポイントの合計)、
+        # 列 1〜 は [0] キー（昇順）、[1] ユーザーID（昇順）、[2] [1] の各ユーザーのキー
+        self.table = table
+        self.db_identity, count, total = (int(value) for value in table[:, 0])
+        self.stamp = (count, total)
+        self.keys, self.user_ids, self.user_keys = table[:, 1:]
+
+    @classmethod
+    def from_points(cls, user_ids, points, db_identity=0):
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        keys = _make_keys(user_ids, points)
+        by_user = np.argsort(user_ids, kind="stable")
+        return cls(_table(db_identity, np.sort(keys), user_ids[by_user], keys[by_user]))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _key_of(self, user_id):
+        i = np.searchsorted(self.user_ids, user_id)
+        if i < len(self.user_ids) and self.user_ids[i] == user_id:
+            return int(self.user_keys[i])
+        return None
+
+    def rank_of_points(self, points):
+        """points を持つ人の順位（自分より多いポイントの人数 + 1）"""
+        return int(np.searchsorted(self.keys, np.left_shift(np.int64(-points), _USER_BITS))) + 1
+
+    def rank(self, user_id):
+        """(順位, ポイント)。順位表にいなければ None"""
+        key = self._key_of(user_id)
+        if key is None:
+            return None
+        points = int(_points(np.int64(key)))
+        return self.rank_of_points(points), points
+
+    def _rows(self, start, stop):
+        keys = np.asarray(self.keys[start:stop])
+        points = _points(keys)
+        ranks = np.searchsorted(self.keys, np.left_shift(-points, _USER_BITS)) + 1
+        return [
+            {"rank": int(rank), "user_id": int(user_id), "points": int(point)}
+            for rank, user_id, point in zip(ranks, _user_ids(keys), points)
+        ]
+
+    def top(self, n):
+        return self._rows(0, n)
+
+    def around(self, user_id, radius):
+        """user_id の前後 radius 人（順位表にいなければ空）"""
+        key = self._key_of(user_id)
+        if key is None:
+            return []
+        position = int(np.searchsorted(self.keys, key))
+        return self._rows(max(position - radius, 0), position + radius + 1)
+
+    def updated(self, user_ids, new_user_ids, new_points):
+        """
+        user_ids の行を外し、(new_user_ids, new_points) の行を入れた新しい順位表
+
+        （new_user_ids は user_ids のうち今も UserPoint があるユーザー）
+        """
+        user_ids = np.unique(np.asarray(user_ids, dtype=np.int64))
+        found = np.searchsorted(self.user_ids, user_ids)
+        present = found < len(self.user_ids)
+        present[present] = self.user_ids[found[present]] == user_ids[present]
+        found = found[present]
+        old_keys = np.sort(np.asarray(self.user_keys[found]))
+
+        keys = np.delete(np.asarray(self.keys), np.searchsorted(self.keys, old_keys))
+        users = np.delete(np.asarray(self.user_ids), found)
+        user_keys = np.delete(np.asarray(self.user_keys), found)
+
+        new_user_ids = np.asarray(new_user_ids, dtype=np.int64)
+        new_keys = _make_keys(new_user_ids, new_points)
+        by_user = np.argsort(new_user_ids, kind="stable")
+        sorted_keys = np.sort(new_keys)
+        return Leaderboard(_table(
+            self.db_identity,
+            np.insert(keys, np.searchsorted(keys, sorted_keys), sorted_keys),
+            np.insert(users, np.searchsorted(users, new_user_ids[by_user]), new_user_ids[by_user]),
+            np.insert(user_keys, np.searchsorted(users, new_user_ids[by_user]), new_keys[by_user]),
+        ))
+
+
+def _read_points(user_ids=None):
+    queryset = UserPoint.objects.order_by()
+    if user_ids is not None:
+        queryset = queryset.filter(user_id__in=list(user_ids))
+    rows = np.array(list(queryset.values_list("user_id", "points")), dtype=np.int64).reshape(-1, 2)
+    return rows[:, 0], rows[:, 1]
+
+
+def _db_stamp():
+    """DB の (人数, ポイントの合計)"""
+    totals = UserPoint.objects.aggregate(count=Count("pk"), total=Sum("points"))
+    return totals["count"], totals["total"] or 0
+
+
+def db_identity():
+    """接続先の DB の識別子（別の DB のスナップショットを使わないため）"""
+    database = settings.DATABASES["default"]
+    name = f"{connection.vendor}:{database.get('HOST', '')}:{database.get('PORT', '')}:{database['NAME']}"
+    return int.from_bytes(hashlib.sha256(name.encode()).digest()[:7], "big")
+
+
+def _path():
+    return os.path.join(str(settings.LEADERBOARD_SNAPSHOT_DIR), f"leaderboard-{db_identity():x}.npy")
+
+
+def _file_id(path):
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+@contextmanager
+def _snapshot_lock():
+    """スナップショットを書き換える間のプロセス間のロック"""
+    path = _path()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _write(board):
+    # 読んでいるプロセスの邪魔にならないよう、別名で書いてから置き換える
+    path = _path()
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".npy")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, np.ascontiguousarray(board.table))
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+_board = None
+_board_file = None
+_checked_at = 0.0
+_verified_at = 0.0
+_lock = threading.Lock()
+
+
+def _install(board, file_id, verified=False):
+    global _board, _board_file, _checked_at, _verified_at
+    _board, _board_file, _checked_at = board, file_id, time.monotonic()
+    if verified:
+        _verified_at = _checked_at
+
+
+def _load():
+    """スナップショットを（変わっていれば）読み直す。なければ None"""
+    try:
+        file_id = _file_id(_path())
+    except FileNotFoundError:
+        return None
+    if file_id != _board_file:
+        _install(Leaderboard(np.load(_path(), mmap_mode="r")), file_id)
+    return _board
+
+
+def build_leaderboard():
+    """UserPoint から作り直してスナップショットに保存する（戻り値: 人数）"""
+    with _lock, _snapshot_lock():
+        board = Leaderboard.from_points(*_read_points(), db_identity=db_identity())
+        _write(board)
+        _install(board, _file_id(_path()), verified=True)
+    return len(board)
+
+
+def _is_stale(board):
+    """スナップショットが DB と合っていないか（LEADERBOARD_VERIFY_SECONDS に1回 DB と比べる）"""
+    global _verified_at
+    if board is None or board.db_identity != db_identity():
+        return True
+    if time.monotonic() - _verified_at < settings.LEADERBOARD_VERIFY_SECONDS:
+        return False
+    _verified_at = time.monotonic()
+    stamp = _db_stamp()
+    if board.stamp != stamp:
+        logger.warning("順位表が DB と合わないので作り直します（順位表 %s、DB %s）", board.stamp, stamp)
+        return True
+    return False
+
+
+def get_leaderboard():
+    """このプロセスの順位表（スナップショットが置き換わっていれば読み直し、DB と違えば作り直す）"""
+    global _checked_at
+    if _board is not None and time.monotonic() - _checked_at < settings.LEADERBOARD_REFRESH_SECONDS:
+        return _board
+    with _lock:
+        _checked_at = time.monotonic()
+        stale = _is_stale(_load())
+    if stale:
+        build_leaderboard()
+    return _board
+
+
+def _discard():
+    """スナップショットを捨てる（次に使うときに作り直される）"""
+    global _board, _board_file
+    _board = _board_file = None
+    try:
+        os.unlink(_path())
+    except FileNotFoundError:
+        pass
+
+
+_pending = set()
+_pending_lock = threading.Lock()
+_flush_timer = None
+
+
+def apply_point_changes(user_ids):
+    """
+    ポイントが変わったユーザーを順位表に反映する（コミット後に呼ぶ）
+
+    LEADERBOARD_FLUSH_SECONDS の間に変わったユーザーをまとめて、別スレッドで反映する
+    （0 ならその場で反映する）。反映する前にプロセスが終わっても、
+    LEADERBOARD_VERIFY_SECONDS 以内に DB と比べて作り直される
+    """
+    global _flush_timer
+    if not user_ids or not os.path.exists(_path()):
+        # まだ作られていなければ、最初に使うときに最新のポイントで作られる
+        return
+    if settings.LEADERBOARD_FLUSH_SECONDS <= 0:
+        _apply(user_ids)
+        return
+    with _pending_lock:
+        _pending.update(user_ids)
+        if _flush_timer is None:
+            _flush_timer = threading.Timer(settings.LEADERBOARD_FLUSH_SECONDS, _flush_in_background)
+            _flush_timer.daemon = True
+            _flush_timer.start()
+
+
+def flush_point_changes():
+    """ためておいたポイントの変化をまとめて反映する"""
+    global _flush_timer
+    with _pending_lock:
+        user_ids, _flush_timer = set(_pending), None
+        _pending.clear()
+    _apply(user_ids)
+
+
+def _flush_in_background():
+    try:
+        flush_point_changes()
+    finally:
+        # タイマーのスレッドが開いた DB の接続を閉じる
+        connections.close_all()
+
+
+def _apply(user_ids):
+    """
+    ファイルロックを取って、スナップショットに user_ids の今のポイントを反映する
+
+    失敗してもコミット済みの変更は戻せないので、ログに残してスナップショットを捨てる
+    （捨てられなくても、LEADERBOARD_VERIFY_SECONDS 以内に DB と比べて作り直される）
+    """
+    if not user_ids or not os.path.exists(_path()):
+        return
+    try:
+        with _lock, _snapshot_lock():
+            board = _load()
+            if board is None or board.db_identity != db_identity():
+                _discard()
+                return
+            board = board.updated(list(user_ids), *_read_points(user_ids))
+            _write(board)
+            _install(board, _file_id(_path()))
+    except Exception:
+        logger.exception("順位表にポイントの変化を反映できませんでした（ユーザー %s）", list(user_ids)[:20])
+        with _lock:
+            try:
+                _discard()
+            except OSError:
+                logger.exception("順位表のスナップショットを捨てられませんでした")
@@ -0,0 +1,62 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from prediction.backtest import backtest, load_history
+from prediction.scoring import ScoringRules
+
+
+class Command(BaseCommand):
+    help = (
+        "採点ルールを変えたらランキングとポイントがどう変わるかを試算する"
+        "（UserPoint には書き込まない）。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "rules",
+            help='試すルール（JSON。例: \'{"in_top3": 1, "trifecta": 20}\'。省略した項目は既定値）',
+        )
+        parser.add_argument("--top", type=int, default=20, help="表示する、順位が大きく動いたユーザーの数")
+        parser.add_argument("--refresh", action="store_true", help="キャッシュを使わず DB から読み直す")
+        parser.add_argument("--json", action="store_true", help="結果を JSON で出力する")
+
+    def handle(self, *args, **options):
+        try:
+            rules = ScoringRules.from_dict(json.loads(options["rules"]))
+        except ValueError as exc:
+            raise CommandError(f"ルールを読み込めません: {exc}")
+
+        started = time.perf_counter()
+        history = load_history(refresh=options["refresh"])
+        loaded = time.perf_counter()
+        report = backtest(rules, history, top=options["top"])
+        finished = time.perf_counter()
+
+        if options["json"]:
+            self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+            return
+
+        self.stdout.write(
+            f"予想 {report['predictions']:,}件 / ユーザー {report['users']:,}人"
+            f"（読み込み {(loaded - started) * 1000:.0f}ms・試算 {(finished - loaded) * 1000:.0f}ms）"
+        )
+        self.stdout.write("\t".join(["", "合計", "平均", "中央値", "上位10%", "最高", "標準偏差"]))
+        for label in ("current", "proposed"):
+            d = report[label]
+            self.stdout.write("\t".join(map(str, [
+                "現在" if label == "current" else "変更後",
+                f"{d['total']:,}", d["mean"], d["median"], d["p90"], d["max"], d["std"],
+            ])))
+        changes = report["rank_changes"]
+        self.stdout.write(
+            f"順位が変わるユーザー: {changes['moved']}人（上がる {changes['up']}人・"
+            f"下がる {changes['down']}人・最大 {changes['max_shift']}位）"
+        )
+        for mover in report["movers"]:
+            (rank_before, rank_after), (points_before, points_after) = mover["rank"], mover["points"]
+            self.stdout.write(
+                f"  {mover['username'] or mover['user_id']}: {rank_before}位 → {rank_after}位"
+                f"（{points_before}点 → {points_after}点）"
+            )
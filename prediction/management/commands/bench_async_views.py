@@ -0,0 +1,131 @@
+import asyncio
+import statistics
+import threading
+import time
+
+from asgiref.sync import ThreadSensitiveContext
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import AsyncClient, Client
+from rest_framework.authtoken.models import Token
+
+from prediction.models import Race
+
+# (名前, 同期版のURL, 非同期版のURL)
+ENDPOINTS = [
+    ("races", "/api/races/", "/api/async/races/"),
+    ("horses", "/api/horses/?race_id={race_id}", "/api/async/horses/?race_id={race_id}"),
+    ("timeline", "/api/predictions/timeline/", "/api/async/timeline/"),
+    ("rankings", "/api/rankings/points/", "/api/async/rankings/points/"),
+    ("profile", "/api/users/me/profile/", "/api/async/users/me/profile/"),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "読み取りエンドポイントの同期版（WSGI・スレッド）と非同期版（ASGI・イベントループ）を"
+        "同じ同時接続数で叩き、スループットとレイテンシを比較する。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=500, help="エンドポイントごとのリクエスト数")
+        parser.add_argument("--concurrency", type=int, default=64, help="同時接続数")
+        parser.add_argument(
+            "--wsgi-threads",
+            type=int,
+            default=8,
+            help="WSGI ワーカーのスレッド数（これを超える同時接続は待たされる）",
+        )
+        parser.add_argument("--endpoint", action="append", help="対象を絞る（races, timeline ...）")
+
+    def handle(self, *args, **options):
+        token = Token.objects.select_related("user").first()
+        race = Race.objects.first()
+        if token is None or race is None:
+            raise CommandError("トークンを持つユーザーとレースが1件以上必要です。")
+        headers = {"Authorization": f"Token {token.key}"}
+
+        self.stdout.write(
+            f"requests={options['requests']} concurrency={options['concurrency']} "
+            f"wsgi_threads={options['wsgi_threads']} user={token.user.username}"
+        )
+        for name, sync_url, async_url in ENDPOINTS:
+            if options["endpoint"] and name not in options["endpoint"]:
+                continue
+            sync_url = sync_url.format(race_id=race.id)
+            async_url = async_url.format(race_id=race.id)
+
+            wsgi = self._run_wsgi(sync_url, headers, options)
+            asgi = asyncio.run(self._run_asgi(async_url, headers, options))
+            for label, result in (("wsgi", wsgi), ("asgi", asgi)):
+                self.stdout.write(
+                    f"{name:<9} {label}  {result['rps']:>8.1f} req/s  "
+                    f"p50={result['p50']:.1f}ms p95={result['p95']:.1f}ms p99={result['p99']:.1f}ms "
+                    f"errors={result['errors']}"
+                )
+        connections.close_all()
+
+    def _run_wsgi(self, url, headers, options):
+        """同時接続ぶんのクライアントスレッドが、限られたワーカースレッドを取り合う"""
+        workers = threading.BoundedSemaphore(options["wsgi_threads"])
+        per_client = self._per_client(options)
+        latencies, errors, lock = [], [0], threading.Lock()
+
+        def client_loop(count):
+            client = Client()
+            samples, failed = [], 0
+            for _ in range(count):
+                started = time.perf_counter()
+                with workers:
+                    response = client.get(url, headers=headers)
+                samples.append((time.perf_counter() - started) * 1000)
+                failed += response.status_code != 200
+            connections.close_all()
+            with lock:
+                latencies.extend(samples)
+                errors[0] += failed
+
+        threads = [threading.Thread(target=client_loop, args=(count,)) for count in per_client]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self._summarize(latencies, errors[0], time.perf_counter() - started)
+
+    async def _run_asgi(self, url, headers, options):
+        """同時接続ぶんのコルーチンを1つのイベントループで動かす"""
+        latencies, errors = [], 0
+
+        async def client_loop(count):
+            nonlocal errors
+            client = AsyncClient()
+            for _ in range(count):
+                started = time.perf_counter()
+                # ASGIHandler と同じく、リクエストごとに同期処理用のスレッドを分ける
+                async with ThreadSensitiveContext():
+                    response = await client.get(url, headers=headers)
+                latencies.append((time.perf_counter() - started) * 1000)
+                errors += response.status_code != 200
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client_loop(count) for count in self._per_client(options)))
+        return self._summarize(latencies, errors, time.perf_counter() - started)
+
+    def _per_client(self, options):
+        base, extra = divmod(options["requests"], options["concurrency"])
+        return [base + (1 if i < extra else 0) for i in range(options["concurrency"])]
+
+    def _summarize(self, latencies, errors, elapsed):
+        latencies.sort()
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] if latencies else 0.0
+
+        return {
+            "rps": len(latencies) / elapsed if elapsed else 0.0,
+            "p50": statistics.median(latencies) if latencies else 0.0,
+            "p95": percentile(0.95),
+            "p99": percentile(0.99),
+            "errors": errors,
+        }
@@ -0,0 +1,51 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from prediction.follow_graph import FollowGraph
+
+
+class Command(BaseCommand):
+    help = "フォローグラフ（CSR）の構築・おすすめ計算・更新の速さを測る。ランダムなグラフを使い、DBは使わない。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--edges", type=int, default=1_000_000)
+        parser.add_argument("--users", type=int, default=100_000)
+        parser.add_argument("--samples", type=int, default=1000, help="おすすめを計算するユーザー数")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options["seed"])
+        users, edges = options["users"], options["edges"]
+
+        # 人気のあるユーザーほどフォローされやすい（べき分布）
+        followers = rng.integers(1, users + 1, size=edges)
+        followeds = np.minimum((rng.pareto(1.2, size=edges) * users / 50).astype(np.int64) + 1, users)
+        pairs = np.unique(np.column_stack([followers, followeds])[followers != followeds], axis=0)
+
+        started = time.perf_counter()
+        graph = FollowGraph(np.arange(1, len(pairs) + 1), pairs[:, 0], pairs[:, 1])
+        self.stdout.write(f"構築      {len(graph):>10,}辺 {(time.perf_counter() - started) * 1000:8.1f}ms")
+
+        timings = []
+        for user_id in rng.integers(1, users + 1, size=options["samples"]):
+            started = time.perf_counter()
+            graph.suggestions(int(user_id))
+            timings.append(time.perf_counter() - started)
+        timings = np.array(timings) * 1000
+        self.stdout.write(
+            f"おすすめ  p50 {np.percentile(timings, 50):.2f}ms  p99 {np.percentile(timings, 99):.2f}ms"
+            f"  最大 {timings.max():.2f}ms（{options['samples']}人）"
+        )
+
+        updates = 20_000
+        next_id = len(pairs) + 1
+        started = time.perf_counter()
+        for i in range(updates):
+            if i % 2:
+                graph.remove(int(rng.integers(1, len(pairs) + 1)))
+            else:
+                graph.add(next_id + i, int(rng.integers(1, users + 1)), int(rng.integers(1, users + 1)))
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"更新      {updates:,}回 {elapsed * 1000:8.1f}ms（{updates / elapsed:,.0f}回/秒、配列の作り直しを含む）")
@@ -0,0 +1,57 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from prediction.scoring import ScoringRules
+
+
+class Command(BaseCommand):
+    help = "採点の評価関数（NumPy）を、1件ずつ照合する Python の実装と比べる。DBは使わない。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--predictions", type=int, default=1_000_000)
+        parser.add_argument("--races", type=int, default=1000)
+        parser.add_argument("--horses", type=int, default=18, help="1レースの出走頭数")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options["seed"])
+        n, races, horses = options["predictions"], options["races"], options["horses"]
+
+        # レースごとに出走馬の中から3頭（予想）と1〜3着（結果）を選ぶ
+        race_of = rng.integers(0, races, size=n)
+        picks = race_of[:, None] * horses + np.argsort(rng.random((n, horses)), axis=1)[:, :3] + 1
+        placings = np.arange(races)[:, None] * horses + np.argsort(rng.random((races, horses)), axis=1)[:, :3] + 1
+        row_placings = placings[race_of]
+
+        rules = {
+            "3/2/1": ScoringRules(),
+            "3/2/1 + 順不同1 + 馬単5 + 3連複5 + 3連単20": ScoringRules(
+                in_top3=1, exacta=5, trio=5, trifecta=20
+            ),
+        }
+        for label, scoring in rules.items():
+            started = time.perf_counter()
+            scores = scoring.evaluate(picks, row_placings)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"numpy   {label:<40} {n:>9,}件 {elapsed * 1000:8.1f}ms "
+                f"({n / elapsed / 1e6:.1f}M件/秒) 合計 {int(scores.sum()):,}点"
+            )
+
+        # 比較: 以前の1件ずつの照合（3/2/1）
+        sample = min(n, 200_000)
+        pick_rows, placing_rows = picks[:sample].tolist(), row_placings[:sample].tolist()
+        started = time.perf_counter()
+        total = 0
+        for pick, placing in zip(pick_rows, placing_rows):
+            total += sum(points for p, r, points in zip(pick, placing, (3, 2, 1)) if p == r)
+        elapsed = (time.perf_counter() - started) * n / sample
+        self.stdout.write(
+            f"python  {'3/2/1（1件ずつ）':<40} {n:>9,}件 {elapsed * 1000:8.1f}ms "
+            f"（{sample:,}件から換算）"
+        )
+        expected = int(ScoringRules().evaluate(picks[:sample], row_placings[:sample]).sum())
+        if total != expected:
+            raise CommandError(f"NumPy と1件ずつの照合で合計が合いません（NumPy {expected:,}点、1件ずつ {total:,}点）")
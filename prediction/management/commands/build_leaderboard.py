@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from prediction.leaderboard import build_leaderboard
+
+
+class Command(BaseCommand):
+    help = "ポイントの順位表のスナップショットを UserPoint から作り直す（デプロイ時やずれたときに）"
+
+    def handle(self, *args, **options):
+        total = build_leaderboard()
+        self.stdout.write(self.style.SUCCESS(f"✅ 順位表を作り直しました（{total}人）"))
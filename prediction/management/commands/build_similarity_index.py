@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from prediction.similarity import build_similarity_index, update_similarity_index
+
+
+class Command(BaseCommand):
+    help = (
+        "予想が似ているユーザーの索引（/api/friends/suggestions/）を作る。"
+        "夜間に全員分を作り直し、日中は --incremental で前回から予想したユーザーの分だけ更新する。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            help="前回の更新以降に予想したユーザーとその似ているユーザーの分だけ作り直す",
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        if options["incremental"]:
+            users = update_similarity_index()
+        else:
+            users = build_similarity_index()
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {users}人分の似ているユーザーを更新しました（{time.perf_counter() - started:.1f}秒）"
+        ))
@@ -0,0 +1,59 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, Max, OuterRef
+
+from prediction.change_log import assign_seqs
+from prediction.models import ChangeLog
+
+
+class Command(BaseCommand):
+    help = (
+        "差分同期用の変更ログを圧縮する。同じオブジェクトについては最新の1行だけを残す"
+        "（どの since から同期しても結果は変わらない）。削除済みユーザー向けの行も消す。"
+        "コミット後に seq を振れなかった行（プロセスが落ちたなど）にも先に seq を振る。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=10000,
+            help="1トランザクションで見る seq の幅（書き込みのロックを短く保つ）",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        assigned = assign_seqs()
+        max_seq = ChangeLog.objects.aggregate(max_seq=Max("seq"))["max_seq"] or 0
+
+        # 新しさは seq（コミットの順）で比べる。id で比べると、あとからコミットされた
+        # 小さい id の行を消して、それより後の since から同期した端末が取りこぼす
+        newer = ChangeLog.objects.filter(
+            kind=OuterRef("kind"),
+            object_id=OuterRef("object_id"),
+            seq__gt=OuterRef("seq"),
+        )
+        superseded = 0
+        for start in range(0, max_seq, batch_size):
+            with transaction.atomic():
+                deleted, _ = (
+                    ChangeLog.objects.filter(seq__gt=start, seq__lte=start + batch_size)
+                    .filter(Exists(newer))
+                    .delete()
+                )
+            superseded += deleted
+
+        orphaned, _ = (
+            ChangeLog.objects.filter(user__isnull=False)
+            .exclude(Exists(User.objects.filter(id=OuterRef("user_id"))))
+            .delete()
+        )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"✅ seq を {assigned} 行に振り、古い変更 {superseded} 行、"
+                f"削除済みユーザー向け {orphaned} 行を削除しました。"
+                f"（残り {ChangeLog.objects.count()} 行）"
+            )
+        )
@@ -0,0 +1,60 @@
+import calendar
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+
+from prediction.models import PointBucket
+from prediction.rankings import daily_buckets_since
+
+
+class Command(BaseCommand):
+    help = (
+        "期間ごとのランキング用の日ごとのポイントのうち、POINT_BUCKET_DAILY_DAYS より前の月の分を"
+        "ユーザーごと・月ごとの1行にまとめる（月間・シーズンの合計は変わらない）。"
+    )
+
+    def handle(self, *args, **options):
+        cutoff = daily_buckets_since()
+        months = sorted({
+            day.replace(day=1)
+            for day in PointBucket.objects.filter(period=PointBucket.DAY, start__lt=cutoff)
+            .order_by()
+            .values_list("start", flat=True)
+            .distinct()
+        })
+
+        compacted = 0
+        for month in months:
+            end = month + timedelta(days=calendar.monthrange(month.year, month.month)[1])
+            # 1か月分ずつ（書き込みのロックを短く保つ）
+            with transaction.atomic():
+                days = PointBucket.objects.select_for_update().filter(
+                    period=PointBucket.DAY, start__gte=month, start__lt=end
+                )
+                totals = dict(
+                    days.order_by().values("user_id").annotate(total=Sum("points")).values_list("user_id", "total")
+                )
+                existing = {
+                    bucket.user_id: bucket
+                    for bucket in PointBucket.objects.select_for_update().filter(
+                        period=PointBucket.MONTH, start=month, user_id__in=list(totals)
+                    )
+                }
+                created = []
+                for user_id, points in totals.items():
+                    bucket = existing.get(user_id)
+                    if bucket is None:
+                        created.append(PointBucket(user_id=user_id, period=PointBucket.MONTH, start=month, points=points))
+                    else:
+                        bucket.points += points
+                PointBucket.objects.bulk_create(created, batch_size=500)
+                PointBucket.objects.bulk_update(list(existing.values()), ["points"], batch_size=500)
+                deleted, _ = days.delete()
+            compacted += deleted
+            self.stdout.write(f"{month:%Y-%m}: {deleted}行 → {len(totals)}行")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {cutoff} より前の日ごとのポイントを月ごとにまとめました（{compacted}行）"
+        ))
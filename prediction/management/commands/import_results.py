@@ -0,0 +1,41 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from prediction.result_import import ResultImportError, import_results, parse_results
+
+
+class Command(BaseCommand):
+    help = (
+        "開催まるごとのレース結果を CSV / JSON から取り込み、まとめて採点する。"
+        "列: race, first_place, second_place, third_place（ID または名前）"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("file", type=str)
+        parser.add_argument(
+            "--format",
+            choices=["csv", "json"],
+            help="ファイル形式（省略時は拡張子から判定）",
+        )
+
+    def handle(self, *args, **options):
+        path = Path(options["file"])
+        fmt = options["format"] or ("json" if path.suffix.lower() == ".json" else "csv")
+        try:
+            content = path.read_text(encoding="utf-8-sig")
+        except OSError as exc:
+            raise CommandError(f"ファイルを読み込めません: {exc}")
+
+        try:
+            summary = import_results(parse_results(content, fmt))
+        except ResultImportError as exc:
+            for error in exc.errors:
+                prefix = f"{error['row']}行目: " if error["row"] else ""
+                self.stderr.write(f"{prefix}{error['error']}")
+            raise CommandError("エラーがあるため取り込みませんでした。")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ 追加 {summary['created']}件・修正 {summary['updated']}件・変更なし {summary['unchanged']}件"
+            f"（{summary['scored_users']}人のポイントを更新）"
+        ))
@@ -0,0 +1,140 @@
+import sqlite3
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections, router, transaction
+
+
+class Command(BaseCommand):
+    help = (
+        "SQLite のデータを PostgreSQL に一括コピーする。"
+        "移行先は事前に migrate 済みであること。"
+        "全テーブルを COPY でバッチ投入し、シーケンスをリセットして件数を照合する。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sqlite",
+            default=str(settings.SQLITE_PATH),
+            help="移行元の SQLite ファイル（既定: db.sqlite3）",
+        )
+        parser.add_argument(
+            "--database",
+            default=DEFAULT_DB_ALIAS,
+            help="移行先のデータベースエイリアス",
+        )
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument(
+            "--noinput",
+            "--no-input",
+            action="store_false",
+            dest="interactive",
+            help="確認なしで実行する",
+        )
+
+    def handle(self, *args, **options):
+        target = connections[options["database"]]
+        if target.vendor != "postgresql":
+            raise CommandError(
+                f"移行先 '{options['database']}' が PostgreSQL ではありません（{target.vendor}）。"
+                "DB_ENGINE=postgresql を設定してください。"
+            )
+
+        source = sqlite3.connect(f"file:{options['sqlite']}?mode=ro", uri=True)
+        source_tables = {
+            name for (name,) in source.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        }
+
+        models = self._models(options["database"])
+        if options["interactive"]:
+            answer = input(
+                f"移行先 '{target.settings_dict['NAME']}' の {len(models)} テーブルを空にしてからコピーします。"
+                "続行しますか？ [y/N]: "
+            )
+            if answer.lower() != "y":
+                raise CommandError("中止しました。")
+
+        started = time.perf_counter()
+        with transaction.atomic(using=options["database"]):
+            with target.cursor() as cursor:
+                # migrate で作られた contenttypes 等も移行元の ID で入れ直す
+                for sql in target.ops.sql_flush(
+                    no_style(),
+                    [model._meta.db_table for model in models],
+                    allow_cascade=True,
+                ):
+                    cursor.execute(sql)
+
+                copied = {}
+                for model in models:
+                    table = model._meta.db_table
+                    if table not in source_tables:
+                        self.stdout.write(self.style.WARNING(f"  skip {table}（移行元に存在しません）"))
+                        continue
+                    copied[table] = self._copy_table(source, cursor, model, options["batch_size"])
+                    self.stdout.write(f"  {table}: {copied[table]} rows")
+
+                for sql in target.ops.sequence_reset_sql(no_style(), models):
+                    cursor.execute(sql)
+
+                self._verify(source, cursor, copied)
+
+        source.close()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"✅ {len(copied)} テーブル / {sum(copied.values())} 行を移行しました"
+                f"（{time.perf_counter() - started:.1f}s）"
+            )
+        )
+
+    def _models(self, database):
+        """移行対象のモデル（M2M の中間テーブルを含む）"""
+        models, tables = [], set()
+        for model in apps.get_models(include_auto_created=True):
+            opts = model._meta
+            if opts.proxy or not opts.managed or opts.db_table in tables:
+                continue
+            if not router.allow_migrate_model(database, model):
+                continue
+            tables.add(opts.db_table)
+            models.append(model)
+        return models
+
+    def _copy_table(self, source, cursor, model, batch_size):
+        table = model._meta.db_table
+        source_columns = {row[1] for row in source.execute(f'PRAGMA table_info("{table}")')}
+        columns = [
+            field.column
+            for field in model._meta.concrete_fields
+            if field.column in source_columns
+        ]
+        quote = cursor.db.ops.quote_name
+        select_sql = "SELECT {} FROM \"{}\"".format(", ".join(f'"{c}"' for c in columns), table)
+        copy_sql = f"COPY {quote(table)} ({', '.join(quote(c) for c in columns)}) FROM STDIN"
+
+        # Django のカーソルの下にある psycopg のカーソルで COPY を使う
+        raw_cursor = cursor.cursor
+        rows = source.execute(select_sql)
+        total = 0
+        while batch := rows.fetchmany(batch_size):
+            with raw_cursor.copy(copy_sql) as copy:
+                for row in batch:
+                    copy.write_row(row)
+            total += len(batch)
+        return total
+
+    def _verify(self, source, cursor, copied):
+        """移行元と移行先の件数を照合し、ずれがあればロールバックする"""
+        quote = cursor.db.ops.quote_name
+        mismatches = []
+        for table, count in copied.items():
+            (expected,) = source.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()
+            cursor.execute(f"SELECT COUNT(*) FROM {quote(table)}")
+            (actual,) = cursor.fetchone()
+            if expected != actual or count != actual:
+                mismatches.append(f"{table}: sqlite={expected} postgresql={actual}")
+        if mismatches:
+            raise CommandError("件数が一致しません（ロールバックしました）:\n" + "\n".join(mismatches))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from prediction.deletion import delete_user_in_chunks
+from prediction.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = (
+        "退会を受け付けたユーザーのデータを少しずつ削除する（cron などで定期実行）。"
+        "短いトランザクションに分けるので、レース当日の書き込みを長く止めない。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", type=int, action="append", help="対象ユーザーID（退会受付がなくても削除する）")
+        parser.add_argument("--chunk-size", type=int, default=500, help="1トランザクションで削除する件数")
+        parser.add_argument("--pause", type=float, default=0.05, help="チャンクの間に空ける秒数")
+
+    def handle(self, *args, **options):
+        user_ids = options["user"] or list(
+            UserProfile.objects.filter(deletion_requested_at__isnull=False)
+            .order_by("deletion_requested_at")
+            .values_list("user_id", flat=True)
+        )
+        if not user_ids:
+            self.stdout.write("削除待ちのユーザーはいません。")
+            return
+
+        for user_id in user_ids:
+            counts = delete_user_in_chunks(
+                user_id, chunk_size=options["chunk_size"], pause=options["pause"]
+            )
+            details = ", ".join(f"{name}={count}" for name, count in counts.items() if count)
+            self.stdout.write(self.style.SUCCESS(f"✅ ユーザー {user_id} を削除しました（{details}）"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from prediction.consensus import rebuild_consensus
+
+
+class Command(BaseCommand):
+    help = "みんなの予想の集計を予想から数え直す（集計がずれたときの修復用）"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--race", type=int, action="append", help="対象レースID（省略時は全レース）")
+
+    def handle(self, *args, **options):
+        horses = rebuild_consensus(options["race"])
+        self.stdout.write(self.style.SUCCESS(f"✅ みんなの予想を数え直しました（{horses}頭分）"))
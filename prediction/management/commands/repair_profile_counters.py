@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from prediction.profile_counters import repair_profile_counters
+
+
+class Command(BaseCommand):
+    help = "プロフィールの件数（予想・フォロワー・フォロー中・グループ・メッセージ）を数え直す（ずれたときの修復用）"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", type=int, action="append", help="対象ユーザーID（省略時は全ユーザー）")
+
+    def handle(self, *args, **options):
+        repaired = repair_profile_counters(options["user"])
+        self.stdout.write(self.style.SUCCESS(f"✅ プロフィールの件数を数え直しました（{repaired}人分を修正）"))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from prediction.models import RaceResult
+from prediction.scoring import score_races
+
+
+class Command(BaseCommand):
+    help = (
+        "結果が出ているレースを現在の採点ルール（settings.SCORING_RULES）で採点し直す。"
+        "前回の採点との差分だけがポイントに反映される。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--race", type=int, action="append", help="対象レースID（省略時は全レース）")
+        parser.add_argument("--batch-size", type=int, default=50, help="1回の採点でまとめるレース数")
+
+    def handle(self, *args, **options):
+        race_ids = options["race"] or list(
+            RaceResult.objects.order_by("race_id").values_list("race_id", flat=True)
+        )
+        batch_size = options["batch_size"]
+        changed_users = set()
+        for start in range(0, len(race_ids), batch_size):
+            deltas = score_races(race_ids[start:start + batch_size])
+            changed_users.update(user_id for user_id, delta in deltas.items() if delta)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {len(race_ids)}レースを採点し直しました（ポイントが変わったユーザー: {len(changed_users)}人）"
+        ))
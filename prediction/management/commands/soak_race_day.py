@@ -0,0 +1,258 @@
+import json
+import random
+import statistics
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, OperationalError, connection, connections
+from django.test import Client
+from rest_framework.authtoken.models import Token
+
+from prediction.models import Horse, Race, RaceResult
+
+SOAK_PREFIX = "soak"
+
+
+class Command(BaseCommand):
+    help = (
+        "レース当日の書き込み競合を再現するソークテスト。"
+        "予想の投稿（/api/predictions/）と結果登録（採点シグナル）を並行実行し、"
+        "ロック待ち・失敗数・レイテンシを計測する。"
+        "本番DBではなく DB_NAME でファイルDBを指定して実行すること"
+        "（既定の db.sqlite3 には --allow-default-db を付けないと実行しない）。"
+        "投入したユーザー・レースは終了時に削除する（--keep-data で残す）。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--duration", type=float, default=30.0, help="実行秒数")
+        parser.add_argument("--predictors", type=int, default=8, help="予想を投稿するスレッド数")
+        parser.add_argument("--admins", type=int, default=2, help="結果を登録するスレッド数")
+        parser.add_argument("--users", type=int, default=200)
+        parser.add_argument("--races", type=int, default=12)
+        parser.add_argument("--horses", type=int, default=16, help="1レースあたりの頭数")
+        parser.add_argument(
+            "--result-interval",
+            type=float,
+            default=0.5,
+            help="結果登録スレッドが次の結果を登録するまでの秒数",
+        )
+        parser.add_argument(
+            "--lock-wait-ms",
+            type=float,
+            default=100.0,
+            help="この時間を超えた書き込みをロック待ちとして数える",
+        )
+        parser.add_argument(
+            "--baseline",
+            action="store_true",
+            help="WAL/busy_timeout/IMMEDIATE を外した Django 既定の接続設定で実行（比較用）",
+        )
+        parser.add_argument("--json", action="store_true", help="結果をJSONで出力")
+        parser.add_argument(
+            "--allow-default-db",
+            action="store_true",
+            help="既定の db.sqlite3 に対しても実行する（ソーク用のデータを書き込む）",
+        )
+        parser.add_argument("--keep-data", action="store_true", help="投入したユーザー・レースを削除しない")
+
+    def handle(self, *args, **options):
+        settings_dict = connections.settings["default"]
+        if settings_dict["ENGINE"] != "django.db.backends.sqlite3":
+            raise CommandError("SQLite のファイルDBに対してのみ実行できます。")
+        if ":memory:" in str(settings_dict["NAME"]) or "mode=memory" in str(settings_dict["NAME"]):
+            raise CommandError("インメモリDBでは競合を再現できません。DB_NAME にファイルを指定してください。")
+        if Path(settings_dict["NAME"]).resolve() == Path(settings.SQLITE_PATH).resolve() and not options["allow_default_db"]:
+            raise CommandError(
+                f"既定のDB（{settings.SQLITE_PATH}）には実行しません。"
+                "DB_NAME=/tmp/soak.sqlite3 のように別のファイルを指定してください"
+                "（どうしても実行するなら --allow-default-db）。"
+            )
+
+        if options["baseline"]:
+            self._use_baseline_settings(settings_dict)
+
+        call_command("migrate", verbosity=0, interactive=False)
+        tokens, races = self._seed(options)
+        connection.close()
+        try:
+            report = self._run(options, tokens, races)
+        finally:
+            if not options["keep_data"]:
+                self._cleanup()
+
+        if options["json"]:
+            self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+            return
+
+        self.stdout.write(f"profile: {report['profile']}  duration: {options['duration']}s")
+        for kind, summary in report["operations"].items():
+            self.stdout.write(
+                f"{kind:<10} ok={summary['ok']:<6} failed={summary['failed']:<4} "
+                f"locked={summary['locked']:<4} lock_waits={summary['lock_waits']:<5} "
+                f"p50={summary['p50_ms']}ms p95={summary['p95_ms']}ms "
+                f"p99={summary['p99_ms']}ms max={summary['max_ms']}ms"
+            )
+
+        failed = sum(summary["failed"] for summary in report["operations"].values())
+        if failed:
+            self.stdout.write(self.style.ERROR(f"❌ {failed} 件の書き込みが失敗しました。"))
+        else:
+            self.stdout.write(self.style.SUCCESS("✅ 書き込みの失敗はありませんでした。"))
+
+    def _run(self, options, tokens, races):
+        """予想の投稿と結果登録を並行して実行し、計測結果を返す"""
+        stats = {"prediction": [], "result": []}
+        lock = threading.Lock()
+        deadline = time.monotonic() + options["duration"]
+
+        workers = [
+            threading.Thread(target=self._predictor, args=(tokens, races, deadline, stats, lock))
+            for _ in range(options["predictors"])
+        ] + [
+            # 同じレースの結果を同時に作らないよう、スレッドごとに担当レースを分ける
+            threading.Thread(
+                target=self._admin,
+                args=(races[i :: options["admins"]], options["result_interval"], deadline, stats, lock),
+            )
+            for i in range(options["admins"])
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        return {
+            "profile": "baseline" if options["baseline"] else "tuned",
+            "duration": options["duration"],
+            "operations": {
+                kind: self._summarize(samples, options["lock_wait_ms"])
+                for kind, samples in stats.items()
+            },
+        }
+
+    def _use_baseline_settings(self, settings_dict):
+        """比較用に Django 既定の接続設定へ戻す（新しく開く接続にのみ効く）"""
+        connection.close()
+        settings_dict["CONN_MAX_AGE"] = 0
+        settings_dict["OPTIONS"] = {}
+        with connection.cursor() as cursor:
+            # journal_mode はファイルに永続化されるため明示的に戻す
+            cursor.execute("PRAGMA journal_mode=DELETE")
+        connection.close()
+
+    def _seed(self, options):
+        """ソーク用のユーザー・トークン・レース・馬を用意する"""
+        users = []
+        for i in range(options["users"]):
+            user, _ = User.objects.get_or_create(username=f"{SOAK_PREFIX}_user_{i}")
+            users.append(user)
+        tokens = [Token.objects.get_or_create(user=user)[0].key for user in users]
+
+        races = []
+        for i in range(options["races"]):
+            race, _ = Race.objects.get_or_create(name=f"[{SOAK_PREFIX}] Race {i + 1}")
+            horse_ids = list(race.horses.values_list("id", flat=True))
+            missing = options["horses"] - len(horse_ids)
+            if missing > 0:
+                Horse.objects.bulk_create(
+                    Horse(name=f"Horse {len(horse_ids) + n + 1}", race=race)
+                    for n in range(missing)
+                )
+                horse_ids = list(race.horses.values_list("id", flat=True))
+            races.append((race.id, horse_ids))
+        return tokens, races
+
+    def _cleanup(self):
+        """投入したレース（馬・結果・予想ごと）とユーザーを削除する"""
+        Race.objects.filter(name__startswith=f"[{SOAK_PREFIX}] ").delete()
+        User.objects.filter(username__startswith=f"{SOAK_PREFIX}_user_").delete()
+        connections.close_all()
+
+    def _predictor(self, tokens, races, deadline, stats, lock):
+        client = Client()
+        samples = []
+        try:
+            while time.monotonic() < deadline:
+                race_id, horse_ids = random.choice(races)
+                first, second, third = random.sample(horse_ids, 3)
+                samples.append(
+                    self._timed(
+                        lambda: client.post(
+                            "/api/predictions/",
+                            {
+                                "race": race_id,
+                                "first_position": first,
+                                "second_position": second,
+                                "third_position": third,
+                            },
+                            content_type="application/json",
+                            HTTP_AUTHORIZATION=f"Token {random.choice(tokens)}",
+                        ),
+                        expected_status=201,
+                    )
+                )
+        finally:
+            connections.close_all()
+        with lock:
+            stats["prediction"].extend(samples)
+
+    def _admin(self, races, interval, deadline, stats, lock):
+        samples = []
+
+        def save_result(race_id, horse_ids):
+            # 作成時のみ採点シグナルが走るため、作り直して毎回採点させる
+            RaceResult.objects.filter(race_id=race_id).delete()
+            first, second, third = random.sample(horse_ids, 3)
+            RaceResult.objects.create(
+                race_id=race_id,
+                first_place_id=first,
+                second_place_id=second,
+                third_place_id=third,
+            )
+
+        try:
+            while time.monotonic() < deadline:
+                race_id, horse_ids = random.choice(races)
+                samples.append(self._timed(lambda: save_result(race_id, horse_ids)))
+                time.sleep(interval)
+        finally:
+            connections.close_all()
+        with lock:
+            stats["result"].extend(samples)
+
+    def _timed(self, func, expected_status=None):
+        """(所要ミリ秒, 成否, ロックエラーか) を返す"""
+        started = time.perf_counter()
+        ok, locked = True, False
+        try:
+            response = func()
+            if expected_status is not None and response.status_code != expected_status:
+                ok = False
+        except DatabaseError as exc:
+            ok = False
+            locked = isinstance(exc, OperationalError) and "locked" in str(exc)
+        return (time.perf_counter() - started) * 1000, ok, locked
+
+    def _summarize(self, samples, lock_wait_ms):
+        latencies = sorted(elapsed for elapsed, _, _ in samples)
+
+        def percentile(p):
+            if not latencies:
+                return 0.0
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 1)
+
+        return {
+            "ok": sum(1 for _, ok, _ in samples if ok),
+            "failed": sum(1 for _, ok, _ in samples if not ok),
+            "locked": sum(1 for _, _, locked in samples if locked),
+            "lock_waits": sum(1 for elapsed in latencies if elapsed > lock_wait_ms),
+            "p50_ms": round(statistics.median(latencies), 1) if latencies else 0.0,
+            "p95_ms": percentile(0.95),
+            "p99_ms": percentile(0.99),
+            "max_ms": round(latencies[-1], 1) if latencies else 0.0,
+        }
@@ -0,0 +1,95 @@
+"""
+グループのメンバー判定と、一覧用の集計
+
+- is_member(): メンバーかどうかを所属テーブルの一意索引 (グループ, ユーザー) の
+  EXISTS で調べ、GROUP_MEMBERSHIP_CACHE_SECONDS だけキャッシュする
+  （group.members.all() を全員分読み込まない）。メンバーが変わったらグループの版を
+  変えて古い結果を使わない（m2m_changed のシグナルから。prediction/signals.py）
+- groups_with_activity(): 参加しているグループに、メンバー数・未読数・最新の
+  メッセージを付けて1クエリで返す
+- 未読: GroupReadState.last_read_id より新しい、他のメンバーのメッセージ
+"""
+
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import GroupMessage, GroupReadState, PredictionGroup
+
+Membership = PredictionGroup.members.through
+
+
+def _version_key(group_id):
+    return f"group_members_version:{group_id}"
+
+
+def _member_key(group_id, user_id):
+    return f"group_member:{group_id}:{cache.get(_version_key(group_id), 0)}:{user_id}"
+
+
+def is_member(user_id, group_id):
+    """user_id が group_id のメンバーか"""
+    key = _member_key(group_id, user_id)
+    member = cache.get(key)
+    if member is None:
+        member = Membership.objects.filter(predictiongroup_id=group_id, user_id=user_id).exists()
+        cache.set(key, member, settings.GROUP_MEMBERSHIP_CACHE_SECONDS)
+    return member
+
+
+def invalidate_members(group_ids):
+    """グループのメンバー判定のキャッシュを破棄する（版を変える）"""
+    cache.set_many({_version_key(group_id): uuid.uuid4().hex for group_id in group_ids}, None)
+
+
+def groups_with_activity(user):
+    """
+    user が参加しているグループ（最新のメッセージが新しい順）
+
+    各グループに member_count, unread_count, last_message_id, last_message_content,
+    last_message_sender, last_message_at を付ける
+    """
+    latest = GroupMessage.objects.filter(group=OuterRef("pk")).order_by("-id")
+    last_read = GroupReadState.objects.filter(group=OuterRef("group"), user=user).values("last_read_id")[:1]
+    unread = (
+        GroupMessage.objects.filter(group=OuterRef("pk"))
+        .exclude(sender=user)
+        .filter(id__gt=Coalesce(Subquery(last_read), Value(0)))
+        .order_by()
+        .values("group")
+        .annotate(n=Count("pk"))
+        .values("n")
+    )
+    members = (
+        Membership.objects.filter(predictiongroup_id=OuterRef("pk"))
+        .order_by()
+        .values("predictiongroup_id")
+        .annotate(n=Count("pk"))
+        .values("n")
+    )
+    return (
+        PredictionGroup.objects.filter(members=user)
+        .annotate(
+            member_count=Coalesce(Subquery(members, output_field=IntegerField()), 0),
+            unread_count=Coalesce(Subquery(unread, output_field=IntegerField()), 0),
+            last_message_id=Subquery(latest.values("id")[:1]),
+            last_message_content=Subquery(latest.values("content")[:1]),
+            last_message_sender=Subquery(latest.values("sender__username")[:1]),
+            last_message_at=Subquery(latest.values("timestamp")[:1]),
+        )
+        .order_by(F("last_message_id").desc(nulls_last=True), "name")
+    )
+
+
+def mark_read(user, group_id):
+    """グループのメッセージを最新まで既読にする"""
+    latest = (
+        GroupMessage.objects.filter(group_id=group_id).order_by("-id").values_list("id", flat=True).first()
+    )
+    if latest is not None:
+        GroupReadState.objects.update_or_create(
+            group_id=group_id, user=user, defaults={"last_read_id": latest}
+        )
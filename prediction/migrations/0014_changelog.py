@@ -0,0 +1,60 @@
+# Generated by Django 5.2.4 on 2026-10-19 22:30
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+# 導入前からあるオブジェクトも since=0 の初回同期で取れるように記録しておく
+BACKFILL = [
+    ("Race", "race", None),
+    ("Horse", "horse", None),
+    ("RaceResult", "race_result", None),
+    ("Prediction", "prediction", "user_id"),
+    ("Follow", "follow", "follower_id"),
+]
+
+
+def backfill_change_log(apps, schema_editor):
+    ChangeLog = apps.get_model("prediction", "ChangeLog")
+    for model_name, kind, audience in BACKFILL:
+        model = apps.get_model("prediction", model_name)
+        fields = ["id", audience] if audience else ["id"]
+        ChangeLog.objects.bulk_create(
+            (
+                ChangeLog(
+                    kind=kind,
+                    object_id=row[0],
+                    op="upsert",
+                    user_id=row[1] if audience else None,
+                )
+                for row in model.objects.order_by("id").values_list(*fields).iterator()
+            ),
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prediction', '0013_userpoint_hit_rate'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('op', models.CharField(choices=[('upsert', 'upsert'), ('delete', 'delete')], max_length=6)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('user', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'object_id', 'id'], name='changelog_object_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_change_log, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.4 on 2026-10-19 22:35
+
+from django.db import migrations, models
+
+
+def backfill_scores(apps, schema_editor):
+    """結果が出ているレースの予想に得点を入れる（ポイントは加算済みなので触らない）"""
+    Prediction = apps.get_model("prediction", "Prediction")
+    RaceResult = apps.get_model("prediction", "RaceResult")
+
+    placings = {
+        race_id: places
+        for race_id, *places in RaceResult.objects.values_list(
+            "race_id", "first_place_id", "second_place_id", "third_place_id"
+        )
+    }
+    changed = []
+    for prediction in Prediction.objects.filter(race_id__in=list(placings)).iterator():
+        picks = (
+            prediction.first_position_id,
+            prediction.second_position_id,
+            prediction.third_position_id,
+        )
+        prediction.score = sum(
+            points
+            for pick, placing, points in zip(picks, placings[prediction.race_id], (3, 2, 1))
+            if placing is not None and pick == placing
+        )
+        changed.append(prediction)
+    Prediction.objects.bulk_update(changed, ["score"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prediction', '0015_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='prediction',
+            name='score',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_scores, migrations.RunPython.noop),
+    ]
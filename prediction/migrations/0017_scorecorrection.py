@@ -0,0 +1,26 @@
+# Generated by Django 5.2.4 on 2026-10-19 22:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prediction', '0016_prediction_score'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScoreCorrection',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('previous_places', models.JSONField()),
+                ('new_places', models.JSONField()),
+                ('affected_predictions', models.PositiveIntegerField(default=0)),
+                ('user_deltas', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('race', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='score_corrections', to='prediction.race')),
+            ],
+        ),
+    ]
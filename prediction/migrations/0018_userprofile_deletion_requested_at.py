@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-19 22:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prediction', '0017_scorecorrection'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='deletion_requested_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
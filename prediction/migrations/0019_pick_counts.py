@@ -0,0 +1,82 @@
+# Generated by Django 5.2.4 on 2026-10-19 22:47
+
+import django.db.models.deletion
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_pick_counts(apps, schema_editor):
+    """既存の予想を数えて、みんなの予想の集計を作る"""
+    Prediction = apps.get_model("prediction", "Prediction")
+    HorsePickCount = apps.get_model("prediction", "HorsePickCount")
+    TrifectaPickCount = apps.get_model("prediction", "TrifectaPickCount")
+
+    counts = defaultdict(dict)
+    for position in ("first", "second", "third"):
+        for horse_id, race_id, n in (
+            Prediction.objects.values_list(f"{position}_position_id", "race_id")
+            .annotate(n=Count("id")).order_by()
+        ):
+            counts[horse_id, race_id][position] = n
+    HorsePickCount.objects.bulk_create(
+        [
+            HorsePickCount(horse_id=horse_id, race_id=race_id, **positions)
+            for (horse_id, race_id), positions in counts.items()
+        ],
+        batch_size=500,
+    )
+    TrifectaPickCount.objects.bulk_create(
+        [
+            TrifectaPickCount(
+                race_id=race_id,
+                first_position_id=first,
+                second_position_id=second,
+                third_position_id=third,
+                count=n,
+            )
+            for race_id, first, second, third, n in (
+                Prediction.objects.values_list(
+                    "race_id", "first_position_id", "second_position_id", "third_position_id",
+                ).annotate(n=Count("id")).order_by()
+            )
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prediction', '0018_userprofile_deletion_requested_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HorsePickCount',
+            fields=[
+                ('horse', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='pick_count', serialize=False, to='prediction.horse')),
+                ('first', models.IntegerField(default=0)),
+                ('second', models.IntegerField(default=0)),
+                ('third', models.IntegerField(default=0)),
+                ('race', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='prediction.race')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TrifectaPickCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.IntegerField(default=0)),
+                ('first_position', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='prediction.horse')),
+                ('race', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='prediction.race')),
+                ('second_position', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='prediction.horse')),
+                ('third_position', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='prediction.horse')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['race', '-count'], name='trifecta_popular_idx')],
+                'unique_together': {('race', 'first_position', 'second_position', 'third_position')},
+            },
+        ),
+        migrations.RunPython(backfill_pick_counts, migrations.RunPython.noop),
+    ]
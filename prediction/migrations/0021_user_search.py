@@ -0,0 +1,48 @@
+# Generated by Django 5.2.4 on 2026-10-19 23:40
+
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    """ユーザー検索の索引（prediction/user_search.py）"""
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS prediction_usersearch"
+            " USING fts5(username, email, tokenize='trigram')"
+        )
+        schema_editor.execute(
+            "INSERT INTO prediction_usersearch (rowid, username, email)"
+            " SELECT id, username, COALESCE(email, '') FROM auth_user"
+        )
+    elif vendor == "postgresql":
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS auth_user_username_trgm"
+            " ON auth_user USING gin (username gin_trgm_ops)"
+        )
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS auth_user_email_trgm"
+            " ON auth_user USING gin (email gin_trgm_ops)"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        schema_editor.execute("DROP TABLE IF EXISTS prediction_usersearch")
+    elif vendor == "postgresql":
+        schema_editor.execute("DROP INDEX IF EXISTS auth_user_username_trgm")
+        schema_editor.execute("DROP INDEX IF EXISTS auth_user_email_trgm")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('prediction', '0020_similaruser'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
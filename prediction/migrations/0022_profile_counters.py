@@ -0,0 +1,68 @@
+# Generated by Django 5.2.4 on 2026-10-19 22:59
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_profile_counters(apps, schema_editor):
+    """既存のデータを数えて、プロフィールの件数を入れる"""
+    UserProfile = apps.get_model("prediction", "UserProfile")
+    Prediction = apps.get_model("prediction", "Prediction")
+    Follow = apps.get_model("prediction", "Follow")
+    GroupMessage = apps.get_model("prediction", "GroupMessage")
+    PredictionGroup = apps.get_model("prediction", "PredictionGroup")
+
+    def counted(model, field):
+        return Coalesce(
+            Subquery(
+                model.objects.filter(**{field: OuterRef("user_id")})
+                .order_by().values(field).annotate(n=Count("pk")).values("n"),
+                output_field=IntegerField(),
+            ),
+            0,
+        )
+
+    UserProfile.objects.update(
+        predictions_count=counted(Prediction, "user"),
+        followers_count=counted(Follow, "followed"),
+        following_count=counted(Follow, "follower"),
+        groups_count=counted(PredictionGroup.members.through, "user"),
+        messages_count=counted(GroupMessage, "sender"),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prediction', '0021_user_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='followers_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='following_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='groups_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='messages_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='predictions_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_profile_counters, migrations.RunPython.noop),
+    ]
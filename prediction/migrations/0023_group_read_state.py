@@ -0,0 +1,62 @@
+# Generated by Django 5.2.4 on 2026-10-19 23:03
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def mark_existing_messages_read(apps, schema_editor):
+    """既存のメッセージは既読にしておく（導入時に全部が未読にならないよう）"""
+    PredictionGroup = apps.get_model("prediction", "PredictionGroup")
+    GroupMessage = apps.get_model("prediction", "GroupMessage")
+    GroupReadState = apps.get_model("prediction", "GroupReadState")
+
+    latest = dict(GroupMessage.objects.values_list("group_id").annotate(latest=Max("id")).order_by())
+    GroupReadState.objects.bulk_create(
+        [
+            GroupReadState(group_id=group_id, user_id=user_id, last_read_id=latest[group_id])
+            for group_id, user_id in PredictionGroup.members.through.objects.filter(
+                predictiongroup_id__in=list(latest)
+            ).values_list("predictiongroup_id", "user_id")
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prediction', '0022_profile_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GroupReadState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='groupmessage',
+            index=models.Index(fields=['group', '-id'], name='groupmessage_latest_idx'),
+        ),
+        migrations.AddField(
+            model_name='groupreadstate',
+            name='group',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='prediction.predictiongroup'),
+        ),
+        migrations.AddField(
+            model_name='groupreadstate',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterUniqueTogether(
+            name='groupreadstate',
+            unique_together={('group', 'user')},
+        ),
+        migrations.RunPython(mark_existing_messages_read, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.4 on 2026-10-19 23:07
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def create_member_standings(apps, schema_editor):
+    """今のメンバー全員の順位表の行を 0 点で作る（既存のグループ予想は rescore_races で採点する）"""
+    PredictionGroup = apps.get_model("prediction", "PredictionGroup")
+    GroupStanding = apps.get_model("prediction", "GroupStanding")
+    GroupStanding.objects.bulk_create(
+        [
+            GroupStanding(group_id=group_id, user_id=user_id)
+            for group_id, user_id in PredictionGroup.members.through.objects.values_list(
+                "predictiongroup_id", "user_id"
+            )
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prediction', '0023_group_read_state'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='groupprediction',
+            name='score',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='GroupStanding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('points', models.IntegerField(default=0)),
+                ('scored_predictions', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='standings', to='prediction.predictiongroup')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['group', '-points'], name='groupstanding_rank_idx')],
+                'unique_together': {('group', 'user')},
+            },
+        ),
+        migrations.RunPython(create_member_standings, migrations.RunPython.noop),
+    ]
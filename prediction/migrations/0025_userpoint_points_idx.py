@@ -0,0 +1,19 @@
+# Generated by Django 5.2.4 on 2026-10-19 23:09
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prediction', '0024_group_standings'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userpoint',
+            index=models.Index(fields=['-points'], name='userpoint_points_idx'),
+        ),
+    ]
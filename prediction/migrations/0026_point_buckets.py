@@ -0,0 +1,54 @@
+# Generated by Django 5.2.4 on 2026-10-19 23:15
+
+import django.db.models.deletion
+from django.conf import settings
+from collections import Counter
+
+from django.db import migrations, models
+
+
+def fill_point_buckets(apps, schema_editor):
+    """採点済みの予想の得点を、レースの開催日（未定なら予想した日）ごとに集計して入れる"""
+    Prediction = apps.get_model("prediction", "Prediction")
+    PointBucket = apps.get_model("prediction", "PointBucket")
+    totals = Counter()
+    for user_id, race_date, created_at, score in (
+        Prediction.objects.filter(score__isnull=False)
+        .exclude(score=0)
+        .values_list("user_id", "race__date", "created_at", "score")
+        .iterator()
+    ):
+        totals[user_id, race_date or created_at.date()] += score
+    PointBucket.objects.bulk_create(
+        [
+            PointBucket(user_id=user_id, period="day", start=day, points=points)
+            for (user_id, day), points in totals.items()
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prediction', '0025_userpoint_points_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PointBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', '日'), ('month', '月')], default='day', max_length=5)),
+                ('start', models.DateField()),
+                ('points', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['start', 'user', 'points'], name='pointbucket_range_idx')],
+                'unique_together': {('user', 'period', 'start')},
+            },
+        ),
+        migrations.RunPython(fill_point_buckets, migrations.RunPython.noop),
+    ]
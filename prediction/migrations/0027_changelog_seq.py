@@ -0,0 +1,26 @@
+# Generated by Django 5.2.4 on 2026-10-19 23:26
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def number_existing_logs(apps, schema_editor):
+    """既存の行はコミット済みなので、id をそのまま seq にする（配信済みの since と同じ値）"""
+    ChangeLog = apps.get_model("prediction", "ChangeLog")
+    ChangeLog.objects.update(seq=F("id"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prediction', '0026_point_buckets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='changelog',
+            name='seq',
+            field=models.BigIntegerField(blank=True, null=True, unique=True),
+        ),
+        migrations.RunPython(number_existing_logs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.4 on 2026-10-19 23:40
+
+from django.db import migrations
+
+# 短い語の検索（prediction/user_search.py）で使う、小文字にしたユーザー名・メールアドレスの索引。
+# PostgreSQL は範囲検索が文字コード順になるよう "C" の照合順序にする
+INDEXES = {
+    "sqlite": [
+        "CREATE INDEX IF NOT EXISTS auth_user_username_lower ON auth_user (LOWER(username))",
+        "CREATE INDEX IF NOT EXISTS auth_user_email_lower ON auth_user (LOWER(email))",
+    ],
+    "postgresql": [
+        'CREATE INDEX IF NOT EXISTS auth_user_username_lower ON auth_user ((LOWER(username) COLLATE "C"))',
+        'CREATE INDEX IF NOT EXISTS auth_user_email_lower ON auth_user ((LOWER(email) COLLATE "C"))',
+    ],
+}
+
+
+def create_prefix_index(apps, schema_editor):
+    for sql in INDEXES.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def drop_prefix_index(apps, schema_editor):
+    if schema_editor.connection.vendor in INDEXES:
+        schema_editor.execute("DROP INDEX IF EXISTS auth_user_username_lower")
+        schema_editor.execute("DROP INDEX IF EXISTS auth_user_email_lower")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('prediction', '0028_idempotency_request_hash'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_prefix_index, drop_prefix_index),
+    ]
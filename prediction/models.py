@@ -27,6 +27,8 @@ class Prediction(models.Model):
     third_position = models.ForeignKey(Horse, on_delete=models.CASCADE, related_name='third_predictions')
     comment = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # 採点結果（prediction/scoring.py）。結果が出るまでは None
+    score = models.IntegerField(blank=True, null=True)
 
     def __str__(self):
         return f"{self.race.name}: 1着 {self.first_position.name}, 2着 {self.second_position.name}, 3着 {self.third_position.name}"
@@ -42,10 +44,29 @@ class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     profile_image = models.ImageField(upload_to='profile_images/', blank=True, null=True)
     updated_at = models.DateTimeField(auto_now=True)  # ← これを追加！
+    # 退会の受付日時。データは process_user_deletions が少しずつ削除する
+    deletion_requested_at = models.DateTimeField(blank=True, null=True, db_index=True)
+    # 件数（prediction/profile_counters.py がシグナルから F 式で増減させる）
+    predictions_count = models.IntegerField(default=0)
+    followers_count = models.IntegerField(default=0)
+    following_count = models.IntegerField(default=0)
+    groups_count = models.IntegerField(default=0)
+    messages_count = models.IntegerField(default=0)
+
+    COUNTER_FIELDS = ('predictions_count', 'followers_count', 'following_count', 'groups_count', 'messages_count')
 
     def __str__(self):
         return self.user.username
 
+    def save(self, *args, **kwargs):
+        # 件数は F 式でだけ更新する（読み込んだときの古い値で上書きしない）
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
 class PredictionGroup(models.Model):
     name = models.CharField(max_length=100, unique=True)
     members = models.ManyToManyField(User, related_name='prediction_groups')
@@ -59,6 +80,12 @@ class GroupMessage(models.Model):
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # グループの最新のメッセージ・未読数（ID の新しい順）
+            models.Index(fields=['group', '-id'], name='groupmessage_latest_idx'),
+        ]
+
 class GroupPrediction(models.Model):
     group = models.ForeignKey(PredictionGroup, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -67,6 +94,8 @@ class GroupPrediction(models.Model):
     second_position = models.ForeignKey(Horse, on_delete=models.CASCADE, related_name='group_second_predictions')
     third_position = models.ForeignKey(Horse, on_delete=models.CASCADE, related_name='group_third_predictions')
     submitted_at = models.DateTimeField(auto_now_add=True)
+    # 採点結果（prediction/scoring.py が Prediction と同じ採点で書き込む。未採点は None）
+    score = models.IntegerField(blank=True, null=True)
 
     def __str__(self):
         return f"{self.group.name} - {self.user.username} - {self.race.name}"
@@ -86,5 +115,211 @@ class UserPoint(models.Model):
     points = models.IntegerField(default=0)
     hit_rate = models.FloatField(default=0.0)
 
+    class Meta:
+        indexes = [
+            # ランキング（ポイントの高い順）
+            models.Index(fields=['-points'], name='userpoint_points_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user.username}: {self.points} pt"
+
+
+class PointBucket(models.Model):
+    """
+    期間ごとのポイント（週間・月間・シーズン・直近N日のランキング用）
+
+    採点（prediction/scoring.py）のたびに、レースの開催日（未定なら予想した日）の
+    日ごとの行に差分を足す。古い日ごとの行は compact_point_buckets で月ごとの行にまとめる
+    """
+    DAY = 'day'
+    MONTH = 'month'
+    PERIOD_CHOICES = [(DAY, '日'), (MONTH, '月')]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    period = models.CharField(max_length=5, choices=PERIOD_CHOICES, default=DAY)
+    start = models.DateField()  # 日ごとならその日、月ごとならその月の1日
+    points = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'period', 'start')
+        indexes = [
+            # 期間の集計（期間内の行だけを索引から読む）
+            models.Index(fields=['start', 'user', 'points'], name='pointbucket_range_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}: {self.period} {self.start} ({self.points})"
+
+
+class ChangeLog(models.Model):
+    """
+    差分同期用の変更ログ（/api/changes/）
+
+    同期位置は seq。id は INSERT の順なので、長いトランザクションが後から小さい id で
+    コミットされると取りこぼす。seq はコミット後に1か所（change_log.assign_seqs）で
+    コミットされた順に振るので、配信済みの seq より前に行が増えることはない。
+    内容は持たず「どのオブジェクトが更新/削除されたか」だけを記録し、配信時に最新の値を読む。
+    user が空の行は全員向け（レース・馬・結果）、それ以外は本人向け。
+    """
+    UPSERT = 'upsert'
+    DELETE = 'delete'
+    OP_CHOICES = [(UPSERT, 'upsert'), (DELETE, 'delete')]
+
+    kind = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    op = models.CharField(max_length=6, choices=OP_CHOICES)
+    # ユーザー削除のカスケード中にも行が書かれるので、外部キー制約は付けない
+    user = models.ForeignKey(
+        User, on_delete=models.DO_NOTHING, db_constraint=False,
+        null=True, blank=True, related_name='+',
+    )
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    # コミット後に振る同期位置（振るまでは None で、配信しない）
+    seq = models.BigIntegerField(null=True, blank=True, unique=True)
+
+    class Meta:
+        indexes = [
+            # compact_change_log で同じオブジェクトの古い行を探す
+            models.Index(fields=['kind', 'object_id', 'id'], name='changelog_object_idx'),
+        ]
+
+    def __str__(self):
+        return f"#{self.id} {self.op} {self.kind}:{self.object_id}"
+
+
+class IdempotencyKey(models.Model):
+    """
+    一括予想投稿（/api/predictions/bulk/）の再送対策
+
+    モバイルが通信エラーで同じリクエストを再送しても二重登録しないよう、
+    Idempotency-Key ヘッダーごとに最初のレスポンスを保存して返す。
+    同じキーで中身の違うリクエストが来たら（クライアントの不具合）、保存したレスポンスは返さない。
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    key = models.CharField(max_length=64)
+    # 最初のリクエストの予想（正規化したもの）の SHA-256
+    request_hash = models.CharField(max_length=64, blank=True, default='')
+    status_code = models.PositiveSmallIntegerField()
+    response = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('user', 'key')
+
+    def __str__(self):
+        return f"{self.user_id}:{self.key}"
+
+
+class ScoreCorrection(models.Model):
+    """
+    レース結果の修正（審議・入力ミスの訂正）による再採点の記録
+
+    places は (1着, 2着, 3着) の馬ID。user_deltas は {ユーザーID: ポイントの増減}
+    """
+    race = models.ForeignKey(Race, on_delete=models.CASCADE, related_name='score_corrections')
+    previous_places = models.JSONField()
+    new_places = models.JSONField()
+    affected_predictions = models.PositiveIntegerField(default=0)
+    user_deltas = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.race.name} の結果修正（{self.created_at:%Y-%m-%d %H:%M}）"
+
+
+class HorsePickCount(models.Model):
+    """
+    みんなの予想（prediction/consensus.py）: 馬ごとに何人が何着に選んだか
+
+    予想の登録・修正・削除のたびに増減させる（レースの予想を毎回数え直さない）
+    """
+    horse = models.OneToOneField(Horse, on_delete=models.CASCADE, primary_key=True, related_name='pick_count')
+    race = models.ForeignKey(Race, on_delete=models.CASCADE, related_name='+')
+    first = models.IntegerField(default=0)
+    second = models.IntegerField(default=0)
+    third = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.horse.name}: {self.first}/{self.second}/{self.third}"
+
+
+class TrifectaPickCount(models.Model):
+    """みんなの予想: (1着, 2着, 3着) の組み合わせごとの予想数"""
+    race = models.ForeignKey(Race, on_delete=models.CASCADE, related_name='+')
+    first_position = models.ForeignKey(Horse, on_delete=models.CASCADE, related_name='+')
+    second_position = models.ForeignKey(Horse, on_delete=models.CASCADE, related_name='+')
+    third_position = models.ForeignKey(Horse, on_delete=models.CASCADE, related_name='+')
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('race', 'first_position', 'second_position', 'third_position')
+        indexes = [
+            # いちばん人気の組み合わせ
+            models.Index(fields=['race', '-count'], name='trifecta_popular_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.race_id}: {self.first_position_id}-{self.second_position_id}-{self.third_position_id} ({self.count})"
+
+
+class SimilarUser(models.Model):
+    """
+    予想の似ているユーザー（prediction/similarity.py が夜間にまとめて計算する）
+
+    score は (馬, 着順) の選び方のコサイン類似度。common_picks は同じ馬を同じ着順に選んだ数
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    similar_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+    common_picks = models.PositiveIntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('user', 'similar_user')
+        indexes = [
+            models.Index(fields=['user', '-score'], name='similaruser_top_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} ~ {self.similar_user_id} ({self.score:.2f})"
+
+
+class GroupReadState(models.Model):
+    """
+    グループのメッセージをどこまで読んだか（prediction/membership.py）
+
+    last_read_id より新しい、他のメンバーのメッセージを未読として数える
+    """
+    group = models.ForeignKey(PredictionGroup, on_delete=models.CASCADE, related_name='+')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    last_read_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('group', 'user')
+
+    def __str__(self):
+        return f"{self.user_id} @ {self.group_id}: {self.last_read_id}"
+
+
+class GroupStanding(models.Model):
+    """
+    グループ内の順位表（メンバーごとのグループ予想の合計得点）
+
+    採点（prediction/scoring.py）のたびに前回との差分だけ足す（グループの予想を毎回合計しない）
+    """
+    group = models.ForeignKey(PredictionGroup, on_delete=models.CASCADE, related_name='standings')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    points = models.IntegerField(default=0)
+    scored_predictions = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('group', 'user')
+        indexes = [
+            models.Index(fields=['group', '-points'], name='groupstanding_rank_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.group_id}: {self.user_id} ({self.points})"
@@ -0,0 +1,85 @@
+"""
+プロフィールの件数（UserProfile の predictions_count など）
+
+プロフィールやランキングを表示するたびに予想・フォロワーなどを数えないよう、
+件数を UserProfile に持っておき、増減はシグナル（prediction/signals.py）から
+F 式の UPDATE で行う（同時に増減しても取りこぼさない）。
+
+- 予想: Prediction の登録・削除、一括登録（predictions_bulk_created）
+- フォロワー・フォロー中: Follow の登録・削除（両方のユーザー）
+- グループ: PredictionGroup.members の追加・削除（m2m_changed）、グループの削除
+- メッセージ: GroupMessage の送信・削除
+- ずれたとき（シグナルを通らない更新など）は manage.py repair_profile_counters で数え直す
+"""
+
+from collections import defaultdict
+
+from django.contrib.auth.models import User
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Follow, GroupMessage, Prediction, PredictionGroup, UserProfile
+
+
+def adjust(counter, deltas):
+    """
+    deltas: {user_id: 増減}。同じ増減のユーザーは UPDATE 1本にまとめる
+
+    プロフィールのないユーザーは飛ばす（repair_profile_counters で作られる）
+    """
+    by_amount = defaultdict(list)
+    for user_id, n in deltas.items():
+        if n:
+            by_amount[n].append(user_id)
+    for n, user_ids in by_amount.items():
+        UserProfile.objects.filter(user_id__in=user_ids).update(**{counter: F(counter) + n})
+
+
+def _counted(queryset, field):
+    """queryset を field（ユーザー）ごとに数えるサブクエリ"""
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{field: OuterRef("user_id")})
+            .order_by()
+            .values(field)
+            .annotate(n=Count("pk"))
+            .values("n"),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+def expected_counts():
+    """各件数を数え直す式 {フィールド名: 式}"""
+    return {
+        "predictions_count": _counted(Prediction.objects.all(), "user"),
+        "followers_count": _counted(Follow.objects.all(), "followed"),
+        "following_count": _counted(Follow.objects.all(), "follower"),
+        "groups_count": _counted(PredictionGroup.members.through.objects.all(), "user"),
+        "messages_count": _counted(GroupMessage.objects.all(), "sender"),
+    }
+
+
+def repair_profile_counters(user_ids=None):
+    """
+    件数を数え直して、ずれていたプロフィールだけ直す
+
+    戻り値: 直したプロフィールの数
+    """
+    users = User.objects.all() if user_ids is None else User.objects.filter(pk__in=user_ids)
+    missing = users.filter(userprofile__isnull=True).values_list("pk", flat=True)
+    UserProfile.objects.bulk_create([UserProfile(user_id=user_id) for user_id in missing], batch_size=500)
+
+    profiles = UserProfile.objects.all()
+    if user_ids is not None:
+        profiles = profiles.filter(user_id__in=user_ids)
+    expected = {f"expected_{name}": value for name, value in expected_counts().items()}
+    wrong = Q()
+    for name in UserProfile.COUNTER_FIELDS:
+        wrong |= ~Q(**{name: F(f"expected_{name}")})
+    wrong_ids = list(profiles.annotate(**expected).filter(wrong).values_list("pk", flat=True))
+
+    if wrong_ids:
+        UserProfile.objects.filter(pk__in=wrong_ids).update(**expected_counts())
+    return len(wrong_ids)
@@ -0,0 +1,149 @@
+"""
+ランキング
+
+- friends_ranking(): 自分とフォロー中のユーザーの中でのポイントランキング。
+  フォロー先はサブクエリで渡す（何千人フォローしていても1クエリ、パラメータも増えない）。
+  結果はユーザーごとに「フォロー先の版 × ポイントの版」をキーにキャッシュするので、
+  フォロー・解除か採点があるまでは DB を引かない
+- period_ranking(): 週間・月間・シーズン・直近N日のポイントランキング。
+  期間内の PointBucket（日ごと、古い分は月ごと）を足すだけで、予想は読まない。
+  1人あたり足す行は期間の日数（古い月は1か月1行）まで。採点があるまでキャッシュする
+"""
+
+import calendar
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models import F, Q, Sum, Value, Window
+from django.db.models.functions import Coalesce, Rank
+from django.utils import timezone
+
+from .follow_cache import following_version
+from .models import Follow, PointBucket
+from .scoring import points_version
+
+PERIODS = ("week", "month", "season", "rolling")
+
+
+def _friends_key(user_id):
+    return f"friends_ranking:{user_id}:{following_version(user_id)}:{points_version()}"
+
+
+def friends_ranking(user):
+    """
+    user とフォロー中のユーザーのポイントランキング（ポイントの高い順。同点は同じ順位）
+
+    戻り値: [{"rank", "user_id", "username", "profile_image", "points", "hit_rate",
+              "predictions_count"}, ...]。profile_image は MEDIA_URL からの相対パス（なければ None）
+    """
+    key = _friends_key(user.id)
+    rows = cache.get(key)
+    if rows is not None:
+        return rows
+
+    followed = Follow.objects.filter(follower=user).values("followed_id")
+    points = Coalesce(F("userpoint__points"), Value(0))
+    queryset = (
+        User.objects.filter(Q(id__in=followed) | Q(id=user.id))
+        .annotate(
+            points=points,
+            rank=Window(Rank(), order_by=points.desc()),
+        )
+        .values(
+            "id",
+            "username",
+            "points",
+            "rank",
+            "userpoint__hit_rate",
+            "userprofile__profile_image",
+            "userprofile__predictions_count",
+        )
+        .order_by("-points", "id")
+    )
+    rows = [
+        {
+            "rank": row["rank"],
+            "user_id": row["id"],
+            "username": row["username"],
+            "profile_image": row["userprofile__profile_image"] or None,
+            "points": row["points"],
+            "hit_rate": row["userpoint__hit_rate"] or 0,
+            "predictions_count": row["userprofile__predictions_count"] or 0,
+        }
+        for row in queryset
+    ]
+    cache.set(key, rows, settings.FRIENDS_RANKING_CACHE_SECONDS)
+    return rows
+
+
+def daily_buckets_since(today=None):
+    """この日以降は日ごとの PointBucket が残っている（compact_point_buckets が月ごとにまとめない）"""
+    today = today or timezone.now().date()
+    return (today - timedelta(days=settings.POINT_BUCKET_DAILY_DAYS)).replace(day=1)
+
+
+def period_bounds(period, on=None, days=None):
+    """
+    期間の (最初の日, 最後の日の翌日)
+
+    period: week（月曜から）, month, season（1月〜12月）, rolling（on までの直近 days 日）
+    on: 期間に含む日（省略時は今日）
+    日ごとの集計が必要なのに月ごとにまとめ済みの期間なら ValueError
+    """
+    today = timezone.now().date()
+    on = on or today
+    if period == "week":
+        start = on - timedelta(days=on.weekday())
+        end = start + timedelta(days=7)
+    elif period == "month":
+        start = on.replace(day=1)
+        end = start + timedelta(days=calendar.monthrange(on.year, on.month)[1])
+    elif period == "season":
+        start = on.replace(month=1, day=1)
+        end = start.replace(year=start.year + 1)
+    elif period == "rolling":
+        if days is None or not 1 <= days <= settings.POINT_BUCKET_DAILY_DAYS:
+            raise ValueError(f"days は 1〜{settings.POINT_BUCKET_DAILY_DAYS} で指定してください")
+        end = on + timedelta(days=1)
+        start = end - timedelta(days=days)
+    else:
+        raise ValueError(f"period は {', '.join(PERIODS)} のどれかを指定してください")
+
+    # 週や直近N日は月の途中で切れるので、日ごとの行が残っている期間だけ
+    if period in ("week", "rolling") and start < daily_buckets_since(today):
+        raise ValueError("日ごとの集計が残っていない期間です（月間・シーズンのランキングを使ってください）")
+    return start, end
+
+
+def period_ranking(start, end):
+    """
+    start 〜 end（end は含まない）のポイントランキング（ポイントの高い順。同点は同じ順位）
+
+    期間内にポイントの増減があったユーザーだけ
+    戻り値: [{"rank", "user_id", "username", "points"}, ...]
+    """
+    key = f"period_ranking:{start}:{end}:{points_version()}"
+    rows = cache.get(key)
+    if rows is not None:
+        return rows
+
+    total = Sum("points")
+    queryset = (
+        PointBucket.objects.filter(start__gte=start, start__lt=end)
+        .values("user_id", "user__username")
+        .annotate(total=total, rank=Window(Rank(), order_by=total.desc()))
+        .order_by("-total", "user_id")
+    )
+    rows = [
+        {
+            "rank": row["rank"],
+            "user_id": row["user_id"],
+            "username": row["user__username"],
+            "points": row["total"],
+        }
+        for row in queryset
+    ]
+    cache.set(key, rows, settings.PERIOD_RANKING_CACHE_SECONDS)
+    return rows
@@ -0,0 +1,181 @@
+"""
+開催まるごとのレース結果の取り込み（manage.py import_results / POST /api/race-results/import/）
+
+1行 = 1レース。レースと馬は ID でも名前でも指定できる。
+
+    race,first_place,second_place,third_place
+    有馬記念,ドウデュース,スターズオンアース,シャフリヤール
+    12,183,190,177
+
+- レースと馬の解決はそれぞれ1クエリ
+- 1件でもエラーがあれば何も書き込まない
+- 追加・修正した結果を1トランザクションで保存し、まとめて1回だけ採点する
+"""
+
+import csv
+import io
+import json
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .change_log import record_changes
+from .models import ChangeLog, Horse, Race, RaceResult
+from .scoring import score_races
+
+PLACE_FIELDS = ("first_place", "second_place", "third_place")
+COLUMNS = ("race",) + PLACE_FIELDS
+
+
+class ResultImportError(Exception):
+    """取り込めない行がある（errors: [{"row": 行番号, "error": メッセージ}]）"""
+
+    def __init__(self, errors):
+        super().__init__(f"{len(errors)}件のエラーがあります")
+        self.errors = errors
+
+
+def parse_results(content, fmt):
+    """CSV / JSON の文字列を行（dict）のリストにする"""
+    if fmt == "json":
+        try:
+            data = json.loads(content)
+        except ValueError:
+            raise ResultImportError([{"row": None, "error": "JSONとして読み込めません"}])
+        if isinstance(data, dict):
+            data = data.get("results")
+        if not isinstance(data, list):
+            raise ResultImportError([{"row": None, "error": "results に結果のリストを指定してください"}])
+        return data
+    return list(csv.DictReader(io.StringIO(content)))
+
+
+def _ref(value):
+    """ID（数字）なら int、それ以外は名前として str"""
+    if isinstance(value, int):
+        return value
+    value = str(value or "").strip()
+    return int(value) if value.isdigit() else value
+
+
+def _lookup(refs_by_name, ids, ref, label):
+    if isinstance(ref, int):
+        return (ref, None) if ref in ids else (None, f"{label}（ID: {ref}）が見つかりません")
+    matches = refs_by_name.get(ref, [])
+    if not matches:
+        return None, f"{label}「{ref}」が見つかりません"
+    if len(matches) > 1:
+        return None, f"{label}「{ref}」が複数あります。IDで指定してください"
+    return matches[0], None
+
+
+def resolve_results(rows):
+    """各行のレース・馬を ID に解決する。戻り値: {race_id: (1着, 2着, 3着)}"""
+    errors = []
+    parsed = []
+    for number, row in enumerate(rows, start=1):
+        if not isinstance(row, dict) or not all(str(row.get(column) or "").strip() for column in COLUMNS):
+            errors.append({"row": number, "error": "race, first_place, second_place, third_place を入力してください"})
+            continue
+        parsed.append((number, _ref(row["race"]), [_ref(row[field]) for field in PLACE_FIELDS]))
+
+    # レース（ID・名前どちらでも）を1クエリで
+    race_refs = {ref for _, ref, _ in parsed}
+    race_ids_in_file = {ref for ref in race_refs if isinstance(ref, int)}
+    race_names = {ref for ref in race_refs if isinstance(ref, str)}
+    races_by_name, race_ids = {}, set()
+    for race_id, name in Race.objects.filter(
+        Q(id__in=race_ids_in_file) | Q(name__in=race_names)
+    ).values_list("id", "name"):
+        race_ids.add(race_id)
+        races_by_name.setdefault(name, []).append(race_id)
+
+    resolved_races = []
+    for number, race_ref, place_refs in parsed:
+        race_id, error = _lookup(races_by_name, race_ids, race_ref, "レース")
+        if error:
+            errors.append({"row": number, "error": error})
+        else:
+            resolved_races.append((number, race_id, place_refs))
+
+    # 出走馬を1クエリで
+    horses_by_race = {}
+    for horse_id, name, race_id in Horse.objects.filter(
+        race_id__in={race_id for _, race_id, _ in resolved_races}
+    ).values_list("id", "name", "race_id"):
+        ids, by_name = horses_by_race.setdefault(race_id, (set(), {}))
+        ids.add(horse_id)
+        by_name.setdefault(name, []).append(horse_id)
+
+    results = {}
+    for number, race_id, place_refs in resolved_races:
+        horse_ids, horses_by_name = horses_by_race.get(race_id, (set(), {}))
+        places = []
+        for place_ref in place_refs:
+            horse_id, error = _lookup(horses_by_name, horse_ids, place_ref, "出走馬")
+            if error:
+                errors.append({"row": number, "error": error})
+                break
+            places.append(horse_id)
+        else:
+            if len(set(places)) != 3:
+                errors.append({"row": number, "error": "同じ馬が複数の着順に入っています"})
+            elif race_id in results:
+                errors.append({"row": number, "error": "同じレースの結果が複数あります"})
+            else:
+                results[race_id] = tuple(places)
+
+    if errors:
+        raise ResultImportError(sorted(errors, key=lambda error: error["row"] or 0))
+    return results
+
+
+def import_results(rows):
+    """
+    結果を一括で追加・修正し、変わったレースをまとめて採点する
+
+    戻り値: {"created", "updated", "unchanged", "scored_users"}
+    """
+    results = resolve_results(rows)
+
+    with transaction.atomic():
+        existing = {
+            race_result.race_id: race_result
+            for race_result in RaceResult.objects.select_for_update().filter(race_id__in=list(results))
+        }
+        now = timezone.now()
+        created, updated, previous = [], [], {}
+        for race_id, places in results.items():
+            race_result = existing.get(race_id)
+            if race_result is None:
+                created.append(RaceResult(
+                    race_id=race_id,
+                    first_place_id=places[0],
+                    second_place_id=places[1],
+                    third_place_id=places[2],
+                ))
+                continue
+
+            current = (race_result.first_place_id, race_result.second_place_id, race_result.third_place_id)
+            if current != places:
+                previous[race_id] = current
+                race_result.first_place_id, race_result.second_place_id, race_result.third_place_id = places
+                race_result.updated_at = now
+                updated.append(race_result)
+
+        # bulk 系は post_save が飛ばないので、変更ログと採点はここでまとめて行う
+        RaceResult.objects.bulk_create(created)
+        RaceResult.objects.bulk_update(updated, [*PLACE_FIELDS, "updated_at"])
+        record_changes(RaceResult, created + updated, ChangeLog.UPSERT)
+        deltas = score_races(
+            [race_result.race_id for race_result in created + updated],
+            previous=previous,
+        )
+
+    return {
+        "created": len(created),
+        "updated": len(updated),
+        "unchanged": len(results) - len(created) - len(updated),
+        "scored_users": len(deltas),
+    }
@@ -0,0 +1,521 @@
+"""
+予想の採点
+
+採点ルール（settings.SCORING_RULES）は ScoringRules にまとめ、NumPy で
+(1着, 2着, 3着) の予想の配列を結果と一度に照合する。採点はすべてここを通す。
+
+レース結果が入ったら（1レースでも開催まるごとでも）score_races() で
+対象レースをまとめて採点する。結果の出たレースの予想をあとから登録・修正したときは
+score_predictions_by_id() でその予想だけ採点する。
+
+- 予想ごとの得点は Prediction.score に保存（未採点は None）
+- ユーザーのポイントには前回の採点との差分だけを足す
+  （何度採点し直しても、ルールを変えて採点し直しても二重に加算されない）
+- ポイントと的中率の更新は、対象レースが何件あってもユーザーごとに1回
+- 結果の修正では、着順が変わった馬を選んだ予想だけを採点し直す
+- グループ予想（GroupPrediction）も同じ採点で同じトランザクションの中で採点し、
+  グループの順位表（GroupStanding）に差分だけ足す
+- 期間ごとのランキング用に、ポイントの増減をレースの開催日（未定なら予想した日）の
+  PointBucket にも足す
+"""
+
+import uuid
+from collections import defaultdict
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, Q, Sum
+from django.db.models.functions import Cast
+
+from .group_standings import ensure_standings
+from .models import (
+    GroupPrediction,
+    GroupStanding,
+    PointBucket,
+    Prediction,
+    RaceResult,
+    ScoreCorrection,
+    UserPoint,
+)
+from .signals import points_changed, races_scored
+
+# ポイントの版（ポイントが変わるたびに変わる。ポイントから作ったキャッシュのキーに使う）
+POINTS_VERSION_KEY = "points:version"
+
+# 着順が決まっていないところの値（馬IDは正の数なので、どの予想とも一致しない）
+NO_HORSE = -1
+
+DEFAULT_SCORING_RULES = {
+    "exact": (3, 2, 1),  # 1着・2着・3着をその着順で的中
+    "in_top3": 0,  # 3着以内には入ったが着順が違う馬（1頭あたり）
+    "exacta": 0,  # 1着・2着を着順どおりに的中（馬単）
+    "trio": 0,  # 3頭とも3着以内（順不同、3連複）
+    "trifecta": 0,  # 3頭とも着順どおり（3連単）
+}
+
+
+class ScoringRules:
+    """採点ルール。使わない項目（0点）は計算から外す"""
+
+    def __init__(self, exact=(3, 2, 1), in_top3=0, exacta=0, trio=0, trifecta=0):
+        self.exact = np.asarray(exact, dtype=np.int64)
+        if self.exact.shape != (3,):
+            raise ValueError("exact には1着・2着・3着の3つの得点を指定してください")
+        self.in_top3 = int(in_top3)
+        self.exacta = int(exacta)
+        self.trio = int(trio)
+        self.trifecta = int(trifecta)
+
+    @classmethod
+    def from_dict(cls, rules):
+        """{"exact": [3, 2, 1], "trifecta": 20, ...} から。省略した項目は既定値"""
+        if not isinstance(rules, dict):
+            raise ValueError("採点ルールは項目名と得点の組で指定してください")
+        unknown = set(rules) - set(DEFAULT_SCORING_RULES)
+        if unknown:
+            raise ValueError(f"不明な採点ルールの項目です: {', '.join(sorted(unknown))}")
+        try:
+            return cls(**{**DEFAULT_SCORING_RULES, **rules})
+        except (TypeError, ValueError) as exc:
+            raise ValueError(f"採点ルールの得点が不正です: {exc}")
+
+    @classmethod
+    def from_settings(cls):
+        return cls.from_dict(getattr(settings, "SCORING_RULES", {}))
+
+    def as_dict(self):
+        return {
+            "exact": self.exact.tolist(),
+            "in_top3": self.in_top3,
+            "exacta": self.exacta,
+            "trio": self.trio,
+            "trifecta": self.trifecta,
+        }
+
+    def evaluate(self, picks, placings):
+        """
+        picks: (n, 3) の予想した馬ID
+        placings: (n, 3) または全件共通の (3,) の着順の馬ID（未確定は NO_HORSE）
+        戻り値: (n,) の得点
+        """
+        picks = np.asarray(picks, dtype=np.int64).reshape(-1, 3)
+        placings = np.broadcast_to(np.asarray(placings, dtype=np.int64), picks.shape)
+
+        exact = picks == placings
+        scores = exact @ self.exact
+        if self.in_top3 or self.trio:
+            in_top3 = (picks[:, :, None] == placings[:, None, :]).any(axis=2)
+            if self.in_top3:
+                scores += (in_top3 & ~exact).sum(axis=1) * self.in_top3
+            if self.trio:
+                scores += in_top3.all(axis=1) * self.trio
+        if self.exacta:
+            scores += (exact[:, 0] & exact[:, 1]) * self.exacta
+        if self.trifecta:
+            scores += exact.all(axis=1) * self.trifecta
+        return scores
+
+
+def placings_array(places):
+    """(1着, 2着, 3着)（None を含む）を evaluate() に渡せる形に"""
+    return [NO_HORSE if horse_id is None else horse_id for horse_id in places]
+
+
+def score_prediction(picks, placings):
+    """(1着, 2着, 3着) の予想を結果と照合した得点（1件）"""
+    return int(ScoringRules.from_settings().evaluate([picks], placings_array(placings))[0])
+
+
+def hit_stats_queryset(user_ids):
+    """ユーザーごとの予想数と的中数（着順ごとの一致数）を1クエリで集計"""
+
+    def hit(position, place):
+        return Cast(
+            Q(**{f"{position}_id": F(f"race__raceresult__{place}_id")}),
+            IntegerField(),
+        )
+
+    return (
+        Prediction.objects.filter(user_id__in=user_ids)
+        .values("user_id")
+        .annotate(
+            total=Count("id"),
+            hits=Sum(
+                hit("first_position", "first_place")
+                + hit("second_position", "second_place")
+                + hit("third_position", "third_place")
+            ),
+        )
+    )
+
+
+def hit_rate(total, hits):
+    """的中率（%、小数第1位まで）。1予想 = 3頭"""
+    if not total:
+        return 0
+    return round(((hits or 0) / (total * 3)) * 100, 1)
+
+
+def moved_horses(previous, current):
+    """修正の前後で着順（圏外を含む）が変わった馬"""
+    before = {horse_id: position for position, horse_id in enumerate(previous) if horse_id}
+    after = {horse_id: position for position, horse_id in enumerate(current) if horse_id}
+    return {
+        horse_id
+        for horse_id in before.keys() | after.keys()
+        if before.get(horse_id) != after.get(horse_id)
+    }
+
+
+def score_races(race_ids, previous=None):
+    """
+    レースの予想をまとめて採点し、ユーザーのポイントと的中率を更新する
+
+    previous: 結果を修正したレースの修正前の着順 {race_id: (1着, 2着, 3着)}。
+      指定したレースは着順が変わった馬を選んだ予想だけを採点し直し
+      （得点はそれ以外の予想では変わらない）、ScoreCorrection に記録する。
+
+    戻り値: {user_id: ポイントの増減}
+    """
+    race_ids = set(race_ids)
+    previous = {race_id: tuple(places) for race_id, places in (previous or {}).items() if race_id in race_ids}
+    if not race_ids:
+        return {}
+
+    with transaction.atomic():
+        placings = _race_placings(race_ids)
+
+        targets = Q(race_id__in=race_ids - previous.keys())
+        for race_id, places in previous.items():
+            horses = moved_horses(places, placings.get(race_id, (None, None, None)))
+            if horses:
+                targets |= Q(race_id=race_id) & (
+                    Q(first_position_id__in=horses)
+                    | Q(second_position_id__in=horses)
+                    | Q(third_position_id__in=horses)
+                )
+
+        rows = _prediction_rows(targets)
+        deltas, changed, corrections, affected, buckets = _apply_rules(rows, placings, previous)
+
+        Prediction.objects.bulk_update(changed, ["score"], batch_size=500)
+        update_user_totals(deltas)
+        update_point_buckets(buckets)
+        _score_group_predictions(targets, placings)
+        ScoreCorrection.objects.bulk_create(
+            ScoreCorrection(
+                race_id=race_id,
+                previous_places=list(places),
+                new_places=list(placings.get(race_id, (None, None, None))),
+                affected_predictions=affected[race_id],
+                user_deltas={str(user_id): delta for user_id, delta in corrections[race_id].items()},
+            )
+            for race_id, places in previous.items()
+            if places != placings.get(race_id)
+        )
+        races_scored.send(sender=Prediction, race_ids=race_ids, user_ids=set(deltas))
+
+    return dict(deltas)
+
+
+def score_predictions_by_id(ids):
+    """
+    予想を（結果が出ていれば）採点し、ユーザーのポイントと的中率を更新する。
+    結果の出たレースの予想をあとから登録・修正したとき用
+    （結果が入ったときは score_races がまとめて採点する）
+
+    戻り値: {user_id: ポイントの増減}
+    """
+    with transaction.atomic():
+        # 結果の出ていないレースの未採点の予想は何も変わらない
+        # （採点済みの予想を結果の出ていないレースに変えたら、得点を取り消す）
+        rows = _prediction_rows(
+            Q(pk__in=list(ids)) & (Q(race__raceresult__isnull=False) | Q(score__isnull=False))
+        )
+        if not rows:
+            return {}
+        placings = _race_placings({row[2] for row in rows})
+        deltas, changed, _, _, buckets = _apply_rules(rows, placings, {})
+
+        Prediction.objects.bulk_update(changed, ["score"], batch_size=500)
+        update_user_totals(deltas)
+        update_point_buckets(buckets)
+
+    return dict(deltas)
+
+
+def _prediction_rows(targets):
+    """採点する予想の行（_apply_rules に渡す形）"""
+    return list(Prediction.objects.filter(targets).values_list(
+        "id",
+        "user_id",
+        "race_id",
+        "first_position_id",
+        "second_position_id",
+        "third_position_id",
+        "score",
+        "race__date",
+        "created_at",
+    ))
+
+
+def _race_placings(race_ids):
+    """{race_id: (1着, 2着, 3着)}（結果が出ているレースだけ）"""
+    return {
+        race_id: tuple(places)
+        for race_id, *places in RaceResult.objects.filter(race_id__in=race_ids).values_list(
+            "race_id", "first_place_id", "second_place_id", "third_place_id"
+        )
+    }
+
+
+def _rescore(race_ids, picks, old_scores, placings):
+    """
+    予想の行をまとめて採点する
+
+    戻り値: (結果があるか, 前回採点済みか, 新しい得点（結果がなければ 0）, 前回との差分) の配列
+    """
+    # レースごとの着順を予想の行に広げる（結果が消えたレースは未採点に戻す）
+    races, race_index = np.unique(race_ids, return_inverse=True)
+    race_placings = np.array(
+        [placings_array(placings.get(int(race_id), (None, None, None))) for race_id in races],
+        dtype=np.int64,
+    )
+    race_has_result = np.array([int(race_id) in placings for race_id in races])
+    has_result = race_has_result[race_index]
+
+    scores = ScoringRules.from_settings().evaluate(picks, race_placings[race_index])
+    was_scored = np.array([score is not None for score in old_scores])
+    old = np.array([score or 0 for score in old_scores], dtype=np.int64)
+    new = np.where(has_result, scores, 0)
+    return has_result, was_scored, new, new - old
+
+
+def _apply_rules(rows, placings, previous):
+    """
+    予想の行をまとめて採点し、前回の得点との差分を出す
+
+    戻り値: (ユーザーごとの増減, 得点が変わった予想, 修正レースのユーザーごとの増減, 修正レースの対象件数,
+            (ユーザー, 日) ごとの増減)
+    """
+    deltas = defaultdict(int)
+    corrections = {race_id: defaultdict(int) for race_id in previous}
+    affected = defaultdict(int)
+    buckets = defaultdict(int)
+    if not rows:
+        return deltas, [], corrections, affected, buckets
+
+    ids, user_ids, race_ids, first, second, third, old_scores, race_dates, created = zip(*rows)
+    race_ids = np.asarray(race_ids, dtype=np.int64)
+    user_ids = np.asarray(user_ids, dtype=np.int64)
+    has_result, was_scored, new, delta = _rescore(
+        race_ids, np.column_stack([first, second, third]), old_scores, placings
+    )
+
+    # 的中率は得点が変わらなくても変わりうるので、対象ユーザーには必ず入れる
+    users, user_index = np.unique(user_ids, return_inverse=True)
+    for user_id, total in zip(users, np.bincount(user_index, weights=delta, minlength=len(users))):
+        deltas[int(user_id)] += int(total)
+
+    changed_rows = np.flatnonzero((has_result != was_scored) | (has_result & (delta != 0)))
+    changed = [
+        Prediction(id=ids[row], score=int(new[row]) if has_result[row] else None)
+        for row in changed_rows
+    ]
+    for row in np.flatnonzero(delta):
+        buckets[int(user_ids[row]), bucket_day(race_dates[row], created[row])] += int(delta[row])
+
+    if previous:
+        for row in np.flatnonzero(np.isin(race_ids, list(previous))):
+            race_id = int(race_ids[row])
+            affected[race_id] += 1
+            if delta[row]:
+                corrections[race_id][int(user_ids[row])] += int(delta[row])
+
+    return deltas, changed, corrections, affected, buckets
+
+
+def _score_group_predictions(targets, placings):
+    """
+    targets に当たるグループ予想を採点し、グループの順位表に差分を足す
+
+    戻り値: 順位表が変わったグループID
+    """
+    rows = list(GroupPrediction.objects.filter(targets).values_list(
+        "id",
+        "group_id",
+        "user_id",
+        "race_id",
+        "first_position_id",
+        "second_position_id",
+        "third_position_id",
+        "score",
+    ))
+    if not rows:
+        return set()
+
+    ids, group_ids, user_ids, race_ids, first, second, third, old_scores = zip(*rows)
+    has_result, was_scored, new, delta = _rescore(
+        np.asarray(race_ids, dtype=np.int64), np.column_stack([first, second, third]), old_scores, placings
+    )
+
+    changed_rows = np.flatnonzero((has_result != was_scored) | (has_result & (delta != 0)))
+    GroupPrediction.objects.bulk_update(
+        [
+            GroupPrediction(id=ids[row], score=int(new[row]) if has_result[row] else None)
+            for row in changed_rows
+        ],
+        ["score"],
+        batch_size=500,
+    )
+
+    deltas = defaultdict(lambda: [0, 0])
+    for row in changed_rows:
+        standing = deltas[group_ids[row], user_ids[row]]
+        standing[0] += int(delta[row])
+        standing[1] += int(has_result[row]) - int(was_scored[row])
+    update_group_standings(deltas)
+    return {group_id for group_id, _ in deltas}
+
+
+def score_group_predictions(ids):
+    """
+    グループ予想を（結果が出ていれば）採点する。結果の出たレースの予想を
+    あとから共有・修正したとき用（結果が入ったときは score_races がまとめて採点する）
+    """
+    with transaction.atomic():
+        race_ids = set(GroupPrediction.objects.filter(pk__in=ids).values_list("race_id", flat=True))
+        return _score_group_predictions(Q(pk__in=ids), _race_placings(race_ids))
+
+
+def update_group_standings(deltas):
+    """
+    グループの順位表に差分を足す
+
+    deltas: {(group_id, user_id): (得点の増減, 採点済みの予想数の増減)}
+    ない行は先に 0 点で作り（並行してメンバーの参加や別の採点が同じ行を作っても
+    ぶつからないよう ignore_conflicts）、差分は F() で足す。同じ差分の行はまとめて1回
+    """
+    deltas = {key: value for key, value in deltas.items() if any(value)}
+    if not deltas:
+        return
+
+    ensure_standings(deltas)
+    by_delta = defaultdict(list)
+    for (group_id, user_id), (points, scored) in deltas.items():
+        by_delta[points, scored].append(Q(group_id=group_id, user_id=user_id))
+    for (points, scored), keys in by_delta.items():
+        # OR が長くなりすぎないよう（SQLite の式の深さの上限）区切る
+        for start in range(0, len(keys), 200):
+            condition = Q()
+            for key in keys[start:start + 200]:
+                condition |= key
+            GroupStanding.objects.filter(condition).update(
+                points=F("points") + points,
+                scored_predictions=F("scored_predictions") + scored,
+            )
+
+
+def bucket_day(race_date, created_at):
+    """ポイントを入れる日（レースの開催日。未定なら予想した日）"""
+    return race_date or created_at.date()
+
+
+def update_point_buckets(deltas, create_missing=True):
+    """
+    日ごとのポイント（PointBucket）に差分を足す（まとめて1回）
+
+    deltas: {(user_id, 日): ポイントの増減}
+    create_missing=False なら行がない日は、月ごとにまとめた行があればそこに足し、
+    なければ飛ばす（取り消しなど）
+    """
+    deltas = {key: points for key, points in deltas.items() if points}
+    if not deltas:
+        return
+
+    user_ids = {user_id for user_id, _ in deltas}
+    existing = {
+        (bucket.user_id, bucket.period, bucket.start): bucket
+        for bucket in PointBucket.objects.select_for_update().filter(
+            Q(period=PointBucket.DAY, start__in={day for _, day in deltas})
+            | Q(period=PointBucket.MONTH, start__in={day.replace(day=1) for _, day in deltas}),
+            user_id__in=user_ids,
+        )
+    }
+    created, updated = [], {}
+    for (user_id, day), points in deltas.items():
+        bucket = existing.get((user_id, PointBucket.DAY, day))
+        if bucket is None and not create_missing:
+            bucket = existing.get((user_id, PointBucket.MONTH, day.replace(day=1)))
+            if bucket is None:
+                continue
+        if bucket is None:
+            bucket = PointBucket(user_id=user_id, period=PointBucket.DAY, start=day)
+            created.append(bucket)
+        elif bucket.pk:
+            updated[bucket.pk] = bucket
+        bucket.points += points
+
+    PointBucket.objects.bulk_create(created)
+    PointBucket.objects.bulk_update(list(updated.values()), ["points"], batch_size=500)
+
+
+def points_version():
+    return cache.get(POINTS_VERSION_KEY, 0)
+
+
+def _bump_points_version():
+    cache.set(POINTS_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def invalidate_points(user_ids):
+    """ポイントの版を変え、points_changed を送る（コミット後）"""
+
+    def changed():
+        _bump_points_version()
+        points_changed.send(sender=UserPoint, user_ids=user_ids)
+
+    transaction.on_commit(changed)
+
+
+def update_user_totals(deltas, create_missing=True):
+    """
+    ユーザーごとにポイントを差分だけ加算し、的中率を再計算する（まとめて1回）
+
+    create_missing=False なら UserPoint がないユーザーは飛ばす（取り消しなど）
+    """
+    if not deltas:
+        return
+
+    stats = {row["user_id"]: row for row in hit_stats_queryset(list(deltas))}
+    existing = {
+        user_point.user_id: user_point
+        for user_point in UserPoint.objects.select_for_update().filter(user_id__in=list(deltas))
+    }
+
+    created, changed, rates_changed = [], set(), False
+    for user_id, delta in deltas.items():
+        user_point = existing.get(user_id)
+        if user_point is None:
+            if not create_missing:
+                continue
+            user_point = UserPoint(user_id=user_id)
+            created.append(user_point)
+            changed.add(user_id)
+        user_point.points += delta
+        if delta:
+            changed.add(user_id)
+        row = stats.get(user_id, {})
+        rate = hit_rate(row.get("total"), row.get("hits"))
+        rates_changed |= rate != user_point.hit_rate
+        user_point.hit_rate = rate
+
+    UserPoint.objects.bulk_create(created)
+    UserPoint.objects.bulk_update(list(existing.values()), ["points", "hit_rate"], batch_size=500)
+    if changed:
+        invalidate_points(sorted(changed))
+    elif rates_changed:
+        # ポイントは変わらず的中率だけ（未採点の予想の削除など）。順位表はそのまま
+        transaction.on_commit(_bump_points_version)
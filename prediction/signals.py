@@ -1,5 +1,7 @@
 # prediction/signals.py
 
+from collections import Counter
+
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
@@ -7,38 +9,351 @@ from .models import UserProfile
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from .models import RaceResult, Prediction, UserPoint
+from django.db.models.signals import m2m_changed, post_delete, pre_delete, pre_save
+from django.dispatch import Signal
+from django.db import transaction
+from .change_log import record_change, record_changes
+from .models import ChangeLog, Follow, GroupMessage, GroupPrediction, Horse, PredictionGroup, Race
+
+# bulk_create で予想をまとめて登録したとき（post_save の代わり）
+# 引数: instances=登録した Prediction のリスト, user=投稿したユーザー
+predictions_bulk_created = Signal()
+
+# 採点（prediction/scoring.py）が終わったとき
+# 引数: race_ids=採点したレースID, user_ids=ポイントを更新したユーザーID
+races_scored = Signal()
+
+# ユーザーのポイントが変わったとき（コミット後）
+# 引数: user_ids=ポイントが変わったユーザーID
+points_changed = Signal()
+
 
 @receiver(post_save, sender=User)
 def create_or_update_user_profile(sender, instance, created, **kwargs):
     # 存在しなければ作成、あれば取得
     profile, _ = UserProfile.objects.get_or_create(user=instance)
     profile.save()
+
+
+@receiver(post_save, sender=User)
+def index_user_for_search(sender, instance, raw=False, update_fields=None, **kwargs):
+    """ユーザー検索の索引を更新（SQLite のみ。ログイン時の last_login 更新などは飛ばす）"""
+    if raw or (update_fields is not None and not {"username", "email"} & set(update_fields)):
+        return
+    from .user_search import index_user
+    index_user(instance)
+
+
+@receiver(post_delete, sender=User)
+def unindex_user_for_search(sender, instance, **kwargs):
+    """削除したユーザーを検索の索引から外す"""
+    from .user_search import unindex_user
+    unindex_user(instance.pk)
     
+@receiver(post_save, sender=UserPoint)
+@receiver(post_delete, sender=UserPoint)
+def invalidate_points_version(sender, instance, raw=False, **kwargs):
+    """管理画面などで UserPoint を直接変えたときもポイントの版を変える"""
+    from .scoring import invalidate_points
+    if not raw:
+        invalidate_points([instance.user_id])
+
+
+@receiver(points_changed)
+def update_leaderboard(sender, user_ids, **kwargs):
+    """順位表（prediction/leaderboard.py）にポイントの変化を反映する"""
+    from .leaderboard import apply_point_changes
+    apply_point_changes(user_ids)
+
+
+@receiver(pre_save, sender=RaceResult)
+def remember_previous_placings(sender, instance, raw=False, **kwargs):
+    """修正前の着順を覚えておく（差分だけ採点し直すため）"""
+    if instance.pk and not raw:
+        instance._previous_placings = RaceResult.objects.filter(pk=instance.pk).values_list(
+            "first_place_id", "second_place_id", "third_place_id"
+        ).first()
+
+
+@receiver(post_save, sender=RaceResult)
+def update_user_points_and_hit_rate(sender, instance, created, raw=False, **kwargs):
+    """レース結果が作成・修正されたら、そのレースを採点してポイントと的中率を更新"""
+    if raw:
+        return
+
+    from .scoring import score_races
+    previous = getattr(instance, "_previous_placings", None)
+    if created or previous is None:
+        score_races([instance.race_id])
+    else:
+        score_races([instance.race_id], previous={instance.race_id: previous})
+
+
+@receiver(post_delete, sender=RaceResult)
+def retract_points(sender, instance, **kwargs):
+    """レース結果が削除されたら、そのレースで加算したポイントを取り消す"""
+    from .scoring import score_races
+    score_races([instance.race_id])
+
+
+@receiver(post_delete, sender=Prediction)
+def retract_prediction_points(sender, instance, **kwargs):
+    """削除された予想の得点を取り消し、的中率を再計算"""
+    from .deletion import is_being_deleted
+    from .scoring import bucket_day, update_point_buckets, update_user_totals
+
+    # 退会処理中（delete_user_in_chunks）はユーザーごと消えるので集計しない
+    if is_being_deleted(instance.user_id):
+        return
+    # ユーザー削除のカスケード中でも壊れないよう、UserPoint・PointBucket は新しく作らない
+    update_user_totals({instance.user_id: -(instance.score or 0)}, create_missing=False)
+    if instance.score:
+        race_date = Race.objects.filter(pk=instance.race_id).values_list("date", flat=True).first()
+        update_point_buckets(
+            {(instance.user_id, bucket_day(race_date, instance.created_at)): -instance.score},
+            create_missing=False,
+        )
+
+
+@receiver(post_save, sender=Prediction)
+def score_prediction(sender, instance, raw=False, **kwargs):
+    """結果の出たレースの予想をあとから登録・修正したら、その予想だけ採点する"""
+    from .scoring import score_predictions_by_id
+    if not raw:
+        score_predictions_by_id([instance.pk])
+
+
+@receiver(predictions_bulk_created)
+def score_bulk_predictions(sender, instances, **kwargs):
+    """結果の出たレースの予想を採点する（一括登録）"""
+    from .scoring import score_predictions_by_id
+    score_predictions_by_id([instance.pk for instance in instances])
+
+
+@receiver(pre_save, sender=Prediction)
+def remember_previous_picks(sender, instance, raw=False, **kwargs):
+    """修正前の予想を覚えておく（みんなの予想の集計を差し替えるため）"""
+    if instance.pk and not raw:
+        instance._previous_picks = Prediction.objects.filter(pk=instance.pk).values_list(
+            "race_id", "first_position_id", "second_position_id", "third_position_id"
+        ).first()
+
+
+@receiver(post_save, sender=Prediction)
+def count_picks(sender, instance, created, raw=False, **kwargs):
+    """みんなの予想の集計に反映（修正なら前の予想と差し替え）"""
+    if raw:
+        return
+
+    from .consensus import apply_picks, prediction_picks
+    picks = prediction_picks(instance)
+    previous = getattr(instance, "_previous_picks", None)
+    if created or previous is None:
+        apply_picks(added=[picks])
+    elif (previous[0], tuple(previous[1:])) != picks:
+        apply_picks(added=[picks], removed=[(previous[0], tuple(previous[1:]))])
+
+
+@receiver(post_delete, sender=Prediction)
+def uncount_picks(sender, instance, **kwargs):
+    """削除された予想をみんなの予想の集計から引く"""
+    from .consensus import apply_picks, prediction_picks
+    apply_picks(removed=[prediction_picks(instance)])
+
+
+@receiver(post_save, sender=Race)
+@receiver(post_save, sender=Horse)
 @receiver(post_save, sender=RaceResult)
-def update_user_points_and_hit_rate(sender, instance, created, **kwargs):
-    """レース結果が作成されたら、全ユーザーのポイントと的中率を更新"""
-    if created:
-        race = instance.race
-        predictions = Prediction.objects.filter(race=race)
-        
-        for prediction in predictions:
-            user = prediction.user
-            points_earned = 0
-            
-            # ポイント計算
-            if prediction.first_position == instance.first_place:
-                points_earned += 3
-            if prediction.second_position == instance.second_place:
-                points_earned += 2
-            if prediction.third_position == instance.third_place:
-                points_earned += 1
-            
-            # UserPointを更新
-            user_point, created = UserPoint.objects.get_or_create(user=user)
-            user_point.points += points_earned
-            
-            # ✅ 的中率を再計算
-            from api.views import calculate_hit_rate
-            user_point.hit_rate = calculate_hit_rate(user)
-            
-            user_point.save()
+@receiver(post_save, sender=Prediction)
+@receiver(post_save, sender=Follow)
+def record_upsert(sender, instance, raw=False, **kwargs):
+    """差分同期用の変更ログ（追加・更新）"""
+    if not raw:
+        record_change(instance, ChangeLog.UPSERT)
+
+
+@receiver(post_delete, sender=Race)
+@receiver(post_delete, sender=Horse)
+@receiver(post_delete, sender=RaceResult)
+@receiver(post_delete, sender=Prediction)
+@receiver(post_delete, sender=Follow)
+def record_delete(sender, instance, **kwargs):
+    """差分同期用の変更ログ（削除）"""
+    record_change(instance, ChangeLog.DELETE)
+
+
+@receiver(predictions_bulk_created)
+def record_bulk_upserts(sender, instances, **kwargs):
+    """差分同期用の変更ログ（一括登録）"""
+    record_changes(sender, instances, ChangeLog.UPSERT)
+
+
+@receiver(predictions_bulk_created)
+def count_bulk_picks(sender, instances, **kwargs):
+    """みんなの予想の集計に反映（一括登録）"""
+    from .consensus import apply_picks, prediction_picks
+    apply_picks(added=[prediction_picks(instance) for instance in instances])
+
+
+@receiver(post_save, sender=Follow)
+def add_follow_edge(sender, instance, created, raw=False, **kwargs):
+    """読み込み済みのフォローグラフにコミット後すぐ反映（他のプロセスは変更ログから追いつく）"""
+    from .follow_graph import loaded_graph
+    if created and not raw and loaded_graph() is not None:
+        edge = (instance.pk, instance.follower_id, instance.followed_id)
+        transaction.on_commit(lambda: loaded_graph().add(*edge))
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_follow_set(sender, instance, raw=False, **kwargs):
+    """フォローした側のフォロー先のキャッシュを破棄"""
+    from .follow_cache import invalidate_following
+    if not raw:
+        invalidate_following(instance.follower_id)
+
+
+@receiver(post_delete, sender=Follow)
+def remove_follow_edge(sender, instance, **kwargs):
+    """フォロー解除をフォローグラフに反映"""
+    from .follow_graph import loaded_graph
+    if loaded_graph() is not None:
+        follow_id = instance.pk
+        transaction.on_commit(lambda: loaded_graph().remove(follow_id))
+
+
+@receiver(post_save, sender=Prediction)
+def count_prediction(sender, instance, created, raw=False, **kwargs):
+    """プロフィールの予想数を増やす"""
+    from .profile_counters import adjust
+    if created and not raw:
+        adjust("predictions_count", {instance.user_id: 1})
+
+
+@receiver(predictions_bulk_created)
+def count_bulk_predictions(sender, instances, **kwargs):
+    """プロフィールの予想数を増やす（一括登録）"""
+    from .profile_counters import adjust
+    adjust("predictions_count", Counter(instance.user_id for instance in instances))
+
+
+@receiver(post_delete, sender=Prediction)
+def uncount_prediction(sender, instance, **kwargs):
+    """プロフィールの予想数を減らす"""
+    from .deletion import is_being_deleted
+    from .profile_counters import adjust
+    if is_being_deleted(instance.user_id):
+        return
+    adjust("predictions_count", {instance.user_id: -1})
+
+
+@receiver(post_save, sender=Follow)
+def count_follow(sender, instance, created, raw=False, **kwargs):
+    """フォローした側のフォロー中の数・された側のフォロワー数を増やす"""
+    from .profile_counters import adjust
+    if created and not raw:
+        adjust("following_count", {instance.follower_id: 1})
+        adjust("followers_count", {instance.followed_id: 1})
+
+
+@receiver(post_delete, sender=Follow)
+def uncount_follow(sender, instance, **kwargs):
+    """フォロー解除（ユーザー削除のカスケードを含む）"""
+    from .profile_counters import adjust
+    adjust("following_count", {instance.follower_id: -1})
+    adjust("followers_count", {instance.followed_id: -1})
+
+
+@receiver(m2m_changed, sender=PredictionGroup.members.through)
+def count_group_members(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    プロフィールのグループ数を増減させる
+
+    group.members と user.prediction_groups のどちらからの変更も受ける。
+    post_add の pk_set は実際に追加した分だけだが、remove / clear は
+    実際にあった所属を pre_ で調べておく
+    """
+    from .profile_counters import adjust
+    if action == "post_add":
+        user_ids = [instance.pk] * len(pk_set) if reverse else pk_set
+        adjust("groups_count", Counter(user_ids))
+    elif action in ("pre_remove", "pre_clear"):
+        memberships = sender.objects.filter(**{"user_id" if reverse else "predictiongroup_id": instance.pk})
+        if action == "pre_remove":
+            memberships = memberships.filter(**{"predictiongroup_id__in" if reverse else "user_id__in": pk_set})
+        instance._removed_memberships = list(memberships.values_list("user_id", flat=True))
+    elif action in ("post_remove", "post_clear"):
+        removed = getattr(instance, "_removed_memberships", [])
+        adjust("groups_count", {user_id: -n for user_id, n in Counter(removed).items()})
+        instance._removed_memberships = []
+
+
+@receiver(m2m_changed, sender=PredictionGroup.members.through)
+def invalidate_group_members(sender, instance, action, reverse, pk_set, **kwargs):
+    """メンバー判定のキャッシュを破棄（group.members / user.prediction_groups の両方から）"""
+    from .membership import invalidate_members
+    if action == "pre_clear" and reverse:
+        # clear() は pk_set がないので、外れるグループを先に調べておく
+        instance._cleared_groups = list(
+            sender.objects.filter(user_id=instance.pk).values_list("predictiongroup_id", flat=True)
+        )
+    elif action in ("post_add", "post_remove", "post_clear"):
+        if not reverse:
+            invalidate_members([instance.pk])
+        elif action == "post_clear":
+            invalidate_members(getattr(instance, "_cleared_groups", []))
+        else:
+            invalidate_members(pk_set)
+
+
+@receiver(m2m_changed, sender=PredictionGroup.members.through)
+def add_group_standings(sender, instance, action, reverse, pk_set, **kwargs):
+    """メンバーに加わったら、グループの順位表に 0 点の行を作る"""
+    from .group_standings import ensure_standings
+    if action == "post_add":
+        if reverse:
+            ensure_standings([(group_id, instance.pk) for group_id in pk_set])
+        else:
+            ensure_standings([(instance.pk, user_id) for user_id in pk_set])
+
+
+@receiver(post_save, sender=GroupPrediction)
+def score_group_prediction(sender, instance, raw=False, **kwargs):
+    """結果の出たレースの予想をあとから共有・修正したら、その予想だけ採点する"""
+    from .scoring import score_group_predictions
+    if not raw:
+        score_group_predictions([instance.pk])
+
+
+@receiver(post_delete, sender=GroupPrediction)
+def retract_group_prediction_points(sender, instance, **kwargs):
+    """削除されたグループ予想の得点をグループの順位表から引く"""
+    from .deletion import is_being_deleted
+    from .group_standings import retract_group_prediction
+    if not is_being_deleted(instance.user_id):
+        retract_group_prediction(instance)
+
+
+@receiver(pre_delete, sender=PredictionGroup)
+def uncount_group_members(sender, instance, **kwargs):
+    """グループの削除（所属の行は m2m_changed なしで消える）"""
+    from .profile_counters import adjust
+    adjust("groups_count", {user_id: -1 for user_id in instance.members.values_list("pk", flat=True)})
+
+
+@receiver(post_save, sender=GroupMessage)
+def count_message(sender, instance, created, raw=False, **kwargs):
+    """プロフィールのメッセージ数を増やす"""
+    from .profile_counters import adjust
+    if created and not raw:
+        adjust("messages_count", {instance.sender_id: 1})
+
+
+@receiver(post_delete, sender=GroupMessage)
+def uncount_message(sender, instance, **kwargs):
+    """プロフィールのメッセージ数を減らす"""
+    from .deletion import is_being_deleted
+    from .profile_counters import adjust
+    if is_being_deleted(instance.sender_id):
+        return
+    adjust("messages_count", {instance.sender_id: -1})
@@ -0,0 +1,139 @@
+"""
+「予想が似ているユーザー」の索引（SimilarUser）
+
+ユーザーごとの予想を (馬, 着順) の疎ベクトルにし（馬はレースに属するので
+(レース, 馬, 着順) と同じ）、疎行列の積でまとめて似ているユーザーを求める。
+
+- 似ている度合い: 同じ馬を同じ着順に選んだ数 / √(自分の予想の頭数 × 相手の予想の頭数)
+  （コサイン類似度。共通の選択が SIMILARITY_MIN_COMMON_PICKS 未満の相手は除く）
+- 夜間に全員分を作り直す（manage.py build_similarity_index）
+- 途中の更新は、前回から予想したユーザーとその似ているユーザーの分だけ
+  （--incremental。予想の削除などは次の作り直しで反映）
+- /api/friends/suggestions/ は SimilarUser を読むだけで、ここの計算はしない
+"""
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Q
+from scipy import sparse
+
+from .models import Prediction, SimilarUser
+
+POSITIONS = 3
+CHUNK_SIZE = 1000
+
+
+def pick_matrix():
+    """
+    (ユーザー × (馬, 着順)) の 0/1 の疎行列（CSR）
+
+    戻り値: (行列, 各行のユーザーID)
+    """
+    rows = np.array(
+        list(Prediction.objects.values_list(
+            "user_id", "first_position_id", "second_position_id", "third_position_id",
+        ).order_by()),
+        dtype=np.int64,
+    ).reshape(-1, 1 + POSITIONS)
+    users, user_index = np.unique(rows[:, 0], return_inverse=True)
+    features = rows[:, 1:] * POSITIONS + np.arange(POSITIONS)
+    _, feature_index = np.unique(features, return_inverse=True)
+
+    matrix = sparse.csr_matrix(
+        (
+            np.ones(features.size, dtype=np.float64),
+            (np.repeat(user_index, POSITIONS), feature_index.ravel()),
+        ),
+        shape=(len(users), int(feature_index.max()) + 1 if features.size else 0),
+    )
+    # 同じレースに2回予想していても1回と数える
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+    return matrix, users
+
+
+def top_similar(matrix, users, rows, k=None, min_common=None):
+    """
+    rows（行列の行番号）のユーザーそれぞれに似ているユーザー上位 k 人
+
+    戻り値: {user_id: [(similar_user_id, score, common_picks), ...]}
+    """
+    k = k or settings.SIMILAR_USERS_PER_USER
+    min_common = min_common or settings.SIMILARITY_MIN_COMMON_PICKS
+    sizes = np.asarray(matrix.sum(axis=1)).ravel()
+    transposed = matrix.T.tocsr()
+
+    result = {}
+    for start in range(0, len(rows), CHUNK_SIZE):
+        chunk = np.asarray(rows[start:start + CHUNK_SIZE])
+        # 共通の選択の数（chunk × 全ユーザー）
+        common = (matrix[chunk] @ transposed).tocsr()
+        for offset, row in enumerate(chunk):
+            begin, end = common.indptr[offset], common.indptr[offset + 1]
+            others = common.indices[begin:end]
+            counts = common.data[begin:end]
+            keep = (others != row) & (counts >= min_common)
+            others, counts = others[keep], counts[keep]
+            scores = counts / np.sqrt(sizes[row] * sizes[others])
+            top = np.argsort(-scores, kind="stable")[:k]
+            result[int(users[row])] = [
+                (int(users[others[i]]), round(float(scores[i]), 4), int(counts[i])) for i in top
+            ]
+    return result
+
+
+def _save(similar):
+    with transaction.atomic():
+        SimilarUser.objects.filter(user_id__in=list(similar)).delete()
+        SimilarUser.objects.bulk_create(
+            [
+                SimilarUser(user_id=user_id, similar_user_id=other, score=score, common_picks=common)
+                for user_id, neighbours in similar.items()
+                for other, score, common in neighbours
+            ],
+            batch_size=500,
+        )
+
+
+def build_similarity_index():
+    """全員分を作り直す（戻り値: 対象ユーザー数）"""
+    matrix, users = pick_matrix()
+    rows = np.arange(len(users))
+    for start in range(0, len(rows), CHUNK_SIZE):
+        _save(top_similar(matrix, users, rows[start:start + CHUNK_SIZE]))
+    # 予想がなくなったユーザーの行
+    SimilarUser.objects.exclude(user_id__in=users.tolist()).delete()
+    return len(users)
+
+
+def update_similarity_index(since=None):
+    """
+    前回の更新以降に予想したユーザーと、その似ているユーザーの分だけ作り直す
+
+    戻り値: 対象ユーザー数
+    """
+    if since is None:
+        since = SimilarUser.objects.aggregate(latest=Max("updated_at"))["latest"]
+    if since is None:
+        return build_similarity_index()
+
+    changed = set(
+        Prediction.objects.filter(created_at__gt=since).values_list("user_id", flat=True).distinct()
+    )
+    if not changed:
+        return 0
+
+    matrix, users = pick_matrix()
+    row_of = {int(user_id): row for row, user_id in enumerate(users)}
+    similar = top_similar(matrix, users, [row_of[user_id] for user_id in changed if user_id in row_of])
+    # 相手側の上位にも入れ替わりがありうるので、新しく似ている相手の分も作り直す
+    neighbours = {other for rows in similar.values() for other, _, _ in rows} - set(similar)
+    neighbours |= set(
+        SimilarUser.objects.filter(similar_user_id__in=changed)
+        .exclude(Q(user_id__in=changed))
+        .values_list("user_id", flat=True)
+    )
+    similar.update(top_similar(matrix, users, [row_of[user_id] for user_id in neighbours if user_id in row_of]))
+    _save(similar)
+    return len(similar)
@@ -0,0 +1,116 @@
+"""
+予想の期待得点（モンテカルロ）
+
+みんなの予想（prediction/consensus.py）から馬の強さを見積もり、着順を何万回も
+まとめて NumPy で抽選して、予想の得点（現在の採点ルール）の期待値などを出す。
+
+- 着順の抽選: 馬の強さ w = 3×1着 + 2×2着 + 1×3着に選ばれた数 + 1 として、
+  log(w) + Gumbel ノイズの大きい順（Plackett–Luce モデルと同じ分布）
+- 勝率: みんなの予想からランダムに選んだ1件より高い得点になる確率（同点は 1/2）
+- 抽選の乱数はレースと集計の版で決まるので、同じ版なら誰の予想も同じ着順で比べる
+- このスレッドの CPU 時間が settings.SIMULATION_CPU_BUDGET_MS を超えたら、そこまでの回数で打ち切る
+  （スレッドで動くサーバーでも、他のリクエストの CPU 時間は数えない）
+- 結果はレースの集計が変わるまでキャッシュする。打ち切った結果は
+  SIMULATION_TRUNCATED_CACHE_SECONDS だけ（混んでいるときの再計算を抑える程度）
+"""
+
+import hashlib
+import json
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from .consensus import consensus_version, race_consensus
+from .models import TrifectaPickCount
+from .scoring import ScoringRules
+
+CHUNK_SIZE = 5000
+
+
+def _finishes(rng, log_strength, size):
+    """(size, 3) の1着・2着・3着（馬の列番号）"""
+    keys = log_strength + rng.gumbel(size=(size, len(log_strength)))
+    top3 = np.argpartition(-keys, 2, axis=1)[:, :3]
+    order = np.argsort(-np.take_along_axis(keys, top3, axis=1), axis=1)
+    return np.take_along_axis(top3, order, axis=1)
+
+
+def _cache_key(race_id, version, picks, rules):
+    digest = hashlib.sha1(json.dumps(rules.as_dict(), sort_keys=True).encode()).hexdigest()[:8]
+    return f"simulation:{race_id}:{version}:{'-'.join(map(str, picks))}:{digest}"
+
+
+def simulate_prediction(race_id, picks, runs=None, budget_ms=None):
+    """
+    (1着, 2着, 3着) の予想の期待得点・的中確率・勝率を見積もる
+
+    戻り値: {"expected_score", "std_error", "hit_probability", "trifecta_probability",
+             "win_probability", "simulations", "budget_exhausted", "cached"}
+    出走馬が3頭未満なら None
+    """
+    rules = ScoringRules.from_settings()
+    version = consensus_version(race_id)
+    key = _cache_key(race_id, version, picks, rules)
+    cached = cache.get(key)
+    if cached is not None:
+        return {**cached, "cached": True}
+
+    consensus = race_consensus(race_id)
+    horses = np.array([row["horse_id"] for row in consensus["horses"]], dtype=np.int64)
+    if len(horses) < 3:
+        return None
+    strength = np.array(
+        [3 * row["first"] + 2 * row["second"] + row["third"] + 1 for row in consensus["horses"]],
+        dtype=np.float64,
+    )
+    log_strength = np.log(strength)
+
+    # 比べる相手（みんなの予想の3連単の分布）
+    crowd = list(
+        TrifectaPickCount.objects.filter(race_id=race_id, count__gt=0)
+        .values_list("first_position_id", "second_position_id", "third_position_id", "count")
+    )
+    crowd_picks = np.array([row[:3] for row in crowd], dtype=np.int64).reshape(-1, 3)
+    crowd_weights = np.array([row[3] for row in crowd], dtype=np.float64)
+    crowd_weights = crowd_weights / crowd_weights.sum() if len(crowd) else crowd_weights
+
+    runs = runs or settings.SIMULATION_RUNS
+    budget = (budget_ms or settings.SIMULATION_CPU_BUDGET_MS) / 1000
+    rng = np.random.default_rng([race_id, int(hashlib.sha1(str(version).encode()).hexdigest()[:12], 16)])
+    picks = np.asarray(picks, dtype=np.int64)
+
+    scores, trifectas, wins = [], [], []
+    started = time.thread_time()
+    done = 0
+    while done < runs:
+        size = min(CHUNK_SIZE, runs - done)
+        placings = horses[_finishes(rng, log_strength, size)]
+        chunk = rules.evaluate(np.broadcast_to(picks, placings.shape), placings)
+        scores.append(chunk)
+        trifectas.append((placings == picks).all(axis=1))
+        if len(crowd):
+            opponents = crowd_picks[rng.choice(len(crowd), size=size, p=crowd_weights)]
+            against = rules.evaluate(opponents, placings)
+            wins.append((chunk > against) + 0.5 * (chunk == against))
+        done += size
+        if time.thread_time() - started > budget:
+            break
+
+    scores = np.concatenate(scores)
+    result = {
+        "expected_score": round(float(scores.mean()), 3),
+        "std_error": round(float(scores.std() / np.sqrt(len(scores))), 3),
+        "hit_probability": round(float((scores > 0).mean()), 4),
+        "trifecta_probability": round(float(np.concatenate(trifectas).mean()), 4),
+        "win_probability": round(float(np.concatenate(wins).mean()), 4) if wins else None,
+        "simulations": int(len(scores)),
+        "budget_exhausted": bool(done < runs),
+    }
+    cache.set(
+        key,
+        result,
+        settings.SIMULATION_TRUNCATED_CACHE_SECONDS if result["budget_exhausted"] else settings.SIMULATION_CACHE_SECONDS,
+    )
+    return {**result, "cached": False}
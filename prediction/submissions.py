@@ -0,0 +1,173 @@
+"""
+予想の投稿（1件 / 開催まるごとの一括）
+
+- 出走馬のチェックは全件まとめて1クエリ
+- 一括投稿は bulk_create で1トランザクション。post_save は飛ばないので
+  代わりに predictions_bulk_created シグナルを送る
+- Idempotency-Key が同じ再送には最初のレスポンスをそのまま返す。
+  同じキーで予想の中身が違えば 422（登録も保存したレスポンスの返却もしない）
+"""
+
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import Horse, IdempotencyKey, Prediction
+from .signals import predictions_bulk_created
+
+PICK_FIELDS = ('race', 'first_position', 'second_position', 'third_position')
+IDEMPOTENCY_KEY_MAX_LENGTH = IdempotencyKey._meta.get_field('key').max_length
+
+
+def _parse_pick(item):
+    """1件分の入力を (race_id, (1着, 2着, 3着), comment) に。不正ならエラーメッセージ"""
+    if not isinstance(item, dict) or not all(item.get(field) for field in PICK_FIELDS):
+        return None, 'すべてのフィールドを入力してください'
+    try:
+        race_id, *horse_ids = (int(item[field]) for field in PICK_FIELDS)
+    except (TypeError, ValueError):
+        return None, 'IDは整数で指定してください'
+    if len(set(horse_ids)) != 3:
+        return None, '同じ馬を複数回選択できません'
+    return (race_id, tuple(horse_ids), item.get('comment') or None), None
+
+
+def validate_picks(items):
+    """
+    予想をまとめて検証する
+
+    戻り値: (有効な予想 [(index, race_id, horse_ids, comment)], エラー {index: メッセージ})
+    """
+    parsed, errors = [], {}
+    for index, item in enumerate(items):
+        pick, error = _parse_pick(item)
+        if error:
+            errors[index] = error
+        else:
+            parsed.append((index, *pick))
+
+    # 出走馬かどうかを1クエリで確認（レースの存在もこれで分かる）
+    race_ids = {race_id for _, race_id, _, _ in parsed}
+    horse_ids = {horse_id for _, _, picks, _ in parsed for horse_id in picks}
+    entries = set(
+        Horse.objects.filter(id__in=horse_ids, race_id__in=race_ids).values_list('id', 'race_id')
+    ) if parsed else set()
+
+    valid = []
+    for index, race_id, picks, comment in parsed:
+        if any((horse_id, race_id) not in entries for horse_id in picks):
+            errors[index] = '指定したレースに出走していない馬が含まれています'
+        else:
+            valid.append((index, race_id, picks, comment))
+    return valid, errors
+
+
+def request_hash(items):
+    """予想の中身のハッシュ（ID の数値・文字列の違いやキーの順番は区別しない）"""
+
+    def normalize(item):
+        if not isinstance(item, dict):
+            return item
+        return {
+            **{field: str(item.get(field)) for field in PICK_FIELDS},
+            'comment': item.get('comment') or None,
+        }
+
+    payload = json.dumps([normalize(item) for item in items], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def submit_predictions(user, items, idempotency_key=None):
+    """
+    開催まるごとの予想を一括で登録する
+
+    戻り値: (HTTPステータス, レスポンス)
+    全件成功: 201 / 一部失敗: 207 / 全件失敗: 400 /
+    同じ Idempotency-Key で中身の違う予想: 422
+    """
+    digest = request_hash(items) if idempotency_key else ''
+    if idempotency_key:
+        stored = _stored_response(user, idempotency_key, digest)
+        if stored is not None:
+            return stored
+
+    try:
+        with transaction.atomic():
+            status_code, body = _submit(user, items)
+            if idempotency_key:
+                IdempotencyKey.objects.create(
+                    user=user, key=idempotency_key, request_hash=digest,
+                    status_code=status_code, response=body,
+                )
+    except IntegrityError:
+        # 同じキーの再送が並行して先に登録された（こちらの登録はロールバック済み）
+        stored = _stored_response(user, idempotency_key, digest) if idempotency_key else None
+        if stored is None:
+            raise
+        return stored
+    return status_code, body
+
+
+def _submit(user, items):
+    valid, errors = validate_picks(items)
+
+    # 同じレースへの予想は1リクエストに1件まで
+    seen_races = set()
+    for index, race_id, _, _ in valid:
+        if race_id in seen_races:
+            errors[index] = '同じレースが複数回含まれています'
+        seen_races.add(race_id)
+    valid = [pick for pick in valid if pick[0] not in errors]
+
+    predictions = Prediction.objects.bulk_create([
+        Prediction(
+            user=user,
+            race_id=race_id,
+            first_position_id=picks[0],
+            second_position_id=picks[1],
+            third_position_id=picks[2],
+            comment=comment,
+        )
+        for _, race_id, picks, comment in valid
+    ])
+    if predictions:
+        predictions_bulk_created.send(sender=Prediction, instances=predictions, user=user)
+
+    created = {index: prediction for (index, *_), prediction in zip(valid, predictions)}
+    results = []
+    for index in range(len(items)):
+        if index in created:
+            results.append({'index': index, 'id': created[index].id, 'race': created[index].race_id})
+        else:
+            results.append({'index': index, 'error': errors[index]})
+
+    if not errors:
+        status_code = 201
+    elif created:
+        status_code = 207
+    else:
+        status_code = 400
+    return status_code, {
+        'created': len(created),
+        'failed': len(errors),
+        'results': results,
+    }
+
+
+def _stored_response(user, key, digest):
+    cutoff = timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    # 期限切れのキーはついでに掃除する
+    IdempotencyKey.objects.filter(user=user, created_at__lt=cutoff).delete()
+    stored = IdempotencyKey.objects.filter(user=user, key=key).first()
+    if stored is None:
+        return None
+    # ハッシュのない行は、ハッシュを保存する前に登録されたもの
+    if stored.request_hash and stored.request_hash != digest:
+        return 422, {
+            'error': 'この Idempotency-Key は別の内容の予想に使われています。新しいキーで送信してください',
+        }
+    return stored.status_code, stored.response
@@ -1,3 +1,521 @@
-from django.test import TestCase
+import io
+import tempfile
+from datetime import date, timedelta
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from . import leaderboard
+from .leaderboard import Leaderboard
+from .models import (
+    Follow,
+    GroupMessage,
+    GroupPrediction,
+    GroupStanding,
+    Horse,
+    PointBucket,
+    Prediction,
+    PredictionGroup,
+    Race,
+    RaceResult,
+    UserPoint,
+    UserProfile,
+)
+from .group_standings import ensure_standings, group_ranking
+from .profile_counters import repair_profile_counters
+from .rankings import daily_buckets_since, period_bounds, period_ranking
+from .result_import import ResultImportError, import_results, parse_results
+from .scoring import update_group_standings, update_point_buckets
+from .submissions import submit_predictions
+
+
+def make_race(name, horses=5, date=None):
+    """出走馬つきのレース"""
+    race = Race.objects.create(name=name, date=date)
+    return race, [Horse.objects.create(name=f"{name}の馬{i}", race=race) for i in range(1, horses + 1)]
+
+
+def predict(user, race, horses, **kwargs):
+    """horses の先頭3頭を1着・2着・3着とした予想"""
+    return Prediction.objects.create(
+        user=user, race=race,
+        first_position=horses[0], second_position=horses[1], third_position=horses[2],
+        **kwargs,
+    )
+
+
+def brute_rank(points, user_id):
+    """{user_id: points} での順位（自分より多いポイントの人数 + 1）"""
+    if user_id not in points:
+        return None
+    return sum(1 for other in points.values() if other > points[user_id]) + 1, points[user_id]
+
+
+class LeaderboardTests(SimpleTestCase):
+    def assertMatches(self, board, points):
+        self.assertEqual(len(board), len(points))
+        self.assertEqual(board.stamp, (len(points), sum(points.values())))
+        for user_id in list(points) + [999]:
+            self.assertEqual(board.rank(user_id), brute_rank(points, user_id), user_id)
+        self.assertEqual(list(board.user_ids), sorted(points))
+        self.assertEqual(list(board.keys), sorted(board.keys))
+
+    def test_rank(self):
+        points = {1: 10, 2: 30, 3: 20, 4: -5}
+        board = Leaderboard.from_points(list(points), list(points.values()))
+        self.assertMatches(board, points)
+        self.assertEqual([row["user_id"] for row in board.top(4)], [2, 3, 1, 4])
+
+    def test_ties_share_rank(self):
+        points = {5: 10, 2: 10, 9: 10, 3: 7}
+        board = Leaderboard.from_points(list(points), list(points.values()))
+        self.assertEqual([board.rank(user_id)[0] for user_id in (2, 5, 9, 3)], [1, 1, 1, 4])
+        # 同点はユーザーIDの小さい順
+        self.assertEqual([row["user_id"] for row in board.top(4)], [2, 5, 9, 3])
+        self.assertEqual(board.rank_of_points(8), 4)
+
+    def test_insert(self):
+        points = {1: 10, 3: 20}
+        board = Leaderboard.from_points(list(points), list(points.values()))
+        board = board.updated([2, 4], [2, 4], [15, 20])
+        self.assertMatches(board, {1: 10, 2: 15, 3: 20, 4: 20})
+
+    def test_update_and_remove(self):
+        points = {user_id: user_id % 7 for user_id in range(1, 50)}
+        board = Leaderboard.from_points(list(points), list(points.values()))
+        # 3 と 10 は点数が変わり、20 と 21 は UserPoint が消えた、100 は元々いない
+        board = board.updated([3, 10, 20, 21, 100], [3, 10], [40, 0])
+        points.update({3: 40, 10: 0})
+        del points[20], points[21]
+        self.assertMatches(board, points)
+
+    def test_rank_after_delete(self):
+        points = {1: 30, 2: 20, 3: 20, 4: 10}
+        board = Leaderboard.from_points(list(points), list(points.values()))
+        board = board.updated([1], [], [])
+        self.assertEqual(board.rank(2), (1, 20))
+        self.assertEqual(board.rank(3), (1, 20))
+        self.assertEqual(board.rank(4), (3, 10))
+        self.assertIsNone(board.rank(1))
+
+    def test_remove_everyone(self):
+        board = Leaderboard.from_points([1, 2], [5, 6]).updated([1, 2], [], [])
+        self.assertEqual(len(board), 0)
+        self.assertIsNone(board.rank(1))
+        self.assertEqual(board.stamp, (0, 0))
+
+    def test_random_updates_match_brute_force(self):
+        rng = np.random.default_rng(0)
+        points = {int(user_id): int(rng.integers(-20, 50)) for user_id in rng.choice(500, 200, replace=False) + 1}
+        board = Leaderboard.from_points(list(points), list(points.values()))
+        for _ in range(30):
+            changed = [int(user_id) for user_id in rng.choice(500, 10, replace=False) + 1]
+            for user_id in changed:
+                if rng.random() < 0.3:
+                    points.pop(user_id, None)
+                else:
+                    points[user_id] = int(rng.integers(-20, 50))
+            kept = [user_id for user_id in changed if user_id in points]
+            board = board.updated(changed, kept, [points[user_id] for user_id in kept])
+        self.assertMatches(board, points)
+
+    def test_around(self):
+        points = {1: 50, 2: 40, 3: 30, 4: 20, 5: 10}
+        board = Leaderboard.from_points(list(points), list(points.values()))
+        self.assertEqual([row["user_id"] for row in board.around(3, 1)], [2, 3, 4])
+        self.assertEqual([row["user_id"] for row in board.around(1, 1)], [1, 2])
+        self.assertEqual(board.around(9, 1), [])
+
+
+class LeaderboardSnapshotTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(
+            LEADERBOARD_SNAPSHOT_DIR=directory.name, LEADERBOARD_VERIFY_SECONDS=0, LEADERBOARD_FLUSH_SECONDS=0
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(leaderboard._discard)
+        leaderboard._discard()
+        self.users = [User.objects.create_user(f"user{i}") for i in range(3)]
+
+    def test_applies_point_changes_after_commit(self):
+        UserPoint.objects.create(user=self.users[0], points=5)
+        self.assertEqual(leaderboard.get_leaderboard().rank(self.users[0].id), (1, 5))
+        with self.captureOnCommitCallbacks(execute=True):
+            UserPoint.objects.create(user=self.users[1], points=9)
+        self.assertEqual(leaderboard._board.rank(self.users[1].id), (1, 9))
+        self.assertEqual(leaderboard._board.rank(self.users[0].id), (2, 5))
+
+    def test_rebuilds_when_snapshot_differs_from_db(self):
+        UserPoint.objects.create(user=self.users[0], points=5)
+        leaderboard.get_leaderboard()
+        # シグナルを通らない変更（反映に失敗した・DB を復元したなど）
+        UserPoint.objects.bulk_create([UserPoint(user=self.users[2], points=7)])
+        leaderboard._checked_at = 0
+        self.assertEqual(leaderboard.get_leaderboard().rank(self.users[2].id), (1, 7))
+
+    def test_rebuilds_snapshot_of_another_database(self):
+        UserPoint.objects.create(user=self.users[0], points=5)
+        board = Leaderboard.from_points([self.users[1].id], [100], db_identity=leaderboard.db_identity() + 1)
+        with leaderboard._snapshot_lock():
+            leaderboard._write(board)
+        leaderboard._board = None
+        self.assertEqual(leaderboard.get_leaderboard().rank(self.users[0].id), (1, 5))
+        self.assertIsNone(leaderboard.get_leaderboard().rank(self.users[1].id))
+
+
+class ResultImportTests(TestCase):
+    """開催まるごとの結果の取り込み（prediction/result_import.py）"""
+
+    def setUp(self):
+        self.user = User.objects.create_user("importer")
+        self.race1, self.horses1 = make_race("有馬記念")
+        self.race2, self.horses2 = make_race("ホープフルS")
+        predict(self.user, self.race1, self.horses1)
+        predict(self.user, self.race2, self.horses2)
+
+    def test_imports_by_name_and_id_and_scores_once(self):
+        content = (
+            "race,first_place,second_place,third_place\n"
+            "有馬記念,有馬記念の馬1,有馬記念の馬2,有馬記念の馬3\n"
+            f"{self.race2.id},{self.horses2[1].id},{self.horses2[0].id},{self.horses2[2].id}\n"
+        )
+        summary = import_results(parse_results(content, "csv"))
+        self.assertEqual(summary, {"created": 2, "updated": 0, "unchanged": 0, "scored_users": 1})
+        # 有馬記念は 3+2+1、ホープフルSは3着だけ的中
+        self.assertEqual(UserPoint.objects.get(user=self.user).points, 7)
+        self.assertEqual(
+            dict(Prediction.objects.values_list("race_id", "score")), {self.race1.id: 6, self.race2.id: 1}
+        )
+
+    def test_any_error_writes_nothing(self):
+        content = (
+            "race,first_place,second_place,third_place\n"
+            "有馬記念,有馬記念の馬1,有馬記念の馬2,有馬記念の馬3\n"
+            "ホープフルS,有馬記念の馬1,ホープフルSの馬2,ホープフルSの馬3\n"  # 出走していない馬
+        )
+        with self.assertRaises(ResultImportError) as raised:
+            import_results(parse_results(content, "csv"))
+        self.assertEqual([error["row"] for error in raised.exception.errors], [2])
+        self.assertFalse(RaceResult.objects.exists())
+        self.assertFalse(UserPoint.objects.exists())
+
+    def test_reimport_applies_only_corrections(self):
+        rows = [
+            {"race": self.race1.id, "first_place": self.horses1[0].id, "second_place": self.horses1[1].id,
+             "third_place": self.horses1[2].id},
+            {"race": self.race2.id, "first_place": self.horses2[0].id, "second_place": self.horses2[1].id,
+             "third_place": self.horses2[2].id},
+        ]
+        import_results(rows)
+        self.assertEqual(UserPoint.objects.get(user=self.user).points, 12)
+
+        rows[1] = {**rows[1], "first_place": self.horses2[3].id}
+        summary = import_results(rows)
+        self.assertEqual((summary["updated"], summary["unchanged"]), (1, 1))
+        self.assertEqual(UserPoint.objects.get(user=self.user).points, 9)
+        self.assertEqual(self.race2.score_corrections.get().user_deltas, {str(self.user.id): -3})
+
+
+class ScoringTests(TestCase):
+    """採点とポイント・日ごとのポイントへの差分の反映（prediction/scoring.py）"""
+
+    def setUp(self):
+        self.alice = User.objects.create_user("alice")
+        self.bob = User.objects.create_user("bob")
+        self.race, self.horses = make_race("菊花賞", date=date(2026, 10, 25))
+        self.alice_pick = predict(self.alice, self.race, self.horses)
+        self.bob_pick = predict(self.bob, self.race, self.horses[2:])
+
+    def set_result(self, *indexes):
+        first, second, third = (self.horses[i] for i in indexes)
+        result = RaceResult.objects.filter(race=self.race).first() or RaceResult(race=self.race)
+        result.first_place, result.second_place, result.third_place = first, second, third
+        result.save()
+        return result
+
+    def points(self, user):
+        return UserPoint.objects.get(user=user).points
+
+    def bucket(self, user):
+        return PointBucket.objects.get(user=user, period=PointBucket.DAY, start=self.race.date).points
+
+    def test_result_scores_predictions(self):
+        self.set_result(0, 1, 2)
+        self.assertEqual((self.points(self.alice), self.points(self.bob)), (6, 0))
+        self.assertEqual(self.bucket(self.alice), 6)
+        self.assertEqual(UserPoint.objects.get(user=self.alice).hit_rate, 100.0)
+
+    def test_correction_applies_only_the_difference(self):
+        self.set_result(0, 1, 2)
+        # 1着と3着を入れ替え（bob が1着に選んだ馬が1着に）
+        self.set_result(2, 1, 0)
+        self.assertEqual((self.points(self.alice), self.points(self.bob)), (2, 3))
+        self.assertEqual((self.bucket(self.alice), self.bucket(self.bob)), (2, 3))
+        correction = self.race.score_corrections.get()
+        self.assertEqual(correction.user_deltas, {str(self.alice.id): -4, str(self.bob.id): 3})
+        self.assertEqual(correction.affected_predictions, 2)
+
+        # 同じ着順で保存し直しても変わらない
+        self.set_result(2, 1, 0)
+        self.assertEqual((self.points(self.alice), self.points(self.bob)), (2, 3))
+        self.assertEqual(self.race.score_corrections.count(), 1)
+
+    def test_deleting_result_retracts_points(self):
+        self.set_result(0, 1, 2).delete()
+        self.assertEqual((self.points(self.alice), self.points(self.bob)), (0, 0))
+        self.assertEqual(self.bucket(self.alice), 0)
+        self.assertEqual(set(Prediction.objects.values_list("score", flat=True)), {None})
+
+    def test_prediction_after_result_is_scored(self):
+        self.set_result(0, 1, 2)
+        carol = User.objects.create_user("carol")
+        late = predict(carol, self.race, self.horses)
+        late.refresh_from_db()
+        self.assertEqual((late.score, self.points(carol), self.bucket(carol)), (6, 6, 6))
+
+        # 修正すれば差分だけ
+        late.first_position, late.third_position = self.horses[2], self.horses[0]
+        late.save()
+        late.refresh_from_db()
+        self.assertEqual((late.score, self.points(carol), self.bucket(carol)), (2, 2, 2))
+
+    def test_bulk_prediction_after_result_is_scored(self):
+        self.set_result(0, 1, 2)
+        other_race, other_horses = make_race("天皇賞")
+        carol = User.objects.create_user("carol")
+        status_code, _ = submit_predictions(carol, [
+            {"race": self.race.id, "first_position": self.horses[0].id,
+             "second_position": self.horses[1].id, "third_position": self.horses[3].id},
+            {"race": other_race.id, "first_position": other_horses[0].id,
+             "second_position": other_horses[1].id, "third_position": other_horses[2].id},
+        ])
+        self.assertEqual(status_code, 201)
+        self.assertEqual(self.points(carol), 5)
+        self.assertEqual(
+            dict(Prediction.objects.filter(user=carol).values_list("race_id", "score")),
+            {self.race.id: 5, other_race.id: None},
+        )
+
+    def test_deleting_scored_prediction_retracts_points(self):
+        self.set_result(0, 1, 2)
+        Prediction.objects.get(pk=self.alice_pick.pk).delete()
+        self.assertEqual((self.points(self.alice), self.bucket(self.alice)), (0, 0))
+
+
+class ProfileCounterTests(TestCase):
+    """プロフィールの件数（prediction/profile_counters.py）"""
+
+    def setUp(self):
+        self.alice = User.objects.create_user("alice")
+        self.bob = User.objects.create_user("bob")
+
+    def counts(self, user):
+        return UserProfile.objects.filter(user=user).values(*UserProfile.COUNTER_FIELDS).get()
+
+    def test_predictions(self):
+        race, horses = make_race("レース")
+        prediction = predict(self.alice, race, horses)
+        other_race, other_horses = make_race("別のレース")
+        submit_predictions(self.alice, [{
+            "race": other_race.id, "first_position": other_horses[0].id,
+            "second_position": other_horses[1].id, "third_position": other_horses[2].id,
+        }])
+        self.assertEqual(self.counts(self.alice)["predictions_count"], 2)
+        # 修正では増えない
+        prediction.comment = "本命"
+        prediction.save()
+        prediction.delete()
+        self.assertEqual(self.counts(self.alice)["predictions_count"], 1)
+
+    def test_follows(self):
+        follow = Follow.objects.create(follower=self.alice, followed=self.bob)
+        self.assertEqual(self.counts(self.alice)["following_count"], 1)
+        self.assertEqual(self.counts(self.bob)["followers_count"], 1)
+        follow.delete()
+        self.assertEqual(self.counts(self.alice)["following_count"], 0)
+        self.assertEqual(self.counts(self.bob)["followers_count"], 0)
+
+    def test_groups_from_both_sides(self):
+        first = PredictionGroup.objects.create(name="first")
+        second = PredictionGroup.objects.create(name="second")
+        first.members.add(self.alice, self.bob)
+        self.alice.prediction_groups.add(second)
+        # 既にメンバーなら増えない
+        first.members.add(self.alice)
+        self.assertEqual(self.counts(self.alice)["groups_count"], 2)
+
+        first.members.remove(self.bob)
+        self.alice.prediction_groups.clear()
+        self.assertEqual((self.counts(self.alice)["groups_count"], self.counts(self.bob)["groups_count"]), (0, 0))
+
+        second.members.add(self.bob)
+        second.delete()
+        self.assertEqual(self.counts(self.bob)["groups_count"], 0)
+
+    def test_messages(self):
+        group = PredictionGroup.objects.create(name="group")
+        message = GroupMessage.objects.create(group=group, sender=self.alice, content="こんにちは")
+        self.assertEqual(self.counts(self.alice)["messages_count"], 1)
+        message.delete()
+        self.assertEqual(self.counts(self.alice)["messages_count"], 0)
+
+    def test_repair_fixes_only_drifted_profiles(self):
+        Follow.objects.create(follower=self.alice, followed=self.bob)
+        # シグナルを通らない変更
+        Follow.objects.bulk_create([Follow(follower=self.bob, followed=self.alice)])
+        UserProfile.objects.filter(user=self.alice).update(predictions_count=5)
+        carol = User.objects.create_user("carol")
+        UserProfile.objects.filter(user=carol).delete()
+
+        self.assertEqual(repair_profile_counters(), 2)
+        self.assertEqual(
+            self.counts(self.alice),
+            {"predictions_count": 0, "followers_count": 1, "following_count": 1, "groups_count": 0, "messages_count": 0},
+        )
+        self.assertEqual(self.counts(self.bob)["following_count"], 1)
+        self.assertEqual(self.counts(carol)["predictions_count"], 0)
+        self.assertEqual(repair_profile_counters(), 0)
+
+
+class GroupStandingTests(TestCase):
+    """グループの順位表（prediction/group_standings.py）"""
+
+    def setUp(self):
+        self.alice = User.objects.create_user("alice")
+        self.bob = User.objects.create_user("bob")
+        self.group = PredictionGroup.objects.create(name="group")
+        self.group.members.add(self.alice, self.bob)
+        self.race, self.horses = make_race("レース")
+
+    def share(self, user, horses):
+        return GroupPrediction.objects.create(
+            group=self.group, user=user, race=self.race,
+            first_position=horses[0], second_position=horses[1], third_position=horses[2],
+        )
+
+    def standings(self):
+        return [(row.user.username, row.points, row.scored_predictions, row.rank) for row in group_ranking(self.group.id)]
+
+    def test_members_start_at_zero(self):
+        self.assertEqual(self.standings(), [("alice", 0, 0, 1), ("bob", 0, 0, 1)])
+
+    def test_result_then_correction(self):
+        self.share(self.alice, self.horses)
+        self.share(self.bob, self.horses[2:])
+        RaceResult.objects.create(
+            race=self.race, first_place=self.horses[0], second_place=self.horses[1], third_place=self.horses[2]
+        )
+        self.assertEqual(self.standings(), [("alice", 6, 1, 1), ("bob", 0, 1, 2)])
+
+        result = RaceResult.objects.get(race=self.race)
+        result.first_place, result.third_place = self.horses[2], self.horses[0]
+        result.save()
+        self.assertEqual(self.standings(), [("bob", 3, 1, 1), ("alice", 2, 1, 2)])
+
+    def test_share_after_result_and_delete(self):
+        RaceResult.objects.create(
+            race=self.race, first_place=self.horses[0], second_place=self.horses[1], third_place=self.horses[2]
+        )
+        shared = self.share(self.alice, self.horses)
+        self.assertEqual(self.standings()[0], ("alice", 6, 1, 1))
+
+        GroupPrediction.objects.get(pk=shared.pk).delete()
+        self.assertEqual(self.standings(), [("alice", 0, 0, 1), ("bob", 0, 0, 1)])
+
+    def test_former_members_are_hidden(self):
+        self.group.members.remove(self.bob)
+        self.assertEqual([row[0] for row in self.standings()], ["alice"])
+
+    def test_deltas_for_rows_created_concurrently(self):
+        carol = User.objects.create_user("carol")
+        # 採点の途中で別の処理（メンバーの参加）が同じ行を作っていても足せる
+        ensure_standings([(self.group.id, carol.id)])
+        update_group_standings({(self.group.id, carol.id): (5, 1), (self.group.id, self.alice.id): (5, 1)})
+        update_group_standings({(self.group.id, carol.id): (1, 1)})
+        self.assertEqual(
+            dict(GroupStanding.objects.filter(group=self.group).values_list("user__username", "points")),
+            {"alice": 5, "bob": 0, "carol": 6},
+        )
+
+
+class PeriodBoundsTests(SimpleTestCase):
+    """期間ごとのランキングの期間（prediction/rankings.py）"""
+
+    def test_periods(self):
+        wednesday = date(2026, 10, 14)
+        with override_settings(POINT_BUCKET_DAILY_DAYS=10000):
+            self.assertEqual(period_bounds("week", wednesday), (date(2026, 10, 12), date(2026, 10, 19)))
+            self.assertEqual(period_bounds("rolling", wednesday, days=7), (date(2026, 10, 8), date(2026, 10, 15)))
+        self.assertEqual(period_bounds("month", date(2028, 2, 10)), (date(2028, 2, 1), date(2028, 3, 1)))
+        self.assertEqual(period_bounds("season", wednesday), (date(2026, 1, 1), date(2027, 1, 1)))
+
+    def test_invalid(self):
+        today = timezone.now().date()
+        for period, kwargs in [
+            ("year", {}),
+            ("rolling", {}),
+            ("rolling", {"days": 0}),
+            # 日ごとの行を月ごとにまとめた期間の週
+            ("week", {"on": daily_buckets_since(today) - timedelta(days=1)}),
+        ]:
+            with self.subTest(period=period, **kwargs), self.assertRaises(ValueError):
+                period_bounds(period, **kwargs)
+
+
+class PointBucketCompactionTests(TestCase):
+    """日ごとのポイントの月ごとへのまとめ（compact_point_buckets）"""
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user("alice")
+        self.bob = User.objects.create_user("bob")
+        cutoff = daily_buckets_since()
+        self.old_month = (cutoff - timedelta(days=1)).replace(day=1)
+        self.old_days = [self.old_month + timedelta(days=n) for n in (0, 9, 20)]
+        self.recent_day = cutoff
+        update_point_buckets({
+            (self.alice.id, self.old_days[0]): 3,
+            (self.alice.id, self.old_days[1]): 2,
+            (self.bob.id, self.old_days[2]): 6,
+            (self.alice.id, self.recent_day): 1,
+        })
+
+    def month_range(self):
+        return self.old_month, (self.old_month + timedelta(days=32)).replace(day=1)
+
+    def rows(self):
+        return sorted(PointBucket.objects.values_list("user__username", "period", "start", "points"))
+
+    def test_compacts_old_days_into_months(self):
+        before = period_ranking(*self.month_range())
+        call_command("compact_point_buckets", stdout=io.StringIO())
+        self.assertEqual(self.rows(), [
+            ("alice", PointBucket.DAY, self.recent_day, 1),
+            ("alice", PointBucket.MONTH, self.old_month, 5),
+            ("bob", PointBucket.MONTH, self.old_month, 6),
+        ])
+        cache.clear()
+        self.assertEqual(period_ranking(*self.month_range()), before)
+
+        # もう一度実行しても変わらない
+        call_command("compact_point_buckets", stdout=io.StringIO())
+        self.assertEqual(len(self.rows()), 3)
+
+    def test_late_changes_after_compaction(self):
+        call_command("compact_point_buckets", stdout=io.StringIO())
+        # 取り消しは月ごとの行から引く。あとから入った日ごとの行は次のまとめで足す
+        update_point_buckets({(self.alice.id, self.old_days[1]): -2}, create_missing=False)
+        update_point_buckets({(self.bob.id, self.old_days[0]): 4})
+        call_command("compact_point_buckets", stdout=io.StringIO())
+        self.assertEqual(self.rows(), [
+            ("alice", PointBucket.DAY, self.recent_day, 1),
+            ("alice", PointBucket.MONTH, self.old_month, 3),
+            ("bob", PointBucket.MONTH, self.old_month, 10),
+        ])
@@ -35,6 +35,9 @@ urlpatterns = [
     path('api/friends/<int:user_id>/follow/', views.follow_user_api, name='api_follow_user'),
     path('api/friends/<int:user_id>/unfollow/', views.unfollow_user_api, name='api_unfollow_user'),
     path('api/friends/following/', views.get_following_users, name='api_get_following'),
+    path('api/friends/following/check/', views.check_following, name='api_check_following'),
+    path('api/friends/suggestions/', views.friend_suggestions, name='api_friend_suggestions'),
+    path('api/friends/suggestions/mutual/', views.mutual_friend_suggestions, name='api_mutual_friend_suggestions'),
     
     # ============================================
     # 予想機能API
@@ -49,6 +52,7 @@ urlpatterns = [
     # 予想（GETとPOSTを別々にする）
     # ✅ 追加するコード
     path('api/predictions/', views.predictions_api, name='api_predictions'),
+    path('api/predictions/bulk/', views.predictions_bulk_api, name='api_predictions_bulk'),
     path('api/predictions/<int:prediction_id>/', views.prediction_detail_api, name='api_prediction_detail'),    
     ]
 
@@ -0,0 +1,136 @@
+"""
+ユーザー検索（/api/friends/search/、フレンド一覧の検索）
+
+username / email の部分一致を毎回全件なめないよう、索引を使って検索する。
+
+- SQLite: FTS5 の trigram 索引（prediction_usersearch）。User の保存・削除の
+  シグナルで同期する（prediction/signals.py）
+- PostgreSQL: pg_trgm の GIN 索引を auth_user に直接張る（同期は不要）
+- 並び順: ユーザー名の前方一致 → 部分一致 → 似ている順（typo もある程度拾う）
+- 3文字未満の語は trigram が作れないので、ユーザー名・メールアドレスの前方一致
+  （大文字・小文字は区別しない。LOWER(...) の索引を使う）
+- フォロー中かどうか（is_followed）はフォロー先のキャッシュ（prediction/follow_cache.py）で付ける
+"""
+
+from django.db import connection
+
+from .follow_cache import contains, following_ids
+
+SEARCH_TABLE = "prediction_usersearch"
+# trigram の索引は3文字から。それより短い語はユーザー名・メールアドレスの前方一致だけ
+MIN_TRIGRAM_LENGTH = 3
+
+COLUMNS = ("id", "username", "email")
+
+
+def uses_fts():
+    return connection.vendor == "sqlite"
+
+
+def uses_trigram():
+    return connection.vendor == "postgresql"
+
+
+def _like_escape(value):
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _lower_column(column):
+    """短い語の前方一致に使う式（索引の式と同じ形）"""
+    if uses_trigram():
+        return f'(LOWER({column}) COLLATE "C")'
+    return f"LOWER({column})"
+
+
+def _fts_query(query):
+    """語の trigram を OR でつないだ FTS5 のクエリ（部分一致と、似ている語の両方に当たる）"""
+    query = query.lower()
+    trigrams = dict.fromkeys(query[i:i + 3] for i in range(len(query) - 2))
+    return " OR ".join('"{}"'.format(trigram.replace('"', '""')) for trigram in trigrams)
+
+
+def index_user(user):
+    """SQLite の検索索引に User を追加・更新する"""
+    if not uses_fts():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [user.pk])
+        cursor.execute(
+            f"INSERT INTO {SEARCH_TABLE} (rowid, username, email) VALUES (%s, %s, %s)",
+            [user.pk, user.username, user.email or ""],
+        )
+
+
+def unindex_user(user_id):
+    if not uses_fts():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [user_id])
+
+
+def search_users(viewer, query, limit=20):
+    """
+    viewer 以外の有効なユーザーを query で検索する（1クエリ。フォロー先はキャッシュから）
+
+    戻り値: [{"id", "username", "email", "is_followed"}, ...]
+    """
+    query = query.strip()
+    if not query:
+        return []
+
+    prefix = _like_escape(query) + "%"
+    substring = "%" + _like_escape(query) + "%"
+
+    if len(query) < MIN_TRIGRAM_LENGTH:
+        # 短い語はユーザー名・メールアドレスの前方一致（大文字・小文字は区別しない）。
+        # LOWER(...) の索引（migrations/0029）の範囲検索で、ユーザー名に当たったものが先
+        username, email = _lower_column("u.username"), _lower_column("u.email")
+        sql = (
+            "SELECT u.id, u.username, u.email FROM auth_user u"
+            f" WHERE (({username} >= LOWER(%s) AND {username} < LOWER(%s))"
+            f" OR ({email} >= LOWER(%s) AND {email} < LOWER(%s)))"
+            " AND u.id <> %s AND u.is_active"
+            f" ORDER BY ({username} >= LOWER(%s) AND {username} < LOWER(%s)) DESC, u.username"
+            " LIMIT %s"
+        )
+        bounds = [query, query + "\U0010ffff"]
+        params = [*bounds, *bounds, viewer.id, *bounds, limit]
+    elif uses_fts():
+        sql = (
+            "SELECT u.id, u.username, u.email"
+            f" FROM {SEARCH_TABLE} s JOIN auth_user u ON u.id = s.rowid"
+            f" WHERE {SEARCH_TABLE} MATCH %s AND u.id <> %s AND u.is_active"
+            " ORDER BY u.username LIKE %s ESCAPE '\\' DESC,"
+            " u.username LIKE %s ESCAPE '\\' DESC,"
+            f" bm25({SEARCH_TABLE}, 10.0, 1.0), u.id"
+            " LIMIT %s"
+        )
+        params = [_fts_query(query), viewer.id, prefix, substring, limit]
+    elif uses_trigram():
+        # ILIKE と % 演算子（類似度が pg_trgm.similarity_threshold 以上）は GIN 索引を使える
+        sql = (
+            "SELECT u.id, u.username, u.email FROM auth_user u"
+            " WHERE (u.username ILIKE %s OR u.email ILIKE %s OR u.username %% %s)"
+            " AND u.id <> %s AND u.is_active"
+            " ORDER BY u.username ILIKE %s DESC, u.username ILIKE %s DESC,"
+            " similarity(u.username, %s) DESC, u.id"
+            " LIMIT %s"
+        )
+        params = [
+            substring, substring, query,
+            viewer.id, prefix, substring, query, limit,
+        ]
+    else:
+        sql = (
+            "SELECT u.id, u.username, u.email FROM auth_user u"
+            " WHERE (LOWER(u.username) LIKE LOWER(%s) OR LOWER(u.email) LIKE LOWER(%s))"
+            " AND u.id <> %s AND u.is_active"
+            " ORDER BY u.username LIMIT %s"
+        )
+        params = [substring, substring, viewer.id, limit]
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    followed = following_ids(viewer.id)
+    return [{**dict(zip(COLUMNS, row)), "is_followed": contains(followed, row[0])} for row in rows]
@@ -1,15 +1,20 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.http import JsonResponse, HttpResponseForbidden
 from django.contrib.auth.decorators import login_required
-from .models import Prediction, Horse, Race, Follow, PredictionGroup, GroupMessage, GroupPrediction, RaceResult, UserPoint
+from .models import Prediction, Horse, Race, Follow, PredictionGroup, GroupMessage, GroupPrediction, RaceResult, SimilarUser, UserPoint
 from django.contrib import messages
 from django.contrib.auth.models import User, Group
 from django.contrib.auth import login
 from .forms import SignUpForm, GroupMessageForm, SelectMyPredictionForm, UserProfileForm, PredictionForm, UserProfileForm
 from .utils import evaluate_predictions
+from .consensus import race_consensus
+from .follow_cache import following_ids, is_following
+from .follow_graph import get_graph
+from .group_standings import group_ranking
+from .membership import groups_with_activity, is_member, mark_read
+from .user_search import search_users as find_users
 from django.contrib.admin.views.decorators import staff_member_required
-
-from django.db.models import Q
+from django.core.paginator import Paginator
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 
@@ -250,7 +255,9 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.authtoken.models import Token
 from rest_framework.response import Response
 from rest_framework import status
+from django.conf import settings
 from django.contrib.auth import authenticate
+from .submissions import IDEMPOTENCY_KEY_MAX_LENGTH, submit_predictions, validate_picks
 from django.contrib.auth.models import User
 
 # ============================================
@@ -378,46 +385,60 @@ def predictions_api(request):
         return Response(data)
     
     elif request.method == 'POST':
-        race_id = request.data.get('race')
-        first_position_id = request.data.get('first_position')
-        second_position_id = request.data.get('second_position')
-        third_position_id = request.data.get('third_position')
-        
-        if not all([race_id, first_position_id, second_position_id, third_position_id]):
-            return Response(
-                {'error': 'すべてのフィールドを入力してください'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        try:
-            race = Race.objects.get(id=race_id)
-            first_position = Horse.objects.get(id=first_position_id)
-            second_position = Horse.objects.get(id=second_position_id)
-            third_position = Horse.objects.get(id=third_position_id)
-            
-            if len({first_position_id, second_position_id, third_position_id}) != 3:
-                return Response(
-                    {'error': '同じ馬を複数回選択できません'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            prediction = Prediction.objects.create(
-                user=request.user,
-                race=race,
-                first_position=first_position,
-                second_position=second_position,
-                third_position=third_position,
-            )
-            
-            return Response({
-                'id': prediction.id,
-                'message': '予想を投稿しました',
-            }, status=status.HTTP_201_CREATED)
-            
-        except Race.DoesNotExist:
-            return Response({'error': 'レースが見つかりません'}, status=status.HTTP_404_NOT_FOUND)
-        except Horse.DoesNotExist:
-            return Response({'error': '馬が見つかりません'}, status=status.HTTP_404_NOT_FOUND)
+        # 出走馬のチェックまで1クエリ
+        valid, errors = validate_picks([request.data])
+        if errors:
+            return Response({'error': errors[0]}, status=status.HTTP_400_BAD_REQUEST)
+
+        _, race_id, (first_id, second_id, third_id), comment = valid[0]
+        prediction = Prediction.objects.create(
+            user=request.user,
+            race_id=race_id,
+            first_position_id=first_id,
+            second_position_id=second_id,
+            third_position_id=third_id,
+            comment=comment,
+        )
+
+        return Response({
+            'id': prediction.id,
+            'message': '予想を投稿しました',
+        }, status=status.HTTP_201_CREATED)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def predictions_bulk_api(request):
+    """
+    開催まるごとの予想を一括投稿
+    POST /api/predictions/bulk/
+    {"predictions": [{"race": 1, "first_position": 3, "second_position": 5, "third_position": 7}, ...]}
+
+    通った予想だけ登録し、結果は1件ずつ返す（全件成功: 201 / 一部失敗: 207 / 全件失敗: 400）。
+    Idempotency-Key ヘッダーを付けると、同じキーの再送には最初のレスポンスを返す
+    （同じキーで中身が違えば 422。キーは64文字まで、長すぎれば 400）。
+    """
+    items = request.data.get('predictions') if isinstance(request.data, dict) else None
+    if not isinstance(items, list) or not items:
+        return Response(
+            {'error': 'predictions に予想のリストを指定してください'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if len(items) > settings.PREDICTION_BATCH_MAX_SIZE:
+        return Response(
+            {'error': f'一度に投稿できる予想は{settings.PREDICTION_BATCH_MAX_SIZE}件までです'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    idempotency_key = request.headers.get('Idempotency-Key', '').strip() or None
+    if idempotency_key and len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        # 切り詰めると先頭が同じ別のキーと混ざるので受け付けない
+        return Response(
+            {'error': f'Idempotency-Key は{IDEMPOTENCY_KEY_MAX_LENGTH}文字以内で指定してください'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    status_code, body = submit_predictions(request.user, items, idempotency_key)
+    return Response(body, status=status_code)
 
 
 @api_view(['DELETE'])
@@ -488,10 +509,20 @@ def get_horses_api(request):
 
 @login_required
 def user_list(request):
-    users = User.objects.exclude(id=request.user.id)
-    followed_users = request.user.following.values_list('followed_id', flat=True)
+    search_query = request.GET.get('search', '').strip()
+    if search_query:
+        users = find_users(request.user, search_query, limit=settings.USER_LIST_PAGE_SIZE)
+        return render(request, "user_list.html", {
+            "users": users,
+            "followed_users": {user['id'] for user in users if user['is_followed']},
+        })
+
+    users = User.objects.exclude(id=request.user.id).order_by('id')
+    page = Paginator(users, settings.USER_LIST_PAGE_SIZE).get_page(request.GET.get('page'))
+    followed_users = set(following_ids(request.user.id))
     return render(request, "user_list.html", {
-        "users": users,
+        "users": page,
+        "page_obj": page,
         "followed_users": followed_users,
     })
 
@@ -521,6 +552,8 @@ def search_users(request):
     """
     ユーザー検索API
     GET /api/friends/search/?search=query
+
+    ユーザー名・メールアドレスで検索（索引を使う。prediction/user_search.py）
     """
     search_query = request.GET.get('search', '').strip()
     
@@ -530,35 +563,13 @@ def search_users(request):
             'followed_users': []
         })
     
-    # メールアドレスまたはユーザー名で検索（部分一致）
-    users = User.objects.filter(
-        Q(email__icontains=search_query) | 
-        Q(username__icontains=search_query)
-    ).exclude(id=request.user.id)[:20]  # 最大20件
-    
-    # フォロー中のユーザーIDリスト
-    followed_user_ids = list(
-        request.user.following.values_list('followed_id', flat=True)
-    )
-    
-    # ユーザー情報を整形
-    users_data = []
-    for user in users:
-        # UserProfileからbioを取得（存在する場合）
-        bio = ""
-        if hasattr(user, 'userprofile'):
-            bio = user.userprofile.bio or ""
-        
-        users_data.append({
-            'id': user.id,
-            'username': user.username,
-            'email': user.email,
-            'bio': bio,
-        })
+    # フォロー中かどうかも同じクエリで取得（最大20件）
+    users_data = find_users(request.user, search_query, limit=20)
     
     return JsonResponse({
         'users': users_data,
-        'followed_users': followed_user_ids
+        # 互換のため。検索結果のうちフォロー中のユーザーだけ
+        'followed_users': [user['id'] for user in users_data if user['is_followed']]
     })
 
 
@@ -622,12 +633,116 @@ def get_following_users(request):
     フォロー中のユーザーIDリストを取得
     GET /api/friends/following/
     """
-    followed_user_ids = list(
-        request.user.following.values_list('followed_id', flat=True)
+    return JsonResponse({
+        'followed_users': list(following_ids(request.user.id))
+    })
+
+
+@api_view(['GET'])
+@login_required
+def check_following(request):
+    """
+    複数のユーザーをまとめてフォロー中か調べる
+    GET /api/friends/following/check/?ids=1,2,3
+
+    戻り値: {"following": {"1": true, "2": false, ...}}
+    """
+    try:
+        user_ids = [int(value) for value in request.GET.get('ids', '').split(',') if value.strip()]
+    except ValueError:
+        return JsonResponse({'error': 'ids はカンマ区切りのユーザーIDで指定してください'}, status=400)
+    if len(user_ids) > settings.FOLLOW_CHECK_MAX_IDS:
+        return JsonResponse(
+            {'error': f'一度に調べられるのは{settings.FOLLOW_CHECK_MAX_IDS}人までです'}, status=400
+        )
+
+    return JsonResponse({
+        'following': {str(user_id): followed for user_id, followed in is_following(request.user.id, user_ids).items()}
+    })
+
+
+@api_view(['GET'])
+@login_required
+def friend_suggestions(request):
+    """
+    予想が似ているユーザー（まだフォローしていない人）
+    GET /api/friends/suggestions/?limit=20
+
+    夜間に計算した SimilarUser を読むだけ（manage.py build_similarity_index）
+    """
+    try:
+        limit = min(max(int(request.GET.get('limit', 20)), 1), settings.SIMILAR_USERS_PER_USER)
+    except ValueError:
+        return JsonResponse({'error': 'limit は整数で指定してください'}, status=400)
+
+    suggestions = (
+        SimilarUser.objects.filter(user=request.user, similar_user__is_active=True)
+        .exclude(similar_user__followers__follower=request.user)
+        .select_related('similar_user__userprofile')
+        .order_by('-score', 'similar_user_id')[:limit]
     )
-    
+
+    users_data = []
+    for suggestion in suggestions:
+        user = suggestion.similar_user
+        profile = getattr(user, 'userprofile', None)
+        users_data.append({
+            'id': user.id,
+            'username': user.username,
+            'profile_image_url': (
+                request.build_absolute_uri(profile.profile_image.url)
+                if profile and profile.profile_image else None
+            ),
+            'similarity': suggestion.score,
+            'common_picks': suggestion.common_picks,
+        })
+
+    return JsonResponse({'users': users_data})
+
+
+@api_view(['GET'])
+@login_required
+def mutual_friend_suggestions(request):
+    """
+    友達の友達（フォローしている人がフォローしている、まだフォローしていない人）
+    GET /api/friends/suggestions/mutual/?page=1
+
+    共通のフォローの多い順。計算はメモリ上のフォローグラフで行う
+    """
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        return JsonResponse({'error': 'page は整数で指定してください'}, status=400)
+    page_size = settings.FRIEND_SUGGESTIONS_PAGE_SIZE
+
+    user_ids, mutual_counts = get_graph().suggestions(request.user.id)
+    start = (page - 1) * page_size
+    page_ids = user_ids[start:start + page_size].tolist()
+    counts = dict(zip(page_ids, mutual_counts[start:start + page_size].tolist()))
+
+    users = User.objects.filter(id__in=page_ids, is_active=True).select_related('userprofile')
+    users_by_id = {user.id: user for user in users}
+    users_data = []
+    for user_id in page_ids:
+        user = users_by_id.get(user_id)
+        if user is None:
+            continue
+        profile = getattr(user, 'userprofile', None)
+        users_data.append({
+            'id': user.id,
+            'username': user.username,
+            'profile_image_url': (
+                request.build_absolute_uri(profile.profile_image.url)
+                if profile and profile.profile_image else None
+            ),
+            'mutual_count': counts[user_id],
+        })
+
     return JsonResponse({
-        'followed_users': followed_user_ids
+        'users': users_data,
+        'page': page,
+        'total': len(user_ids),
+        'has_next': start + page_size < len(user_ids),
     })
 
 @login_required
@@ -635,9 +750,7 @@ def timeline(request):
     selected_race_id = request.GET.get("race_id")
 
     # フォロー中のユーザーと自分自身を対象にする
-    following_users = list(
-        request.user.following.values_list("followed", flat=True)
-    ) + [request.user.id]
+    following_users = list(following_ids(request.user.id)) + [request.user.id]
 
     predictions = Prediction.objects.filter(user__id__in=following_users)
 
@@ -655,6 +768,8 @@ def timeline(request):
             "predictions": predictions,
             "races": races,
             "selected_race_id": int(selected_race_id) if selected_race_id else None,
+            # レースで絞り込んだときは、みんなの予想も表示する
+            "consensus": race_consensus(int(selected_race_id)) if selected_race_id else None,
         },
     )
 
@@ -686,13 +801,16 @@ def profile(request):
 
 @login_required
 def group_list(request):
-    groups = request.user.prediction_groups.all()
+    # メンバー数・未読数・最新のメッセージ付き（1クエリ）
+    groups = groups_with_activity(request.user)
     return render(request, 'grouplist.html', {'groups': groups})
 
 @login_required
 def create_group(request):
     user = request.user
-    following_users = User.objects.filter(followers__follower=user).exclude(id=user.id)
+    following_users = User.objects.filter(
+        id__in=list(following_ids(user.id))
+    ).exclude(id=user.id).order_by('username')
 
     if request.method == "POST":
         group_name = request.POST.get("name")
@@ -716,6 +834,8 @@ def create_group(request):
 @login_required
 def group_detail(request, group_id):
     group = get_object_or_404(PredictionGroup, id=group_id)
+    if not is_member(request.user.id, group.id):
+        return HttpResponseForbidden("グループメンバーのみ閲覧できます。")
 
     if request.method == "POST":
         if 'share_prediction' in request.POST:
@@ -756,11 +876,13 @@ def group_detail(request, group_id):
     message_form = GroupMessageForm()
     messages_list = GroupMessage.objects.filter(group=group).order_by('-timestamp')
     predictions = GroupPrediction.objects.filter(group=group).order_by('-submitted_at')
+    mark_read(request.user, group.id)
 
     return render(request, 'group_detail.html', {
         'group': group,
         'messages': messages_list,
         'predictions': predictions,
+        'standings': group_ranking(group.id),
         'share_form': share_form,
         'message_form': message_form,
     })
@@ -794,6 +916,35 @@ def evaluate_race(request, race_id):
     messages.success(request, f"{race.name} の答え合わせを実行しました。")
     return redirect('race_list')  # 適切なURLに戻す
 
+def _evaluated_results(user):
+    """結果が出ているレースの予想と得点（テンプレート表示用）"""
+    predictions = list(
+        Prediction.objects.filter(user=user, race__raceresult__isnull=False).select_related(
+            'race',
+            'race__raceresult__first_place',
+            'race__raceresult__second_place',
+            'race__raceresult__third_place',
+            'first_position',
+            'second_position',
+            'third_position',
+        )
+    )
+    evaluated_results = []
+    for pred in predictions:
+        result = pred.race.raceresult
+        evaluated_results.append({
+            'race_name': pred.race.name,
+            'predicted_1': pred.first_position.name if pred.first_position else "―",
+            'predicted_2': pred.second_position.name if pred.second_position else "―",
+            'predicted_3': pred.third_position.name if pred.third_position else "―",
+            'actual_1': result.first_place.name if result.first_place else "―",
+            'actual_2': result.second_place.name if result.second_place else "―",
+            'actual_3': result.third_place.name if result.third_place else "―",
+            'score': pred.score,
+        })
+    return evaluated_results
+
+
 @login_required
 def profile_and_points_view(request):
     user = request.user
@@ -807,37 +958,11 @@ def profile_and_points_view(request):
     else:
         form = UserProfileForm(instance=profile)
 
-    # ユーザーの予想と結果を照合してポイントを再計算
-    predictions = Prediction.objects.filter(user=user).select_related('race')
-    total_score = 0
-    evaluated_results = []
+    # ユーザーの予想と結果を照合
+    evaluated_results = _evaluated_results(user)
 
-    for pred in predictions:
-        result = RaceResult.objects.filter(race=pred.race).first()
-        if result:
-            score = 0
-            if pred.first_position == result.first_place:
-                score += 3
-            if pred.second_position == result.second_place:
-                score += 2
-            if pred.third_position == result.third_place:
-                score += 1
-            total_score += score
-            evaluated_results.append({
-                'race_name': pred.race.name,
-                'predicted_1': pred.first_position.name if pred.first_position else "―",
-                'predicted_2': pred.second_position.name if pred.second_position else "―",
-                'predicted_3': pred.third_position.name if pred.third_position else "―",
-                'actual_1': result.first_place.name if result.first_place else "―",
-                'actual_2': result.second_place.name if result.second_place else "―",
-                'actual_3': result.third_place.name if result.third_place else "―",
-                'score': score,
-            })
-
-    # ポイントを最新に保存
-    user_point, _ = UserPoint.objects.get_or_create(user=user)
-    user_point.points = total_score
-    user_point.save()
+    # ポイントは採点時（prediction/scoring.py）に更新済み。表示のたびに書き込まない
+    user_point = UserPoint.objects.filter(user=user).first() or UserPoint(user=user)
 
     context = {
         'form': form,
@@ -850,38 +975,10 @@ def profile_and_points_view(request):
 @login_required
 def result_list_view(request):
     user = request.user
-    predictions = Prediction.objects.filter(user=user).select_related('race')
-    evaluated_results = []
+    evaluated_results = _evaluated_results(user)
 
-    total_score = 0  # ← これを加えて点数合計も反映
-    for pred in predictions:
-        result = RaceResult.objects.filter(race=pred.race).first()
-        if result:
-            score = 0
-            if pred.first_position == result.first_place:
-                score += 3
-            if pred.second_position == result.second_place:
-                score += 2
-            if pred.third_position == result.third_place:
-                score += 1
-
-            total_score += score
-
-            evaluated_results.append({
-                'race_name': pred.race.name,
-                'predicted_1': pred.first_position.name if pred.first_position else "―",
-                'predicted_2': pred.second_position.name if pred.second_position else "―",
-                'predicted_3': pred.third_position.name if pred.third_position else "―",
-                'actual_1': result.first_place.name if result.first_place else "―",
-                'actual_2': result.second_place.name if result.second_place else "―",
-                'actual_3': result.third_place.name if result.third_place else "―",
-                'score': score,
-            })
-
-    # ← ポイント保存（optionalだけど揃えるなら入れる）
-    user_point, _ = UserPoint.objects.get_or_create(user=user)
-    user_point.points = total_score
-    user_point.save()
+    # ポイントは採点時（prediction/scoring.py）に更新済み。表示のたびに書き込まない
+    user_point = UserPoint.objects.filter(user=user).first() or UserPoint(user=user)
 
     return render(request, 'result_list.html', {
         'evaluated_results': evaluated_results,